@@ -7,8 +7,8 @@ except ImportError:
     pass
 
 from math import trunc
-from mini_lambda.base import _LambdaExpressionBase, evaluate, get_repr, FunctionDefinitionError, \
-    _get_root_var
+from mini_lambda.base import _LambdaExpressionBase, FunctionDefinitionError, \
+    _get_root_var, ExpressionNode, NODE_CALL, NODE_METHOD_CALL, _unary_op_node, _binary_op_node, _make_call_function
 from mini_lambda.base import _PRECEDENCE_ADD_SUB, _PRECEDENCE_MUL_DIV_ETC, _PRECEDENCE_COMPARISON, \
     _PRECEDENCE_EXPONENTIATION, _PRECEDENCE_SHIFTS, _PRECEDENCE_POS_NEG_BITWISE_NOT, \
     _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF
@@ -41,15 +41,14 @@ class _LambdaExpressionGenerated(_LambdaExpressionBase):
         ## def _${o.method_name}(r, input):
         ##     return ${o.uni_operator}r
         ## return self.add_unbound_method_to_stack(_${o.method_name})
+        self_fun = self._fun
         def _${o.method_name}(input):
-            # first evaluate the inner function
-            res = self.evaluate(input)
-            # then call the method
-            return ${o.uni_operator}res
+            return ${o.uni_operator}self_fun(input)
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        string_expr = '${o.uni_operator}' + get_repr(self, ${o.precedence_level})
-        return type(self)(fun=_${o.method_name}, precedence_level=${o.precedence_level}, str_expr=string_expr, root_var=self._root_var, repr_on=self.repr_on)
+        node = _unary_op_node('${o.uni_operator}', self)
+        return type(self)(fun=_${o.method_name}, precedence_level=${o.precedence_level}, root_var=self._root_var,
+                          repr_on=self.repr_on, node=node)
 
     ## -----------------------------
         % elif o.pair_operator:
@@ -61,16 +60,20 @@ class _LambdaExpressionGenerated(_LambdaExpressionBase):
         ##    return r ${o.pair_operator} evaluate(other, input)
         ## return self.add_unbound_method_to_stack(_${o.method_name})
         root_var, _ = _get_root_var(self, other)
-        def _${o.method_name}(input):
-            # first evaluate the inner function
-            r = self.evaluate(input)
-            # then call the method
-            return r ${o.pair_operator} evaluate(other, input)
+        # the inner functions are called directly, and a constant operand is used as is
+        self_fun = self._fun
+        if isinstance(other, _LambdaExpressionBase):
+            other_fun = other._fun
+            def _${o.method_name}(input):
+                return self_fun(input) ${o.pair_operator} other_fun(input)
+        else:
+            def _${o.method_name}(input):
+                return self_fun(input) ${o.pair_operator} other
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        string_expr = get_repr(self, ${o.precedence_level}) + ' ${o.pair_operator} ' + get_repr(other, ${o.precedence_level})
-        return type(self)(fun=_${o.method_name}, precedence_level=${o.precedence_level}, str_expr=string_expr,
-                          root_var=root_var, repr_on=self.repr_on)
+        node = _binary_op_node('${o.pair_operator}', self, other)
+        return type(self)(fun=_${o.method_name}, precedence_level=${o.precedence_level},
+                          root_var=root_var, repr_on=self.repr_on, node=node)
 
     ## -----------------------------
             % else:
@@ -81,16 +84,20 @@ class _LambdaExpressionGenerated(_LambdaExpressionBase):
         ##     return evaluate(other, input) ${o.pair_operator} r
         ## return self.add_unbound_method_to_stack(_${o.method_name})
         root_var, _ = _get_root_var(self, other)
-        def _${o.method_name}(input):
-            # first evaluate the inner function
-            r = self.evaluate(input)
-            # then call the method
-            return evaluate(other, input) ${o.pair_operator} r
+        # the inner functions are called directly, and a constant operand is used as is
+        self_fun = self._fun
+        if isinstance(other, _LambdaExpressionBase):
+            other_fun = other._fun
+            def _${o.method_name}(input):
+                return other_fun(input) ${o.pair_operator} self_fun(input)
+        else:
+            def _${o.method_name}(input):
+                return other ${o.pair_operator} self_fun(input)
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        string_expr = get_repr(other, ${o.precedence_level}) + ' ${o.pair_operator} ' + get_repr(self, ${o.precedence_level})
-        return type(self)(fun=_${o.method_name}, precedence_level=${o.precedence_level}, str_expr=string_expr,
-                          root_var=root_var, repr_on=self.repr_on)
+        node = _binary_op_node('${o.pair_operator}', other, self)
+        return type(self)(fun=_${o.method_name}, precedence_level=${o.precedence_level},
+                          root_var=root_var, repr_on=self.repr_on, node=node)
 
     ## -----------------------------
             % endif
@@ -102,22 +109,14 @@ class _LambdaExpressionGenerated(_LambdaExpressionBase):
         ##     return ${o.unbound_method.__name__}(r, input, *args, **kwargs)
         ## return self.add_unbound_method_to_stack(_${o.method_name}, *args, **kwargs)
         root_var, _ = _get_root_var(self, *args, **kwargs)
-        def _${o.method_name}(input):
-            # first evaluate the inner function
-            r = self.evaluate(input)
-            # then call the method
-            return ${o.unbound_method.__name__}(r, *[evaluate(other, input) for other in args],
-                                                **{arg_name: evaluate(other, input) for arg_name, other in kwargs.items()})
+        # first evaluate the inner function, then call the method
+        _${o.method_name} = _make_call_function(${o.unbound_method.__name__}, (self,) + args, kwargs)
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        # Note: we use precedence=None for coma-separated items inside the parenthesis
-        string_expr = ('${o.unbound_method.__name__}(' + get_repr(self, None)
-                       + (', ' if (len(args) > 0 and len(kwargs) > 0) else '')
-                       + ', '.join([get_repr(arg, None) for arg in args])
-                       + ', '.join([arg_name + '=' + get_repr(arg, None) for arg_name, arg in kwargs.items()])
-                       + ')')
+        node = ExpressionNode(NODE_CALL, '${o.unbound_method.__name__}', (self,) + args, tuple(kwargs.items()),
+                              method=${o.unbound_method.__name__})
         return type(self)(fun=_${o.method_name}, precedence_level=_PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF,
-                          str_expr=string_expr, root_var=root_var, repr_on=self.repr_on)
+                          root_var=root_var, repr_on=self.repr_on, node=node)
 
     ## -----------------------------
         % else:
@@ -126,22 +125,13 @@ class _LambdaExpressionGenerated(_LambdaExpressionBase):
         """ Returns a new LambdaExpression performing '<r>.${o.method_name}(*args, **kwargs)' on the result <r> of this evaluator's evaluation """
         # return self.add_bound_method_to_stack('${o.method_name}', *args, **kwargs)
         root_var, _ = _get_root_var(self, *args, **kwargs)
-        def _${o.method_name}(input):
-            # first evaluate the inner function
-            r = self.evaluate(input)
-            # then call the method
-            return r.${o.method_name}(*[evaluate(other, input) for other in args],
-                                      **{arg_name: evaluate(other, input) for arg_name, other in kwargs.items()})
+        # first evaluate the inner function, then call the method
+        _${o.method_name} = _make_call_function(None, (self,) + args, kwargs, method_name='${o.method_name}')
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        # Note: we use precedence=None for coma-separated items inside the parenthesis
-        string_expr = get_repr(self, _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF) + '.${o.method_name}(' \
-                      + ', '.join([get_repr(arg, None) for arg in args]) \
-                      + (', ' if (len(args) > 0 and len(kwargs) > 0) else '') \
-                      + ', '.join([arg_name + '=' + get_repr(arg, None) for arg_name, arg in kwargs.items()]) \
-                      + ')'
+        node = ExpressionNode(NODE_METHOD_CALL, '${o.method_name}', (self,) + args, tuple(kwargs.items()))
         return type(self)(fun=_${o.method_name}, precedence_level=_PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF,
-                          str_expr=string_expr, root_var=root_var, repr_on=self.repr_on)
+                          root_var=root_var, repr_on=self.repr_on, node=node)
 
     ## -----------------------------
         % endif
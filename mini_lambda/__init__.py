@@ -1,10 +1,17 @@
-from mini_lambda.base import FunctionDefinitionError, evaluate, get_repr
+from mini_lambda.base import FunctionDefinitionError, evaluate, get_repr, ExpressionNode, set_constant_folding, \
+    mark_impure, set_interning
+from mini_lambda.compiler import compile_expression
+from mini_lambda.cache import compile_cache_info, clear_compile_cache, set_compile_cache_size
+from mini_lambda.nodes import get_node, walk, NodeVisitor, NodeTransformer, fold_constants, fingerprint, \
+    structurally_equal, StructuralKey, fuse_comparisons
+from mini_lambda.simplifier import simplify
 
 # this one only exports one private class, no need
 # from mini_lambda.generated_magic import *
 
-from mini_lambda.main import _, L, F, C, Not, And, Or, Format, Get, In, Slice, InputVar, Constant, \
-    make_lambda_friendly, make_lambda_friendly_method, make_lambda_friendly_class, as_function, is_mini_lambda_expr
+from mini_lambda.main import _, L, F, C, Not, And, Or, All_, Any_, Sum_, Prod_, AllOf, AnyOf, IfElse, Where, Between, \
+    Format, Get, In, Slice, InputVar, Constant, make_lambda_friendly, make_lambda_friendly_method, \
+    make_lambda_friendly_class, as_function, is_mini_lambda_expr
 
 try:
     # Distribution mode : import from _version.py generated by setuptools_scm during release
@@ -19,12 +26,19 @@ except ImportError:
 __all__ = [
     '__version__',
     # submodules
-    'base', 'generated_magic_replacements', 'main', 'symbols', 'vars',  # generated_magic
+    'base', 'cache', 'compiler', 'evaluator', 'generated_magic_replacements', 'main', 'nodes', 'simplifier', 'symbols',
+    'vars',  # generated_magic
     # symbols
-    'FunctionDefinitionError', 'evaluate', 'get_repr',
+    'FunctionDefinitionError', 'evaluate', 'get_repr', 'compile_expression', 'compile_cache_info',
+    'clear_compile_cache', 'set_compile_cache_size',
+    'ExpressionNode', 'get_node', 'walk', 'NodeVisitor', 'NodeTransformer',
+    'set_constant_folding', 'fold_constants', 'mark_impure', 'set_interning', 'fingerprint', 'structurally_equal',
+    'StructuralKey',
+    'fuse_comparisons', 'simplify',
     '_', 'L', 'F', 'C', 'InputVar', 'Constant', 'make_lambda_friendly', 'make_lambda_friendly_method',
     'make_lambda_friendly_class', 'as_function', 'is_mini_lambda_expr',
-    'Not', 'And', 'Or', 'Format', 'Get', 'In', 'Slice',
+    'Not', 'And', 'Or', 'All_', 'Any_', 'Sum_', 'Prod_', 'AllOf', 'AnyOf', 'IfElse', 'Where', 'Between', 'Format',
+    'Get', 'In', 'Slice',
 ]
 
 # for these two ones we can, there is a `__all__` inside
@@ -0,0 +1,67 @@
+"""
+Helpers shared by the simplifier (`mini_lambda.simplifier`) and the backends evaluating lambda expressions on whole
+arrays: numpy (`mini_lambda.batch`), numexpr (`mini_lambda.numexpr_backend`) and pandas queries
+(`mini_lambda.pandas_eval`).
+
+This module does not require numpy, so that expressions can be translated to pandas queries without it.
+"""
+import math
+
+from mini_lambda.base import _LambdaExpressionBase, NODE_CONSTANT, NODE_CALL
+from mini_lambda.main import _not
+
+
+def _is_constant(operand):
+    """ Returns True if operand is a constant, used as is or through a constant expression """
+    return not isinstance(operand, _LambdaExpressionBase) \
+        or (operand._node is not None and operand._node.kind == NODE_CONSTANT)
+
+
+def _constant_value(operand):
+    """ Returns the value of a constant operand """
+    return operand._node.args[0] if isinstance(operand, _LambdaExpressionBase) else operand
+
+
+def _is_not(node):
+    """ Returns True if node is the call of Not (see LambdaExpression.not_) """
+    return node.kind == NODE_CALL and node.method is _not
+
+
+def _get_callee(node):
+    """ Returns the function called by a call node, and its arguments. The function is None if it is a method called
+    by name, or the result of a sub-expression. """
+    if node.kind == NODE_CALL:
+        return node.method, node.args
+    elif node.symbol == '__call__' and _is_constant(node.args[0]):
+        return _constant_value(node.args[0]), node.args[1:]
+    return None, node.args
+
+
+def _literal(value, strings=False):
+    # type: (...) -> str
+    """ Returns the code of a constant boolean or finite number (and of a string or None if `strings` is True) in the
+    code evaluated by numexpr or pandas, or raises a ValueError """
+    if isinstance(value, (bool, int)) or (isinstance(value, float) and not (math.isinf(value) or math.isnan(value))):
+        return repr(value)
+    elif strings and (value is None or isinstance(value, str)):
+        return repr(value)
+    raise ValueError('constant %r can not be used in the generated code' % (value, ))
+
+
+def _is_negative(value):
+    """ Returns True if value is a negative number, whose code needs to be parenthesized when used as an operand """
+    return isinstance(value, (int, float)) and value < 0
+
+
+def _is_array_exponent(exponent):
+    # type: (...) -> bool
+    """
+    Returns True if exponent is a constant (or a constant expression) that is a positive integer or a float. numpy
+    raises an error, and numexpr and pandas queries return 0, for the negative integer powers of integer arrays, while
+    python returns floats: only these exponents can be used as is.
+    """
+    if not _is_constant(exponent):
+        return False
+    exponent = _constant_value(exponent)
+    return not isinstance(exponent, bool) and (isinstance(exponent, float)
+                                               or (isinstance(exponent, int) and exponent >= 0))
@@ -1,7 +1,15 @@
 from inspect import isclass
+import math
+import operator
+from weakref import WeakValueDictionary
+
+try:  # python 3
+    import builtins
+except ImportError:  # python 2
+    import __builtin__ as builtins
 
 try:  # python 3.5+
-    from typing import Callable, Any, Tuple, Union, TypeVar
+    from typing import Callable, Any, Tuple, Union, TypeVar, Dict
     T = TypeVar('T')
 except ImportError:
     pass
@@ -30,12 +38,616 @@ _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF = 15
 _PRECEDENCE_BIND_TUP_DISPLAY = 16
 _PRECEDENCE_MAX = 17
 
+# the precedence level of each n-ary operation, see _get_expression_for_nary_op
+_NARY_PRECEDENCE_LEVELS = {'+': _PRECEDENCE_ADD_SUB, '*': _PRECEDENCE_MUL_DIV_ETC, '&': _PRECEDENCE_BITWISE_AND,
+                           '|': _PRECEDENCE_BITWISE_OR, 'fsum': _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF}
+
+# if True, expressions that only depend on constants are evaluated as soon as they are created, see set_constant_folding
+_CONSTANT_FOLDING = True
+
+# if True, creating an expression structurally identical to an existing one returns the existing one, see set_interning
+_INTERNING = False
+_INTERNED = WeakValueDictionary()
+
+# expressions deeper than this are evaluated iteratively (see evaluator.py) rather than through nested inner functions,
+# so that their evaluation does not reach the recursion limit. The nested inner functions are faster, and use at most 3
+# python frames per level: this keeps the evaluation of shallower expressions well under the default limit of 1000.
+_MAX_RECURSIVE_DEPTH = 200
+
+def _get_pure_callables():
+    """ Returns the functions of the math and operator modules and the builtins that only depend on their arguments """
+    callables = set(f for name, f in vars(math).items() if not name.startswith('_') and callable(f))
+    callables.update(getattr(operator, name) for name in (
+        'abs', 'add', 'and_', 'concat', 'contains', 'countOf', 'eq', 'floordiv', 'ge', 'getitem', 'gt', 'index',
+        'indexOf', 'inv', 'invert', 'is_', 'is_not', 'le', 'lshift', 'lt', 'matmul', 'mod', 'mul', 'ne', 'neg', 'not_',
+        'or_', 'pos', 'pow', 'rshift', 'sub', 'truediv', 'truth', 'xor', 'div') if hasattr(operator, name))
+    callables.update(getattr(builtins, name) for name in (
+        'abs', 'all', 'any', 'ascii', 'bin', 'bool', 'bytes', 'callable', 'chr', 'complex', 'dict', 'divmod', 'float',
+        'format', 'frozenset', 'getattr', 'hasattr', 'hash', 'hex', 'int', 'isinstance', 'issubclass', 'len', 'list',
+        'long', 'max', 'min', 'oct', 'ord', 'pow', 'repr', 'round', 'set', 'slice', 'sorted', 'str', 'sum', 'tuple',
+        'type', 'unicode') if hasattr(builtins, name))
+    return callables
+
+
+# the callables that constant folding may call when an expression is created, see _is_foldable
+_PURE_CALLABLES = _get_pure_callables()
+
+# the types of the values that constant folding may use: their operations do not call any user code
+_BUILTIN_MODULES = ('builtins', '__builtin__')
+
+# the functions and method names that should be called at each evaluation, see mark_impure
+_IMPURE_CALLABLES = set(f for f in (getattr(builtins, name, None) for name in ('print', 'input', 'raw_input', 'next',
+                                                                               'iter', 'open'))
+                        if f is not None)
+_IMPURE_METHOD_NAMES = {'append', 'extend', 'insert', 'pop', 'popitem', 'remove', 'clear', 'update', 'setdefault',
+                        'add', 'discard', 'sort', 'reverse', 'read', 'readline', 'readlines', 'write', 'writelines',
+                        'seek', 'send', 'throw', 'close', 'next', '__next__'}
+
+
+# the kinds of operations that an expression node may describe, see ExpressionNode
+NODE_VAR = 'var'
+NODE_CONSTANT = 'constant'
+NODE_UNARY_OP = 'unary_op'
+NODE_BINARY_OP = 'binary_op'
+NODE_LOGICAL_OP = 'logical_op'
+NODE_CALL = 'call'
+NODE_METHOD_CALL = 'method_call'
+NODE_GETATTR = 'getattr'
+NODE_GETITEM = 'getitem'
+NODE_BOOL_OP = 'bool_op'
+NODE_IF_ELSE = 'if_else'
+NODE_NARY_OP = 'nary_op'
+NODE_COMPARE_CHAIN = 'compare_chain'
+
+# the python functions corresponding to the operator symbols
+_UNARY_OPERATORS = {'-': operator.neg, '+': operator.pos, '~': operator.invert}
+_BINARY_OPERATORS = {'+': operator.add, '-': operator.sub, '*': operator.mul,
+                     '/': getattr(operator, 'div', operator.truediv),  # classic division in python 2
+                     '//': operator.floordiv, '%': operator.mod, '**': operator.pow,
+                     '<<': operator.lshift, '>>': operator.rshift,
+                     '<': operator.lt, '<=': operator.le, '==': operator.eq, '!=': operator.ne, '>': operator.gt,
+                     '>=': operator.ge}
+_COMPARISON_SYMBOLS = ('<', '<=', '==', '!=', '>', '>=')
+
+
+def _xor(left, right):
+    """ The logical xor used by the '^' operator of LambdaExpression """
+    return (left and not right) or (not left and right)
+
+
+def _sum_values(*values):
+    """ Returns values[0] + values[1] + ... in a single loop. Used by the n-ary '+' (Sum_) """
+    result = values[0]
+    for value in values[1:]:
+        result = result + value
+    return result
+
+
+def _prod_values(*values):
+    """ Returns values[0] * values[1] * ... in a single loop. Used by the n-ary '*' (Prod_) """
+    result = values[0]
+    for value in values[1:]:
+        result = result * value
+    return result
+
+
+def _fsum_values(*values):
+    """ Returns the accurate floating point sum of values. Used by Sum_(..., fsum=True) """
+    return math.fsum(values)
+
+
+def _all_values(*values):
+    """ Returns values[0] & values[1] & ... as the '&' operator of LambdaExpression would. Used by AllOf """
+    return all(values)
+
+
+def _any_values(*values):
+    """ Returns values[0] | values[1] | ... as the '|' operator of LambdaExpression would. Used by AnyOf """
+    return any(values)
+
+
+# the python functions corresponding to the n-ary operations. '&' and '|' are evaluated lazily (see AllOf, AnyOf)
+_NARY_OPERATORS = {'+': _sum_values, '*': _prod_values, 'fsum': _fsum_values, '&': _all_values, '|': _any_values}
+
 
 class FunctionDefinitionError(Exception):
     """ An exception thrown when defining a function incorrectly """
 
 
-class _LambdaExpressionBase(object):
+class ExpressionNode(tuple):
+    """
+    An immutable record describing the operation that a _LambdaExpressionBase performs on top of its operands.
+    Contrary to the inner function (self._fun) that can only be executed, this description can be analysed and
+    transformed, for example to compile the whole expression into a single python function (see
+    `mini_lambda.compiler`) or to write optimization passes (see `mini_lambda.nodes`).
+
+     * kind: the kind of operation, one of the NODE_* constants of this module
+     * symbol: the operator symbol ('+', '&', 'and'...), the method or attribute name, or the name of the
+       variable/constant (None for constants created without a name). For chained comparisons, the tuple of
+       comparison symbols.
+     * args: the positional operands, in evaluation order. They may be _LambdaExpressionBase (the child expressions) or
+       any other object (constants, that are used as is).
+     * kwargs: the keyword operands, as a tuple of (name, operand) pairs
+     * method: the callable applied by the operation when relevant (the operator function, the called method...)
+     * origin: for constants resulting from constant folding, the node of the operation that was folded. It is only
+       used to display the expression as it was written.
+
+    For NODE_CONSTANT nodes the constant value is the single item in args.
+    """
+    __slots__ = ()
+
+    def __new__(cls,
+                kind,         # type: str
+                symbol=None,  # type: str
+                args=(),      # type: Tuple
+                kwargs=(),    # type: Tuple[Tuple[str, Any], ...]
+                method=None,  # type: Callable
+                origin=None   # type: ExpressionNode
+                ):
+        return tuple.__new__(cls, (kind, symbol, args, kwargs, method, origin))
+
+    kind = property(operator.itemgetter(0), doc="the kind of operation, one of the NODE_* constants")
+    symbol = property(operator.itemgetter(1), doc="the operator symbol, method/attribute name, or variable name")
+    args = property(operator.itemgetter(2), doc="the positional operands")
+    kwargs = property(operator.itemgetter(3), doc="the keyword operands, as a tuple of (name, operand) pairs")
+    method = property(operator.itemgetter(4), doc="the callable applied by the operation, if any")
+    origin = property(operator.itemgetter(5), doc="the folded operation, for constants resulting from constant folding")
+
+    # nodes are compared by identity: comparing the operands would call the (overridden) __eq__ of expressions
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = object.__hash__
+
+    @property
+    def operands(self):
+        """ All operands (positional then keyword) in evaluation order """
+        return self.args + tuple(arg for _, arg in self.kwargs)
+
+    @property
+    def children(self):
+        """ The operands that are expressions """
+        return tuple(arg for arg in self.operands if isinstance(arg, _LambdaExpressionBase))
+
+    @property
+    def constants(self):
+        """ The operands that are constants. For NODE_CONSTANT nodes, this is a tuple containing the constant value """
+        return tuple(arg for arg in self.operands if not isinstance(arg, _LambdaExpressionBase))
+
+    def apply(self,
+              args,   # type: Tuple
+              kwargs  # type: Tuple[Tuple[str, Any], ...]
+              ):
+        """
+        Performs the operation described by this node on already evaluated operands. The short-circuit semantics of
+        the logical operators cannot be reproduced here since all operands are already evaluated.
+
+        :param args: the evaluated positional operands
+        :param kwargs: the evaluated keyword operands, as a tuple of (name, value) pairs
+        :return: the result of the operation
+        """
+        kind = self.kind
+        if kind == NODE_VAR:
+            raise ValueError('A variable node cannot be applied')
+        elif kind == NODE_CONSTANT:
+            return self.args[0]
+        elif kind in (NODE_UNARY_OP, NODE_BINARY_OP, NODE_NARY_OP):
+            return self.method(*args)
+        elif kind == NODE_LOGICAL_OP:
+            left, right = args
+            if self.symbol == '&':
+                return bool(right) if left else False
+            elif self.symbol == '|':
+                return True if left else bool(right)
+            else:
+                return _xor(left, right)
+        elif kind == NODE_CALL:
+            return self.method(*args, **dict(kwargs))
+        elif kind == NODE_METHOD_CALL:
+            return getattr(args[0], self.symbol)(*args[1:], **dict(kwargs))
+        elif kind == NODE_GETATTR:
+            return getattr(args[0], self.symbol)
+        elif kind == NODE_GETITEM:
+            return args[0][args[1]]
+        elif kind == NODE_IF_ELSE:
+            return args[1] if args[0] else args[2]
+        elif kind == NODE_COMPARE_CHAIN:
+            for i, symbol in enumerate(self.symbol):
+                result = _BINARY_OPERATORS[symbol](args[i], args[i + 1])
+                if not result:
+                    break
+            return result
+        elif kind == NODE_BOOL_OP:
+            result = args[0]
+            for arg in args[1:]:
+                if (not result) if self.symbol == 'and' else result:
+                    break
+                result = arg
+            return result
+        else:
+            raise ValueError('Unsupported node kind: %r' % kind)
+
+    def __repr__(self):
+        return "<ExpressionNode: %s %r>" % (self.kind, self.symbol)
+
+
+def set_constant_folding(enabled  # type: bool
+                         ):
+    # type: (...) -> bool
+    """
+    Enables or disables constant folding. When it is enabled (the default), expressions that only depend on constants,
+    such as C(2) * C(math.pi) or Log(C(10)), are evaluated once when they are created and then behave as constants,
+    while still being displayed as they were written. Only the operators and the known pure callables (the functions
+    of the math and operator modules, and builtins such as len or round) applied to values of builtin types are folded:
+    other callables, such as C(random.random)(), are still called at each evaluation. `fold_constants` can be used to
+    fold them, as well as the expressions created while constant folding is disabled.
+
+    Note that constants are folded with the values they have when the expression is created.
+
+    :param enabled:
+    :return: the previous value of the setting
+    """
+    global _CONSTANT_FOLDING
+    previous = _CONSTANT_FOLDING
+    _CONSTANT_FOLDING = enabled
+    return previous
+
+
+def set_interning(enabled  # type: bool
+                  ):
+    # type: (...) -> bool
+    """
+    Enables or disables the interning (hash-consing) of expressions. When it is enabled, creating an expression that
+    is structurally identical to an existing one (same operation, on the same operand expressions and equal constants)
+    returns the existing expression instead of a new one. Programs holding many expressions with common sub-expressions
+    therefore use less memory, and their fingerprints and compiled functions are computed once for all duplicates.
+
+    The interned expressions are held in a table with weak references, so that expressions that are not used anymore
+    can still be garbage-collected. Interning is disabled by default.
+
+    :param enabled:
+    :return: the previous value of the setting
+    """
+    global _INTERNING
+    previous = _INTERNING
+    _INTERNING = enabled
+    return previous
+
+
+def _get_value_types():
+    """ Returns the types of the constants that are identified by their value """
+    types = {int, bool, str, bytes, type(None)}
+    try:  # python 2
+        types.update((long, unicode))  # noqa: F821
+    except NameError:
+        pass
+    return frozenset(types)
+
+
+# the constants of these types are identified by their value, and floats and complex numbers by their repr
+_VALUE_TYPES = _get_value_types()
+
+# the functions returning the key of the constants of other types, see `_constant_key`
+_CONSTANT_KEY_FUNCTIONS = dict()  # type: Dict[type, Callable[[Any], Tuple]]
+
+
+def _constant_key(value):
+    """
+    Returns a hashable key identifying a constant. Only the constants whose equality means that they behave the same
+    are identified by their type and value: integers, booleans, strings, bytes and None, floats and complex numbers by
+    their repr (0.0 == -0.0 but they are not interchangeable), and tuples and frozensets of such constants. Other
+    constants, such as `Decimal('1.0')` and `Decimal('1.00')` that are equal but are not printed the same way, are
+    identified by their id.
+    """
+    value_type = type(value)
+    if value_type in _VALUE_TYPES:
+        return 'value', value_type, value
+    elif value_type in (float, complex):
+        return 'value', value_type, repr(value)
+    elif value_type in (tuple, frozenset):
+        keys = value_type(_constant_key(item) for item in value)
+        if all(key[0] == 'value' for key in keys):
+            return 'value', value_type, keys
+    elif value_type in _CONSTANT_KEY_FUNCTIONS:
+        return _CONSTANT_KEY_FUNCTIONS[value_type](value)
+    return 'id', id(value)
+
+
+def _get_interning_key(cls, args, kwargs):
+    """
+    Returns the key identifying the expression that would be created by cls(*args, **kwargs) in the interning table,
+    or None if it should not be interned (variables and opaque expressions). Operand expressions are identified by
+    their id: since they are interned too, identical operands are the same objects. The ids remain valid as long as
+    the interned expression (that references its operands) is alive.
+    """
+    if len(args) > 0:
+        return None
+
+    repr_on = kwargs.get('repr_on', True)
+    if kwargs.get('is_constant', False):
+        return cls, NODE_CONSTANT, kwargs.get('str_expr'), _constant_key(kwargs.get('constant_value')), repr_on
+
+    node = kwargs.get('node')
+    if node is None:
+        return None
+
+    root_var = kwargs.get('root_var')
+    if node.kind == NODE_CONSTANT:
+        node_key = (node.symbol, _constant_key(node.args[0]), id(node.origin))
+    else:
+        node_key = (node.symbol, _constant_key(node.method), tuple(name for name, _ in node.kwargs),
+                    tuple(id(operand) if isinstance(operand, _LambdaExpressionBase) else _constant_key(operand)
+                          for operand in node.operands))
+
+    return cls, node.kind, node_key, kwargs.get('precedence_level'), root_var, repr_on, \
+        root_var == _CONSTANT_VAR_ID and _CONSTANT_FOLDING
+
+
+class _InterningType(type):
+    """
+    The metaclass of lambda expressions. When interning is enabled (see `set_interning`), it returns the existing
+    expression instead of creating a structurally identical one.
+    """
+    def __call__(cls, *args, **kwargs):
+        if not _INTERNING:
+            return type.__call__(cls, *args, **kwargs)
+
+        key = _get_interning_key(cls, args, kwargs)
+        if key is None:
+            return type.__call__(cls, *args, **kwargs)
+
+        expression = _INTERNED.get(key)
+        if expression is None:
+            expression = _INTERNED[key] = type.__call__(cls, *args, **kwargs)
+        return expression
+
+
+# the base class with the _InterningType metaclass (compliant with both python 2 and 3)
+_InterningBase = _InterningType('_InterningBase', (object,), {'__slots__': ()})
+
+
+def _fold(fun,  # type: Callable
+          node  # type: ExpressionNode
+          ):
+    # type: (...) -> Tuple[Callable, ExpressionNode]
+    """
+    Returns the inner function and node to use for an expression that only depends on constants: if its evaluation
+    succeeds, a function returning the precomputed value and a NODE_CONSTANT node remembering the original one (for
+    display). Otherwise (the evaluation raises an error, returns an iterator that can only be consumed once, or a
+    mutable object that each evaluation should create again), the provided fun and node are returned unchanged, so
+    that the errors are raised at evaluation time as usual.
+    """
+    if node.kind == NODE_CONSTANT or _is_impure(node) \
+            or any(child._node is None or child._node.kind != NODE_CONSTANT for child in node.children):
+        # already a constant, impure operation, or operands that could not be folded
+        return fun, node
+
+    try:
+        value = fun(None)
+    except Exception:
+        return fun, node
+
+    if hasattr(value, '__next__') or hasattr(value, 'next'):
+        # an iterator or generator: each evaluation should create a new one
+        return fun, node
+    try:
+        hash(value)
+    except TypeError:
+        # a mutable object such as a list, dict, set or bytearray: each evaluation should create a new one
+        return fun, node
+
+    def constant_fun(x):
+        return value
+
+    return constant_fun, ExpressionNode(NODE_CONSTANT, None, (value,), origin=node)
+
+
+def _is_pure_callable(f):
+    """ Returns True if f is one of the known pure callables, or a method of a builtin type such as str.format """
+    try:
+        if f in _PURE_CALLABLES:
+            return True
+    except TypeError:
+        # not hashable
+        return False
+    return getattr(getattr(f, '__objclass__', None), '__module__', None) in _BUILTIN_MODULES \
+        and getattr(f, '__name__', None) not in _IMPURE_METHOD_NAMES
+
+
+def _is_plain_value(value):
+    """ Returns True if using value in an operation does not call any user code: values of builtin types (recursively
+    for containers), classes, and known pure callables """
+    if isclass(value) or _is_pure_callable(value):
+        return True
+    elif type(value).__module__ not in _BUILTIN_MODULES or callable(value):
+        return False
+    elif isinstance(value, dict):
+        return all(_is_plain_value(k) and _is_plain_value(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        return all(_is_plain_value(item) for item in value)
+    return True
+
+
+def _is_foldable(node  # type: ExpressionNode
+                 ):
+    # type: (...) -> bool
+    """
+    Returns True if the operation described by node, whose operands are constants, may be evaluated when the expression
+    is created (see set_constant_folding): only the known pure callables (the functions of the math and operator
+    modules, and the builtins such as len or round) and the operators are called, on values of builtin types. Other
+    callables, such as C(random.random)(), may return a different value at each call.
+    """
+    operands = node.operands
+    if node.kind == NODE_CALL:
+        if not _is_pure_callable(node.method):
+            return False
+    elif node.kind == NODE_METHOD_CALL:
+        if node.symbol == '__call__':
+            called = operands[0]
+            if isinstance(called, _LambdaExpressionBase):
+                called = called._node.args[0] if called._node is not None and called._node.kind == NODE_CONSTANT \
+                    else None
+            if not _is_pure_callable(called):
+                return False
+            operands = operands[1:]
+        elif node.symbol in _IMPURE_METHOD_NAMES:
+            return False
+
+    for operand in operands:
+        if isinstance(operand, _LambdaExpressionBase):
+            if operand._node is None or operand._node.kind != NODE_CONSTANT:
+                return False
+            operand = operand._node.args[0]
+        if not _is_plain_value(operand):
+            return False
+    return True
+
+
+def mark_impure(*functions  # type: Union[Callable, str]
+                ):
+    """
+    Marks functions as impure: their result may change from one call to the other even with the same arguments, or
+    they have side effects. Such functions are called at each evaluation: the sub-expressions calling them are neither
+    precomputed by constant folding nor shared with identical sub-expressions when an expression is compiled.
+
+    A few builtins (print, input, next, iter, open) and the usual methods modifying containers or files (append, pop,
+    update, write...) are already considered impure.
+
+    :param functions: the impure functions. Strings may be provided to mark the methods with that name as impure, for
+        example 'pop' for x.pop().
+    :return:
+    """
+    for f in functions:
+        if isinstance(f, str):
+            _IMPURE_METHOD_NAMES.add(f)
+        else:
+            _IMPURE_CALLABLES.add(f)
+
+
+def _is_impure_callable(f):
+    """ Returns True if f was marked as impure """
+    try:
+        return f in _IMPURE_CALLABLES
+    except TypeError:
+        # not hashable
+        return False
+
+
+def _is_impure(node  # type: ExpressionNode
+               ):
+    # type: (...) -> bool
+    """ Returns True if the operation described by node calls an impure function or method, see mark_impure """
+    kind = node.kind
+    if kind == NODE_CALL:
+        return _is_impure_callable(node.method)
+
+    elif kind == NODE_METHOD_CALL:
+        if node.symbol != '__call__':
+            return node.symbol in _IMPURE_METHOD_NAMES
+
+        # the called object: a method of an object (x.pop()), or a constant function (C(random)())
+        called = node.args[0]
+        if isinstance(called, _LambdaExpressionBase) and called._node is not None:
+            called_node = called._node
+            if called_node.kind == NODE_GETATTR:
+                return called_node.symbol in _IMPURE_METHOD_NAMES
+            elif called_node.kind == NODE_CONSTANT:
+                called = called_node.args[0]
+            else:
+                return False
+        return _is_impure_callable(called)
+
+    else:
+        return False
+
+
+def _unary_op_node(symbol, operand):
+    """ Returns an ExpressionNode describing '<symbol><operand>' """
+    return ExpressionNode(NODE_UNARY_OP, symbol, (operand,), method=_UNARY_OPERATORS[symbol])
+
+
+def _make_call_function(method,           # type: Callable
+                        args,             # type: Tuple
+                        kwargs,           # type: Dict[str, Any]
+                        method_name=None  # type: str
+                        ):
+    # type: (...) -> Callable[[Any], Any]
+    """
+    Returns the inner function of a call node: a function returning `method(*args, **kwargs)` for an input, where the
+    arguments that are expressions are first evaluated on that input. If `method_name` is provided, `method` is not
+    used: the first argument is the expression on which the method with that name is called, with the other arguments.
+
+    The plan of the arguments is computed once here, so that the returned function only evaluates the arguments that
+    are expressions. When only the first argument is an expression (for example in `s.startswith('a')` or
+    `round(x, 2)`), and for methods called with a single argument, no intermediate list or dict is created.
+
+    :param method:
+    :param args:
+    :param kwargs:
+    :param method_name:
+    :return:
+    """
+    dynamic_args = tuple((i, arg._fun) for i, arg in enumerate(args) if isinstance(arg, _LambdaExpressionBase))
+    dynamic_kwargs = tuple((name, arg._fun) for name, arg in kwargs.items() if isinstance(arg, _LambdaExpressionBase))
+    other_args = args[1:]
+
+    if len(dynamic_kwargs) == 0 and len(dynamic_args) == 1 and dynamic_args[0][0] == 0:
+        # only the first argument is an expression
+        first_fun = dynamic_args[0][1]
+        if method_name is not None:
+            if len(kwargs) > 0:
+                def call(input):
+                    return getattr(first_fun(input), method_name)(*other_args, **kwargs)
+            else:
+                def call(input):
+                    return getattr(first_fun(input), method_name)(*other_args)
+        elif len(kwargs) > 0:
+            def call(input):
+                return method(first_fun(input), *other_args, **kwargs)
+        elif len(other_args) > 0:
+            def call(input):
+                return method(first_fun(input), *other_args)
+        else:
+            def call(input):
+                return method(first_fun(input))
+
+    elif method_name is not None and len(args) == 2 and len(dynamic_args) == 2 and len(kwargs) == 0:
+        # a method called with a single argument, that is an expression
+        first_fun, arg_fun = dynamic_args[0][1], dynamic_args[1][1]
+
+        def call(input):
+            return getattr(first_fun(input), method_name)(arg_fun(input))
+
+    elif len(dynamic_args) == 0 and len(dynamic_kwargs) == 0:
+        # constant arguments
+        def call(input):
+            return method(*args, **kwargs)
+
+    else:
+        # general case: the constant arguments are copied, and the other ones are evaluated
+        def call(input):
+            values = list(args)
+            for i, fun in dynamic_args:
+                values[i] = fun(input)
+            if len(dynamic_kwargs) > 0:
+                kwargs_values = dict(kwargs)
+                for name, fun in dynamic_kwargs:
+                    kwargs_values[name] = fun(input)
+            else:
+                kwargs_values = kwargs
+            if method_name is not None:
+                return getattr(values[0], method_name)(*values[1:], **kwargs_values)
+            else:
+                return method(*values, **kwargs_values)
+
+    return call
+
+
+def _binary_op_node(symbol, left, right):
+    """ Returns an ExpressionNode describing '<left> <symbol> <right>' """
+    return ExpressionNode(NODE_BINARY_OP, symbol, (left, right), method=_BINARY_OPERATORS[symbol])
+
+
+class _LambdaExpressionBase(_InterningBase):
     """
     A _LambdaExpressionBase is a wrapper for a function (self._fun) with a SINGLE argument.
     It can be evaluated on any input by calling the 'evaluate' method. This will execute self._fun() on this input.
@@ -48,7 +660,8 @@ class _LambdaExpressionBase(object):
      self._fun (res) by doing res.meth(*other_args)
     """
 
-    __slots__ = ['repr_on', '_fun', '_str_expr', '_root_var', '_precedence_level']
+    __slots__ = ['repr_on', '_fun', '_str_expr', '_root_var', '_precedence_level', '_node', '_depth', '_program',
+                 '_fingerprint', '__weakref__']
 
     def __init__(self,
                  str_expr=None,          # type: str
@@ -57,19 +670,24 @@ class _LambdaExpressionBase(object):
                  precedence_level=None,  # type: int
                  fun=None,               # type: Callable
                  root_var=None,
-                 repr_on=True            # type: bool
+                 repr_on=True,           # type: bool
+                 node=None               # type: ExpressionNode
                  ):
         """
         Constructor with an optional nested evaluation function. If no argument is provided, the nested evaluation
         function is the identity function with one single parameter x
 
-        :param str_expr: a string representation of this expression. By default this is 'x'
+        :param str_expr: a string representation of this expression. By default this is 'x' for variables, and
+            str(constant_value) for constants. Expressions described by a `node` do not need it: their string
+            representation is rendered from the node graph when it is first requested.
         :param is_constant: False (default) will create a variable, while True will create a constant
         :param constant_value: the value for the constant
         :param precedence_level: the precedence level of this expression. It is used by the get_repr() method to decide
         if there is a need to surround it with parenthesis. By default this is the highest precedence.
         :param fun:
         :param root_var:
+        :param node: the ExpressionNode describing the operation performed by `fun` (expressions only). If it is not
+            provided the expression is considered opaque: it can still be evaluated, but not compiled.
         """
         self.repr_on = repr_on
 
@@ -78,8 +696,7 @@ class _LambdaExpressionBase(object):
             if precedence_level is not None or fun is not None or root_var is not None:
                 raise ValueError('precedence_level, fun, and root_var should not be provided when creating a Constant')
 
-            # symbol for the constant
-            str_expr = str_expr or str(constant_value)
+            # symbol for the constant: if there is none, str(constant_value) will be rendered when needed
 
             # contents = constant_value
             def fun(x):
@@ -91,6 +708,8 @@ class _LambdaExpressionBase(object):
             # precedence level is maximum
             precedence_level = _PRECEDENCE_MAX
 
+            node = ExpressionNode(NODE_CONSTANT, str_expr, (constant_value,))
+
         # case 2: variable. No function nor root_var should be provided, and the inner method will be the identity
         elif fun is None and root_var is None and precedence_level is None and constant_value is None:
             # symbol for the variable
@@ -107,19 +726,55 @@ class _LambdaExpressionBase(object):
             # precedence_level = precedence_level or _PRECEDENCE_MAX
             precedence_level = _PRECEDENCE_MAX
 
+            node = ExpressionNode(NODE_VAR, str_expr)
+
         # case 3 (internal only): expression
-        elif fun is not None and str_expr is not None and root_var is not None and precedence_level is not None:
+        elif fun is not None and (str_expr is not None or node is not None) and root_var is not None \
+                and precedence_level is not None:
             if constant_value is not None:
                 raise ValueError('constant_value should be None if is_constant is not True')
 
+            if root_var == _CONSTANT_VAR_ID and _CONSTANT_FOLDING and node is not None and _is_foldable(node):
+                # this expression only depends on constants and known pure operations: try to precompute it
+                fun, node = _fold(fun, node)
+
         else:
             raise ValueError('Unsupported combination of parameters, see documentation for details')
 
+        # depth of the expression: number of nested inner functions called during an evaluation
+        if node is None:
+            depth = 1
+        elif node.kind in (NODE_VAR, NODE_CONSTANT):
+            depth = 0
+        else:
+            depth = 1 + max([0] + [child._depth for child in node.children])
+
+        if depth > _MAX_RECURSIVE_DEPTH:
+            # a deep expression: evaluate it with an explicit stack instead of the nested inner functions
+            fun = self._evaluate_iteratively
+
         # remember for later use
         self._fun = fun
         self._str_expr = str_expr
         self._root_var = root_var
         self._precedence_level = precedence_level
+        self._node = node
+        self._depth = depth
+        self._program = None
+        self._fingerprint = None
+
+    def _evaluate_iteratively(self, arg):
+        """
+        Evaluates this expression by executing its linearised program (created on first call) with an explicit stack
+        of values, so that the python stack depth does not depend on the depth of the expression.
+
+        :param arg:
+        :return:
+        """
+        from mini_lambda.evaluator import linearize, run
+        if self._program is None:
+            self._program = linearize(self)
+        return run(self._program, arg)
 
     def evaluate(self, arg):
         """
@@ -134,6 +789,37 @@ class _LambdaExpressionBase(object):
         """
         return self._fun(arg)
 
+    def evaluate_batch(self, values, use_numexpr=True, chunk_size=None, out=None):
+        """
+        Evaluates this expression on each element of an array, and returns the array of the results. The operations
+        are translated to numpy operations applied to the whole array when possible (see `mini_lambda.batch`), so that
+        there is no python call per element. This requires numpy. Divisions by zero, integer overflows and fractional
+        powers of negative numbers follow the numpy semantics (inf, nan or 0, wraparound, nan) instead of raising an
+        error or returning a complex number as `evaluate` does.
+
+        :param values: an array, or anything that can be converted to an array with np.asarray
+        :param use_numexpr: if True (default) and numexpr is installed, the expression is evaluated with numexpr in a
+            single pass when possible (see `mini_lambda.numexpr_backend`).
+        :param chunk_size: if provided, values are evaluated by chunks of this number of elements, reusing scratch
+            buffers of the size of a chunk for the intermediate results (see `mini_lambda.batch.evaluate_batch`).
+        :param out: an optional array with the same shape as `values`, where the results are written.
+        :return:
+        """
+        from mini_lambda.batch import evaluate_batch
+        return evaluate_batch(self, values, use_numexpr=use_numexpr, chunk_size=chunk_size, out=out)
+
+    def to_pandas_query(self):
+        """
+        Returns the string that `DataFrame.eval` and `DataFrame.query` can use to evaluate this expression, where the
+        variable is the data frame. For example `df['a'] * 2 + df['b'] > 10` is translated to `((a * 2) + b) > 10`.
+        See `mini_lambda.pandas_eval`.
+
+        :return:
+        :raises ValueError: if the expression can not be translated
+        """
+        from mini_lambda.pandas_eval import to_pandas_query
+        return to_pandas_query(self)
+
     def __repr__(self):
         if self.repr_on:
             return "<LambdaExpression: %s>" % self.to_string()
@@ -143,13 +829,54 @@ class _LambdaExpressionBase(object):
                                           'If you wish to enable repr again to see the expression in your IDE,'
                                           'set the `repr_on` attribute to True')
 
-    def to_string(self):
+    def to_string(self,
+                  max_constant_length=None  # type: int
+                  ):
         """
         Returns a string representation of this InputEvaluator (Since str() does not work, it would return a new
         InputEvaluator).
+
+        The representation is rendered from the node graph the first time it is requested, and then cached.
+
+        :param max_constant_length: an optional maximum length for the representation of constants. Longer
+            representations are truncated and end with '...'. Truncated representations are not cached.
+        :return:
+        """
+        if max_constant_length is not None:
+            return _render(self, max_constant_length)
+
+        str_expr = self._str_expr
+        if str_expr is None:
+            str_expr = self._str_expr = _render(self)
+        return str_expr
+
+    def fingerprint(self):
+        # type: (...) -> int
+        """
+        Returns the structural hash of this expression: structurally equal expressions have the same fingerprint even
+        if they are distinct objects. It is computed once and cached. See `mini_lambda.nodes.fingerprint`.
+
+        :return:
+        """
+        if self._fingerprint is not None:
+            return self._fingerprint
+        from mini_lambda.nodes import fingerprint
+        return fingerprint(self)
+
+    def structurally_equal(self,
+                           other  # type: Any
+                           ):
+        # type: (...) -> bool
+        """
+        Returns True if other is an expression performing the same operations on the same constants and variables than
+        this one. Since `==` creates a new expression, this is the way to compare expressions. See
+        `mini_lambda.nodes.structurally_equal`.
+
+        :param other:
         :return:
         """
-        return self._str_expr
+        from mini_lambda.nodes import structurally_equal
+        return structurally_equal(self, other)
 
     def assert_has_same_root_var(self,
                                  other  # type: Any
@@ -201,25 +928,17 @@ class _LambdaExpressionBase(object):
         :param m_kwargs: optional kwargs to apply in method calls
         :return:
         """
-        root_var, _ = _get_root_var(self, m_args, m_kwargs)
+        root_var, _ = _get_root_var(self, *m_args, **m_kwargs)
 
-        def evaluate_inner_function_and_apply_object_method(raw_input):
-            # first evaluate the inner function
-            res = self.evaluate(raw_input)
-            # then retrieve the (bound) method on the result object, from its name
-            object_method = getattr(res, method_name)
-            # finally call the method
-            return object_method(*[evaluate(other, input) for other in m_args],
-                                 **{arg_name: evaluate(arg, input) for arg_name, arg in m_kwargs.items()})
+        # first evaluate the inner function, then call the method with that name on the result object
+        evaluate_inner_function_and_apply_object_method = _make_call_function(None, (self,) + m_args, m_kwargs,
+                                                                              method_name=method_name)
 
         # return a new InputEvaluator of the same type than self, with the new function as inner function
-        # Note: we use precedence=None for coma-separated items inside the parenthesis
-        string_expr = get_repr(self, _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF) + '.' + method_name + '(' \
-                      + ', '.join([get_repr(arg, None) for arg in m_args]) \
-                      + ', '.join([arg_name + '=' + get_repr(arg, None) for arg_name, arg in m_kwargs.items()]) + ')'
+        node = ExpressionNode(NODE_METHOD_CALL, method_name, (self,) + m_args, tuple(m_kwargs.items()))
         return type(self)(fun=evaluate_inner_function_and_apply_object_method,
                           precedence_level=_PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF,
-                          str_expr=string_expr, root_var=root_var, repr_on=self.repr_on)
+                          root_var=root_var, repr_on=self.repr_on, node=node)
 
     @classmethod
     def constant(cls,
@@ -254,8 +973,8 @@ class _LambdaExpressionBase(object):
             return cls(str_expr=name or value.__name__, is_constant=True, constant_value=value)
 
         else:
-            # a true 'constant'
-            return cls(str_expr=name or str(value), is_constant=True, constant_value=value)
+            # a true 'constant'. Its default representation str(value) is only computed when needed
+            return cls(str_expr=name, is_constant=True, constant_value=value)
 
     @classmethod
     def _get_expression_for_method_with_args(cls, method, *args, **kwargs):
@@ -286,23 +1005,167 @@ class _LambdaExpressionBase(object):
 
         else:
             # there are expressions in the arguments: we have to create a new expression
-            def evaluate_all_and_apply_method(input):
-                # this basically calls your method on the same arguments (positional and keyword),
-                # except that all of the arguments are first  evaluated if they are expressions
-                return method(*[evaluate(arg, input) for arg in args],
-                              **{arg_name: evaluate(arg, input) for arg_name, arg in kwargs.items()})
+            # it basically calls your method on the same arguments (positional and keyword),
+            # except that all of the arguments are first evaluated if they are expressions
+            evaluate_all_and_apply_method = _make_call_function(method, args, kwargs)
 
             # return a new expression of the same type than first_expression, with the new function as inner function
-            # Note: we use precedence=None for coma-separated items inside the parenthesis
-            string_expr = method.__name__ + '(' \
-                          + ', '.join([get_repr(arg, None) for arg in args]) \
-                          + (', ' if (len(args) > 0 and len(kwargs) > 0) else '') \
-                          + ', '.join([arg_name + '=' + get_repr(arg, None) for arg_name, arg in kwargs.items()]) \
-                          + ')'
-
+            node = ExpressionNode(NODE_CALL, method.__name__, args, tuple(kwargs.items()), method=method)
             return cls(fun=evaluate_all_and_apply_method,
                        precedence_level=_PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF,
-                       str_expr=string_expr, root_var=root_var, repr_on=first_expression.repr_on)
+                       root_var=root_var, repr_on=first_expression.repr_on, node=node)
+
+    @classmethod
+    def _get_expression_for_bool_op(cls, symbol, *operands):
+        """
+        This method is called to create the short-circuit boolean operations 'and' and 'or' between several operands.
+        Just like the python keywords, the operands are evaluated lazily from left to right, and the result is the
+        first decisive value (the first falsy value for 'and', the first truthy value for 'or') or the last one.
+
+        If no operand is an expression, the result is returned immediately.
+
+        :param symbol: 'and' or 'or'
+        :param operands: the operands. They may be lambda expressions
+        :return:
+        """
+        root_var, first_expression = _get_root_var(*operands)
+
+        if root_var is None:
+            # there are no expressions in the operands so the result can be computed right now
+            return ExpressionNode(NODE_BOOL_OP, symbol).apply(operands, ())
+
+        is_and = (symbol == 'and')
+        first_operands, last_operand = operands[:-1], operands[-1]
+
+        def evaluate_lazily(input):
+            for operand in first_operands:
+                value = evaluate(operand, input)
+                if (not value) if is_and else value:
+                    # short-circuit: this value is decisive, the next operands are not evaluated
+                    return value
+            return evaluate(last_operand, input)
+
+        node = ExpressionNode(NODE_BOOL_OP, symbol, operands)
+        return cls(fun=evaluate_lazily, precedence_level=_PRECEDENCE_AND if is_and else _PRECEDENCE_OR,
+                   root_var=root_var, repr_on=first_expression.repr_on, node=node)
+
+    @classmethod
+    def _get_expression_for_if_else(cls, condition, then, otherwise):
+        """
+        This method is called to create the conditional expression 'then if condition else otherwise'. Only the branch
+        selected by the condition is evaluated.
+
+        If no argument is an expression, the result is returned immediately.
+
+        :param condition:
+        :param then:
+        :param otherwise:
+        :return:
+        """
+        root_var, first_expression = _get_root_var(condition, then, otherwise)
+
+        if root_var is None:
+            # there are no expressions in the arguments so the result can be computed right now
+            return then if condition else otherwise
+
+        def evaluate_selected_branch(input):
+            if evaluate(condition, input):
+                return evaluate(then, input)
+            else:
+                return evaluate(otherwise, input)
+
+        node = ExpressionNode(NODE_IF_ELSE, 'if', (condition, then, otherwise))
+        return cls(fun=evaluate_selected_branch, precedence_level=_PRECEDENCE_IF_ELSE, root_var=root_var,
+                   repr_on=first_expression.repr_on, node=node)
+
+    @classmethod
+    def _get_expression_for_compare_chain(cls, symbols, *operands):
+        """
+        This method is called to create the chained comparison 'operand_0 symbol_0 operand_1 symbol_1 operand_2...', for
+        example '0 <= x < 1'. Just like in python, each operand is evaluated at most once, and the comparisons are
+        evaluated from left to right until one of them is falsy.
+
+        If no operand is an expression, the result is returned immediately.
+
+        :param symbols: the comparison symbols ('<', '<=', '==', '!=', '>', '>='), one less than the operands
+        :param operands: the operands. They may be lambda expressions
+        :return:
+        """
+        symbols = tuple(symbols)
+        if len(symbols) != len(operands) - 1 or len(symbols) == 0 \
+                or any(symbol not in _COMPARISON_SYMBOLS for symbol in symbols):
+            raise ValueError('Invalid chained comparison: %r for %s operands' % (symbols, len(operands)))
+
+        node = ExpressionNode(NODE_COMPARE_CHAIN, symbols, operands)
+        root_var, first_expression = _get_root_var(*operands)
+
+        if root_var is None:
+            # there are no expressions in the operands so the result can be computed right now
+            return node.apply(operands, ())
+
+        comparisons = tuple(_BINARY_OPERATORS[symbol] for symbol in symbols)
+        if len(operands) == 3 and not isinstance(operands[0], _LambdaExpressionBase) \
+                and not isinstance(operands[2], _LambdaExpressionBase):
+            # a range check with constant bounds, such as 0 <= x < 1
+            low, middle_fun, high = operands[0], operands[1]._fun, operands[2]
+            first_comparison, second_comparison = comparisons
+
+            def evaluate_chain(input):
+                value = middle_fun(input)
+                return first_comparison(low, value) and second_comparison(value, high)
+        else:
+            def evaluate_chain(input):
+                left = evaluate(operands[0], input)
+                for comparison, operand in zip(comparisons, operands[1:]):
+                    right = evaluate(operand, input)
+                    result = comparison(left, right)
+                    if not result:
+                        return result
+                    left = right
+                return result
+
+        return cls(fun=evaluate_chain, precedence_level=_PRECEDENCE_COMPARISON, root_var=root_var,
+                   repr_on=first_expression.repr_on, node=node)
+
+    @classmethod
+    def _get_expression_for_nary_op(cls, symbol, *operands):
+        """
+        This method is called to create the n-ary operations, that combine a flat list of operands in a single node
+        instead of a chain of binary operations:
+         * '+' and '*' (Sum_, Prod_) evaluate all operands and combine them from left to right in a single loop,
+         * 'fsum' (Sum_ with fsum=True) evaluates all operands and returns their math.fsum,
+         * '&' and '|' (AllOf, AnyOf) evaluate the operands lazily from left to right, and return a boolean just like
+           the '&' and '|' operators of LambdaExpression.
+
+        If no operand is an expression, the result is returned immediately.
+
+        :param symbol: '+', '*', 'fsum', '&' or '|'
+        :param operands: the operands. They may be lambda expressions
+        :return:
+        """
+        method = _NARY_OPERATORS[symbol]
+        root_var, first_expression = _get_root_var(*operands)
+
+        if root_var is None:
+            # there are no expressions in the operands so the result can be computed right now
+            return method(*operands)
+
+        if symbol in ('&', '|'):
+            is_and = (symbol == '&')
+
+            def evaluate_all_and_combine(input):
+                for operand in operands:
+                    if bool(evaluate(operand, input)) is not is_and:
+                        # short-circuit: this value is decisive, the next operands are not evaluated
+                        return not is_and
+                return is_and
+        else:
+            def evaluate_all_and_combine(input):
+                return method(*[evaluate(operand, input) for operand in operands])
+
+        node = ExpressionNode(NODE_NARY_OP, symbol, operands, method=method)
+        return cls(fun=evaluate_all_and_combine, precedence_level=_NARY_PRECEDENCE_LEVELS[symbol], root_var=root_var,
+                   repr_on=first_expression.repr_on, node=node)
 
 
 def _get_root_var(*args, **kwargs):
@@ -388,3 +1251,155 @@ def get_repr(statement,                    # type: Any
     else:
         # a standard callable
         return statement.__name__
+
+
+def _truncate(str_repr,            # type: str
+              max_constant_length  # type: int
+              ):
+    """ Truncates the representation of a constant if it is longer than max_constant_length (if not None) """
+    if max_constant_length is not None and len(str_repr) > max_constant_length:
+        return str_repr[:max_constant_length] + '...'
+    else:
+        return str_repr
+
+
+def _get_operand_targets(expression,  # type: _LambdaExpressionBase
+                         node         # type: ExpressionNode
+                         ):
+    # type: (...) -> Tuple[Tuple[int, bool], Tuple[int, bool]]
+    """
+    Returns the target precedence levels to use for the left and right operands of a binary or logical operation,
+    together with a boolean indicating if an operand with the same precedence level should be surrounded with
+    parenthesis.
+
+    For example (x - 1) - 2 is rendered 'x - 1 - 2' but x - (1 - 2) needs the parenthesis. Comparisons can not be
+    written without parenthesis on both sides since python would consider them as chained comparisons.
+    """
+    precedence_level = expression._precedence_level
+    if node.symbol == '**':
+        # ** is right-associative, and binds less tightly than a unary operator on its right: 2 ** -1
+        return (_PRECEDENCE_EXPONENTIATION, True), (_PRECEDENCE_POS_NEG_BITWISE_NOT, False)
+    elif precedence_level == _PRECEDENCE_COMPARISON:
+        return (precedence_level, True), (precedence_level, True)
+    else:
+        return (precedence_level, False), (precedence_level, True)
+
+
+def _render(expression,               # type: _LambdaExpressionBase
+            max_constant_length=None  # type: int
+            ):
+    # type: (...) -> str
+    """
+    Renders the string representation of `expression` from its node graph.
+
+    The graph is walked iteratively with an explicit stack, so that arbitrarily deep expressions can be rendered, and
+    the result is built by joining a flat list of tokens, so that the cost is linear in the size of the result. Items
+    on the stack are either string tokens, or (operand, target_precedence_level, strict) tuples.
+
+    :param expression:
+    :param max_constant_length: an optional maximum length for the representation of constants
+    :return:
+    """
+    tokens = []
+    stack = [(expression, None, False)]
+    while len(stack) > 0:
+        item = stack.pop()
+        if not isinstance(item, tuple):
+            # a string token
+            tokens.append(item)
+            continue
+
+        operand, target, strict = item
+        if not isinstance(operand, _LambdaExpressionBase):
+            # a constant used as is in the expression
+            tokens.append(_truncate(get_repr(operand), max_constant_length))
+            continue
+
+        precedence_level = operand._precedence_level
+        if target is not None and (target > precedence_level or (strict and target == precedence_level)):
+            # we need to 'protect' the operand by surrounding it as it is used inside a higher-precedence context
+            stack += [')', (operand, None, False), '(']
+            continue
+
+        node = operand._node
+        if operand._str_expr is not None and (max_constant_length is None or node is None or node.kind == NODE_VAR
+                                               or (node.kind == NODE_CONSTANT and node.symbol is not None)):
+            # variable, named constant, opaque expression or already rendered expression
+            tokens.append(operand._str_expr)
+            continue
+
+        if node.kind == NODE_CONSTANT:
+            if node.origin is None:
+                tokens.append(_truncate(str(node.args[0]), max_constant_length))
+                continue
+            else:
+                # a folded constant: display the original operation
+                node = node.origin
+
+        kind = node.kind
+
+        # the pieces of this node, in order
+        if kind == NODE_UNARY_OP:
+            pieces = [node.symbol, (node.args[0], precedence_level, False)]
+
+        elif kind in (NODE_BINARY_OP, NODE_LOGICAL_OP):
+            (left_target, left_strict), (right_target, right_strict) = _get_operand_targets(operand, node)
+            pieces = [(node.args[0], left_target, left_strict), ' %s ' % node.symbol,
+                      (node.args[1], right_target, right_strict)]
+
+        elif kind == NODE_GETATTR:
+            pieces = [(node.args[0], _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF, False), '.' + node.symbol]
+
+        elif kind == NODE_GETITEM:
+            pieces = [(node.args[0], _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF, False), '[',
+                      (node.args[1], None, False), ']']
+
+        elif kind == NODE_IF_ELSE:
+            # 'then' and 'condition' can not be conditional expressions themselves without parenthesis
+            condition, then, otherwise = node.args
+            pieces = [(then, precedence_level, True), ' if ', (condition, precedence_level, True), ' else ',
+                      (otherwise, precedence_level, False)]
+
+        elif kind == NODE_COMPARE_CHAIN:
+            # all operands need parenthesis if they are comparisons, just like in binary comparisons
+            pieces = [(node.args[0], precedence_level, True)]
+            for symbol, arg in zip(node.symbol, node.args[1:]):
+                pieces += [' %s ' % symbol, (arg, precedence_level, True)]
+
+        elif kind == NODE_BOOL_OP or (kind == NODE_NARY_OP and node.symbol != 'fsum'):
+            pieces = [(node.args[0], precedence_level, False)]
+            for arg in node.args[1:]:
+                pieces += [' %s ' % node.symbol, (arg, precedence_level, True)]
+
+        elif kind == NODE_NARY_OP:
+            # fsum
+            pieces = ['fsum([']
+            for arg in node.args:
+                pieces += [(arg, None, False), ', ']
+            pieces[-1] = '])'
+
+        elif kind in (NODE_CALL, NODE_METHOD_CALL):
+            if kind == NODE_CALL:
+                pieces = [node.symbol, '(']
+                args = node.args
+            else:
+                pieces = [(node.args[0], _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF, False)]
+                pieces.append('(' if node.symbol == '__call__' else '.' + node.symbol + '(')
+                args = node.args[1:]
+
+            # Note: we use precedence=None for coma-separated items inside the parenthesis
+            for arg in args:
+                pieces += [(arg, None, False), ', ']
+            for arg_name, arg in node.kwargs:
+                pieces += [arg_name + '=', (arg, None, False), ', ']
+            if len(args) + len(node.kwargs) > 0:
+                # remove the last separator
+                pieces.pop()
+            pieces.append(')')
+
+        else:
+            raise ValueError('Unsupported node kind: %r' % kind)
+
+        stack.extend(reversed(pieces))
+
+    return ''.join(tokens)
@@ -0,0 +1,929 @@
+"""
+Batch evaluation of lambda expressions on numpy arrays.
+
+`evaluate_batch(expr, values)` returns the array of the results of `expr` evaluated on each element of `values`, without
+one python call per element: each node of the expression is translated into a numpy operation applied to the whole
+array (`x ** 2 + 3 * x` becomes `np.add(np.power(x, 2), np.multiply(3, x))`), and the nodes that can not be translated
+are applied element by element with `np.frompyfunc`. `get_batch_function(expr)` performs the translation once, and
+`elementwise(expr)` returns a version of the expression that can be applied directly to arrays. When numexpr is
+installed, the expressions that it supports are evaluated in a single pass (see `mini_lambda.numexpr_backend`).
+
+Unlike `expr.evaluate`, the numpy operations follow the numpy semantics: divisions by zero return inf, nan or 0,
+integer overflows wrap around, and fractional powers of negative numbers (`x ** 0.5`) return nan instead of a complex
+number. See the documentation for the details of the translation.
+
+This module requires numpy.
+"""
+import math
+from numbers import Integral, Number
+import operator
+
+try:  # python 3+
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+import numpy as np
+
+try:  # python 3.5+
+    from typing import Any, Callable, Dict, List, Optional, Tuple
+except ImportError:
+    pass
+
+from mini_lambda.base import _LambdaExpressionBase, NODE_VAR, NODE_CONSTANT, NODE_UNARY_OP, NODE_BINARY_OP, \
+    NODE_LOGICAL_OP, NODE_CALL, NODE_METHOD_CALL, NODE_BOOL_OP, NODE_IF_ELSE, NODE_NARY_OP, NODE_COMPARE_CHAIN, \
+    _COMPARISON_SYMBOLS
+from mini_lambda.nodes import walk, NodeTransformer
+from mini_lambda.backends import _is_array_exponent, _is_constant, _constant_value, _is_not, _get_callee
+from mini_lambda.main import _is_in
+
+
+_UNARY_UFUNCS = {'-': np.negative, '+': np.positive, '~': np.invert}
+
+_BINARY_UFUNCS = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.true_divide, '//': np.floor_divide,
+                  '%': np.remainder, '**': np.power, '<<': np.left_shift, '>>': np.right_shift,
+                  '<': np.less, '<=': np.less_equal, '==': np.equal, '!=': np.not_equal, '>': np.greater,
+                  '>=': np.greater_equal}
+
+
+_COMPARISON_OPERATORS = {'<': operator.lt, '<=': operator.le, '==': operator.eq, '!=': operator.ne, '>': operator.gt,
+                         '>=': operator.ge}
+
+_LOGICAL_UFUNCS = {'&': np.logical_and, '|': np.logical_or, '^': np.logical_xor}
+
+
+def _truth(values):
+    """ Returns the truth value of each element of values """
+    return np.asarray(values).astype(bool)
+
+
+def _where_dtype(then, otherwise):
+    """ Returns the dtype of the result of `np.where(condition, then, otherwise)`, or object if then and otherwise are
+    not both numbers and have different kinds: numpy would convert the numbers to strings, for example. """
+    then_dtype, otherwise_dtype = np.asarray(then).dtype, np.asarray(otherwise).dtype
+    if then_dtype.kind == otherwise_dtype.kind or (then_dtype.kind in 'biufc' and otherwise_dtype.kind in 'biufc'):
+        return np.result_type(then_dtype, otherwise_dtype)
+    return np.dtype(object)
+
+
+def _where(condition, then, otherwise):
+    """ The vectorized version of 'then if condition else otherwise' """
+    if _where_dtype(then, otherwise) == object:
+        return np.where(condition, np.asarray(then, dtype=object), np.asarray(otherwise, dtype=object))
+    return np.where(condition, then, otherwise)
+
+
+def _and_values(left, right):
+    """ The vectorized version of 'left and right' """
+    return _where(_truth(left), right, left)
+
+
+def _or_values(left, right):
+    """ The vectorized version of 'left or right' """
+    return _where(_truth(left), left, right)
+
+
+_BOOL_OP_FUNCTIONS = {'and': _and_values, 'or': _or_values}
+
+
+# ------- lazy operands evaluated on the selected elements only
+class _LazyOperand(object):
+    """ An operand of IfElse or of a logical operator, evaluated by `function` on the elements where it is selected """
+    __slots__ = ('function', )
+
+    def __init__(self, function):
+        self.function = function
+
+
+def _selected(operand, values, mask):
+    """ Returns the values of operand on the elements of values where mask is true """
+    if isinstance(operand, _LazyOperand):
+        return operand.function(values[mask])
+    elif np.ndim(operand) == 0:
+        return operand
+    return np.asarray(operand)[mask]
+
+
+def _where_lazy(condition, values, then, otherwise):
+    """ The vectorized version of 'then if condition else otherwise', where `then` and `otherwise` may be
+    _LazyOperands, only evaluated on the elements where they are selected """
+    condition = np.broadcast_to(_truth(condition), np.shape(values))
+    then = _selected(then, values, condition)
+    otherwise = _selected(otherwise, values, ~condition)
+    result = np.empty(condition.shape, dtype=_where_dtype(then, otherwise))
+    result[condition] = then
+    result[~condition] = otherwise
+    return result
+
+
+def _and_lazy(left, values, right):
+    """ The vectorized version of 'left & right', where right may be a _LazyOperand """
+    return _truth(_where_lazy(left, values, right, False))
+
+
+def _or_lazy(left, values, right):
+    """ The vectorized version of 'left | right', where right may be a _LazyOperand """
+    return _truth(_where_lazy(left, values, True, right))
+
+
+def _and_values_lazy(left, values, right):
+    """ The vectorized version of 'left and right', where right may be a _LazyOperand """
+    return _where_lazy(left, values, right, left)
+
+
+def _or_values_lazy(left, values, right):
+    """ The vectorized version of 'left or right', where right may be a _LazyOperand """
+    return _where_lazy(left, values, left, right)
+
+
+_LAZY_FUNCTIONS = {'&': _and_lazy, '|': _or_lazy, 'and': _and_values_lazy, 'or': _or_values_lazy}
+
+
+def _power(base, exponent):
+    """ The vectorized version of base ** exponent. np.power raises an error for the negative integer powers of
+    integers, where python returns floats: the powers are computed on floats when an integer exponent is negative. """
+    base, exponent = np.asarray(base), np.asarray(exponent)
+    if base.dtype.kind in 'biu' and exponent.dtype.kind in 'biu' and np.any(exponent < 0):
+        return np.float_power(base, exponent)
+    return np.power(base, exponent)
+
+
+def _log(values, base=math.e):
+    """ The vectorized version of math.log(x, base) """
+    return np.log(values) / np.log(base)
+
+
+def _get_call_ufuncs():
+    # type: (...) -> Dict[Callable, Tuple[Callable, Tuple[int, ...]]]
+    """
+    Returns the numpy versions of the functions of the math module and of the builtins, with the numbers of positional
+    arguments that they support.
+    """
+    names = {'sqrt': 'sqrt', 'exp': 'exp', 'expm1': 'expm1', 'log10': 'log10', 'log2': 'log2', 'log1p': 'log1p',
+             'sin': 'sin', 'cos': 'cos', 'tan': 'tan', 'asin': 'arcsin', 'acos': 'arccos', 'atan': 'arctan',
+             'sinh': 'sinh', 'cosh': 'cosh', 'tanh': 'tanh', 'asinh': 'arcsinh', 'acosh': 'arccosh',
+             'atanh': 'arctanh', 'fabs': 'fabs', 'floor': 'floor', 'ceil': 'ceil', 'trunc': 'trunc',
+             'degrees': 'degrees', 'radians': 'radians', 'isnan': 'isnan', 'isinf': 'isinf', 'isfinite': 'isfinite'}
+    binary_names = {'atan2': 'arctan2', 'hypot': 'hypot', 'copysign': 'copysign', 'fmod': 'fmod',
+                    'pow': 'float_power'}
+
+    ufuncs = dict()
+    for names_, nb_args in ((names, (1, )), (binary_names, (2, ))):
+        for name, np_name in names_.items():
+            if hasattr(math, name):
+                ufuncs[getattr(math, name)] = getattr(np, np_name), nb_args
+    ufuncs[math.log] = _log, (1, 2)
+    ufuncs[builtins.abs] = np.absolute, (1, )
+    ufuncs[builtins.pow] = np.power, (2, )
+    return ufuncs
+
+
+_CALL_UFUNCS = _get_call_ufuncs()
+
+# the functions performing arithmetic on their operands. Python performs it on booleans as on integers (True + True is
+# 2), while numpy performs logical operations on boolean arrays (np.add gives True): booleans are converted first.
+_ARITHMETIC_FUNCTIONS = set(_UNARY_UFUNCS.values()) | {_BINARY_UFUNCS[symbol] for symbol in _BINARY_UFUNCS
+                                                       if symbol not in _COMPARISON_SYMBOLS} \
+    | {function for function, _ in _CALL_UFUNCS.values()} | {_power}
+
+# the ones whose results are booleans
+_PREDICATE_FUNCTIONS = {np.isnan, np.isinf, np.isfinite}
+
+
+def _as_number(values):
+    """ Converts booleans and arrays of booleans to integers, and returns other values unchanged """
+    if isinstance(values, bool):
+        return int(values)
+    dtype = getattr(values, 'dtype', None)
+    if dtype is not None and dtype.kind == 'b':
+        return values.astype(np.int_)
+    return values
+
+
+# ------- element-wise logical operators
+def _is_integer(value):
+    """ Returns True if value is an array (or series) of booleans or integers """
+    dtype = getattr(value, 'dtype', None)
+    return dtype is not None and dtype.kind in 'biu'
+
+
+def _combine(values, bitwise, logical, python):
+    result = values[0]
+    for value in values[1:]:
+        if _is_integer(result) and _is_integer(value):
+            result = bitwise(result, value)
+        elif hasattr(result, 'dtype') or hasattr(value, 'dtype'):
+            result = logical(result, value)
+        else:
+            result = python(result, value)
+    return result
+
+
+def logical_and(*values):
+    """
+    The element-wise version of '&': `values[0] & values[1] & ...` for arrays of booleans or integers (as numpy
+    does), `np.logical_and` for other arrays, and the logical '&' of mini_lambda for other objects.
+    """
+    return _combine(values, operator.and_, np.logical_and, lambda left, right: bool(left) and bool(right))
+
+
+def logical_or(*values):
+    """
+    The element-wise version of '|': `values[0] | values[1] | ...` for arrays of booleans or integers (as numpy
+    does), `np.logical_or` for other arrays, and the logical '|' of mini_lambda for other objects.
+    """
+    return _combine(values, operator.or_, np.logical_or, lambda left, right: bool(left) or bool(right))
+
+
+def logical_xor(*values):
+    """
+    The element-wise version of '^': `values[0] ^ values[1] ^ ...` for arrays of booleans or integers (as numpy
+    does), `np.logical_xor` for other arrays, and the logical '^' of mini_lambda for other objects.
+    """
+    return _combine(values, operator.xor, np.logical_xor, lambda left, right: bool(left) != bool(right))
+
+
+def logical_not(value):
+    """
+    The element-wise version of 'not': `~value` for arrays of booleans, `np.logical_not` for other arrays and 'not'
+    for other objects.
+    """
+    dtype = getattr(value, 'dtype', None)
+    if dtype is None:
+        return not value
+    elif dtype.kind == 'b':
+        return ~value
+    else:
+        return np.logical_not(value)
+
+
+_ELEMENTWISE_FUNCTIONS = {'&': logical_and, '|': logical_or, '^': logical_xor, 'and': logical_and,
+                          'or': logical_or}
+
+
+class _ElementwiseRewriter(NodeTransformer):
+    """ Replaces the logical operators with their element-wise version """
+
+    def _call(self, expression, function, *operands):
+        return type(expression)._get_expression_for_method_with_args(function, *operands)
+
+    def visit_logical_op(self, expression, node):
+        return self._call(expression, _ELEMENTWISE_FUNCTIONS[node.symbol], *node.args)
+
+    def visit_bool_op(self, expression, node):
+        return self._call(expression, _ELEMENTWISE_FUNCTIONS[node.symbol], *node.args)
+
+    def visit_nary_op(self, expression, node):
+        if node.symbol in ('&', '|'):
+            return self._call(expression, _ELEMENTWISE_FUNCTIONS[node.symbol], *node.args)
+        return expression
+
+    def visit_call(self, expression, node):
+        if _is_not(node):
+            return self._call(expression, logical_not, node.args[0])
+        return expression
+
+
+def elementwise(expression  # type: _LambdaExpressionBase
+                ):
+    # type: (...) -> _LambdaExpressionBase
+    """
+    Returns a version of `expression` where the logical operators `&`, `|`, `^`, `Not`, `And`, `Or`, `All_`, `Any_`,
+    `AllOf` and `AnyOf` are performed element-wise, so that the expression can be evaluated with arrays or series as
+    input (for example `(X > 0) & (X < 1)` with `X` from `mini_lambda.vars.numpy_`). They are replaced with calls to
+    `logical_and`, `logical_or`, `logical_xor` and `logical_not`, that use the bitwise operators for arrays of booleans
+    and integers, as numpy does, and the numpy logical functions for other arrays. Note that all operands are then
+    evaluated.
+
+    :param expression:
+    :return:
+    """
+    return _ElementwiseRewriter().transform(expression)
+
+
+class BatchStep(object):
+    """
+    An operation of a batch function: `function(*args, **kwargs)`, where the positional arguments at the positions
+    listed in `dynamic` are the results of previous steps. `release` lists the previous steps whose result is not used
+    after this one.
+    """
+    __slots__ = ('function', 'args', 'dynamic', 'kwargs', 'release')
+
+    def __init__(self,
+                 function,  # type: Callable
+                 args,      # type: Tuple
+                 dynamic,   # type: Tuple[Tuple[int, int], ...]
+                 kwargs     # type: Dict[str, Any]
+                 ):
+        self.function = function
+        self.args = args
+        self.dynamic = dynamic
+        self.kwargs = kwargs
+        self.release = ()
+
+
+class _StepResult(object):
+    """ The reference to the result of a step, used as an operand while planning """
+    __slots__ = ('index', )
+
+    def __init__(self, index):
+        self.index = index
+
+
+def _to_native_dtype(result):
+    """ Converts an array of objects returned by np.frompyfunc to a numeric dtype, when its elements allow it """
+    if isinstance(result, np.ndarray) and result.dtype == object and result.size > 0:
+        try:
+            converted = np.array(result.tolist())
+        except (TypeError, ValueError):
+            return result
+        if converted.shape == result.shape and converted.dtype != object:
+            return converted
+    return result
+
+
+def _elementwise(fun, nb_args):
+    """ Returns a function applying fun on each element of its nb_args array arguments """
+    ufunc = np.frompyfunc(fun, nb_args, 1)
+
+    def _apply_elementwise(*arrays):
+        return _to_native_dtype(ufunc(*arrays))
+
+    return _apply_elementwise
+
+
+def _apply_node_function(node, args, dynamic):
+    """ Returns a function performing node.apply() on the values of the dynamic operands of node """
+    args = list(args)
+    kwargs = node.kwargs
+
+    def _apply_node(*values):
+        for (position, _), value in zip(dynamic, values):
+            args[position] = value
+        return node.apply(tuple(args), kwargs)
+
+    return _apply_node
+
+
+# the functions that never raise errors nor warn, whatever the values of their operands. The other ones (divisions,
+# powers, logarithms, square roots...) may fail for the elements where a lazy operand is not selected.
+_TOTAL_FUNCTIONS = {np.add, np.subtract, np.multiply, np.negative, np.positive, np.invert, np.absolute, np.fabs,
+                    np.floor, np.ceil, np.trunc, np.degrees, np.radians, np.isnan, np.isinf, np.isfinite,
+                    np.copysign, np.logical_and, np.logical_or, np.logical_xor, np.logical_not, _where,
+                    _and_values, _or_values, logical_and, logical_or, logical_xor, logical_not} \
+    | {_BINARY_UFUNCS[symbol] for symbol in _COMPARISON_SYMBOLS}
+
+
+class _BatchPlanner(object):
+    """ Translates the nodes of an expression into a list of BatchSteps. Step 0 is the input array itself. """
+
+    def __init__(self):
+        self.steps = [None]  # type: List[Optional[BatchStep]]
+        self.results = dict()  # type: Dict[int, Any]
+        self.numbers = set()  # the indices of the steps whose result is never boolean
+        self.converted = dict()  # type: Dict[int, _StepResult]
+        self.masked = set()  # the ids of the lazy sub-expressions whose lazy operands are evaluated on their elements
+
+    # ----- building blocks
+    def operand(self, operand):
+        """ Returns the constant value of operand, or the _StepResult computing it """
+        if not isinstance(operand, _LambdaExpressionBase):
+            return operand
+        return self.results[id(operand)]
+
+    def add_step(self, function, *operands):
+        """ Adds a step calling function on the operands, that may be _StepResults. Returns its _StepResult """
+        dynamic = tuple((i, operand.index) for i, operand in enumerate(operands) if isinstance(operand, _StepResult))
+        if len(dynamic) == 0:
+            # all operands are constant (this may happen for operands that were not folded, such as impure calls)
+            return function(*operands)
+        args = tuple(None if isinstance(operand, _StepResult) else operand for operand in operands)
+        self.steps.append(BatchStep(function, args, dynamic, {}))
+        return _StepResult(len(self.steps) - 1)
+
+    def number(self, operand):
+        """ Returns operand converted to a number if it may be a boolean, see _as_number """
+        if not isinstance(operand, _StepResult):
+            return _as_number(operand)
+        elif operand.index in self.numbers:
+            return operand
+        elif operand.index not in self.converted:
+            # each result is converted once, even if it is used by several operations
+            self.converted[operand.index] = self.add_step(_as_number, operand)
+            self.numbers.add(self.converted[operand.index].index)
+        return self.converted[operand.index]
+
+    def lazy_operand(self, operand):
+        """ Returns the constant value of operand, or a _LazyOperand evaluating it on the selected elements """
+        if _is_constant(operand):
+            return _constant_value(operand)
+        return _LazyOperand(_get_numpy_function(operand))
+
+    def visit_masked(self, node):
+        """ Adds the step performing the operation of a lazy node, whose lazy operands are only evaluated on the
+        elements where they are selected, and returns its result """
+        result = self.operand(node.args[0])
+        if node.kind == NODE_IF_ELSE:
+            return self.add_step(_where_lazy, result, _StepResult(0), self.lazy_operand(node.args[1]),
+                                 self.lazy_operand(node.args[2]))
+        function = _LAZY_FUNCTIONS[node.symbol]
+        for operand in node.args[1:]:
+            result = self.add_step(function, result, _StepResult(0), self.lazy_operand(operand))
+        return result
+
+    def add_result_step(self, function, *operands):
+        """ Adds a step calling function on the operands, and records whether its result is never boolean """
+        result = self.add_step(function, *operands)
+        if isinstance(result, _StepResult) and function in _ARITHMETIC_FUNCTIONS \
+                and function not in _PREDICATE_FUNCTIONS:
+            self.numbers.add(result.index)
+        return result
+
+    def add_elementwise_expression(self, expression):
+        """ Adds a step evaluating expression on each element of the input """
+        return self.add_step(_elementwise(expression._fun, 1), _StepResult(0))
+
+    def add_elementwise_node(self, expression, node):
+        """ Adds a step applying node on each element of its operands """
+        if any(isinstance(arg, _LambdaExpressionBase) for _, arg in node.kwargs):
+            return self.add_elementwise_expression(expression)
+        operands = [self.operand(arg) for arg in node.args]
+        args = tuple(None if isinstance(operand, _StepResult) else operand for operand in operands)
+        dynamic = tuple((i, operand.index) for i, operand in enumerate(operands) if isinstance(operand, _StepResult))
+        if len(dynamic) == 0:
+            return self.add_elementwise_expression(expression)
+        function = _elementwise(_apply_node_function(node, args, dynamic), len(dynamic))
+        return self.add_step(function, *(operand for operand in operands if isinstance(operand, _StepResult)))
+
+    # ----- planning
+    def is_lazy(self, node):
+        """ Returns True if the operation of node does not always evaluate its operands after the first one """
+        return node.kind in (NODE_LOGICAL_OP, NODE_BOOL_OP, NODE_IF_ELSE) \
+            or (node.kind == NODE_NARY_OP and node.symbol in ('&', '|'))
+
+    def is_total(self, node):
+        """ Returns True if the translation of node never raises errors nor warns, whatever its operands """
+        if node.kind in (NODE_VAR, NODE_CONSTANT):
+            return True
+        elif node.kind in (NODE_CALL, NODE_METHOD_CALL) and _get_callee(node)[0] is _is_in:
+            return True
+        return self.get_translation(node)[0] in _TOTAL_FUNCTIONS
+
+    def plan(self, expression):
+        """ Plans the steps computing expression, and returns its _StepResult or constant value """
+        # the sub-expressions that can be fully translated, the ones that can be translated to numpy operations that
+        # never fail, and the ones evaluated element by element as a whole
+        translatable = set()
+        total = set()
+        elementwise = set()
+        for expr in walk(expression):
+            node = expr._node
+            if node is None:
+                continue
+            elif node.kind in (NODE_VAR, NODE_CONSTANT):
+                translatable.add(id(expr))
+                total.add(id(expr))
+            elif self.is_lazy(node) and any(isinstance(arg, _LambdaExpressionBase) and id(arg) not in translatable
+                                            for arg in node.args[1:]):
+                # the lazy operands are evaluated element by element, only where they are selected
+                elementwise.add(id(expr))
+            elif self.get_translation(node) is not None and all(id(child) in translatable for child in node.children):
+                translatable.add(id(expr))
+                if (node.kind in (NODE_IF_ELSE, NODE_BOOL_OP) or node.symbol in ('&', '|')) \
+                        and any(isinstance(arg, _LambdaExpressionBase) and id(arg) not in total
+                                for arg in node.args[1:]):
+                    # a lazy operand may raise errors or warn for the elements where it is not selected (2 ** x,
+                    # Sqrt(x)...): the lazy operands are only evaluated on the elements where they are selected
+                    self.masked.add(id(expr))
+                elif self.is_total(node) and all(id(child) in total for child in node.children):
+                    total.add(id(expr))
+
+        needed = _get_needed(expression, elementwise, self.masked)
+        for expr in walk(expression):
+            if id(expr) not in needed:
+                continue
+            node = expr._node
+            if node is None or id(expr) in elementwise:
+                result = self.add_elementwise_expression(expr)
+            else:
+                result = self.visit(expr, node)
+            self.results[id(expr)] = result
+        return self.results[id(expression)]
+
+    def get_translation(self, node):
+        # type: (...) -> Optional[Tuple[Callable, Tuple]]
+        """
+        Returns the numpy function performing the operation of node on arrays, and the operands to call it with. Returns
+        None if node can not be translated.
+        """
+        kind = node.kind
+        if kind == NODE_UNARY_OP and node.symbol in _UNARY_UFUNCS:
+            return _UNARY_UFUNCS[node.symbol], node.args
+        elif kind == NODE_BINARY_OP and node.symbol == '**' and not _is_array_exponent(node.args[1]):
+            return _power, node.args
+        elif kind == NODE_BINARY_OP and node.symbol in _COMPARISON_SYMBOLS:
+            function = _get_comparison(node.symbol, node.args)
+            return None if function is None else (function, node.args)
+        elif kind in (NODE_BINARY_OP, NODE_NARY_OP) and node.symbol in _BINARY_UFUNCS:
+            return _BINARY_UFUNCS[node.symbol], node.args
+        elif kind in (NODE_LOGICAL_OP, NODE_NARY_OP) and node.symbol in _LOGICAL_UFUNCS:
+            return _LOGICAL_UFUNCS[node.symbol], node.args
+        elif kind == NODE_BOOL_OP:
+            return _BOOL_OP_FUNCTIONS[node.symbol], node.args
+        elif _is_not(node):
+            return np.logical_not, node.args
+        elif kind == NODE_COMPARE_CHAIN:
+            if any(_get_comparison(symbol, node.args[i:i + 2]) is None for i, symbol in enumerate(node.symbol)):
+                return None
+            return np.logical_and, node.args
+        elif kind == NODE_IF_ELSE:
+            return _where, node.args
+        elif kind in (NODE_CALL, NODE_METHOD_CALL) and len(node.kwargs) == 0:
+            function, args = _get_callee(node)
+            if function in (logical_and, logical_or, logical_xor, logical_not):
+                return function, args
+            elif function is _is_in:
+                if _is_constant(args[1]) and isinstance(_constant_value(args[1]), (set, frozenset)):
+                    lookup = _get_lookup_array(_constant_value(args[1]))
+                    if lookup is not None:
+                        return _make_isin(lookup), args[:1]
+                return None
+            try:
+                ufunc, nb_args = _CALL_UFUNCS[function]
+            except (KeyError, TypeError):
+                # unknown or unhashable function
+                return None
+            if len(args) in nb_args:
+                if ufunc is np.power and not _is_array_exponent(args[1]):
+                    return _power, args
+                return ufunc, args
+        return None
+
+    def visit(self, expression, node):
+        """ Adds the steps performing the operation of node and returns its result """
+        kind = node.kind
+        if kind == NODE_VAR:
+            return _StepResult(0)
+        elif kind == NODE_CONSTANT:
+            return node.args[0]
+
+        translation = self.get_translation(node)
+        if translation is None:
+            return self.add_elementwise_node(expression, node)
+        elif id(expression) in self.masked:
+            return self.visit_masked(node)
+        function, args = translation
+        operands = [self.operand(arg) for arg in args]
+        if function in _ARITHMETIC_FUNCTIONS:
+            operands = [self.number(operand) for operand in operands]
+
+        if kind == NODE_COMPARE_CHAIN:
+            result = None
+            for i, symbol in enumerate(node.symbol):
+                comparison = self.add_step(_get_comparison(symbol, node.args[i:i + 2]), operands[i], operands[i + 1])
+                result = comparison if result is None else self.add_step(np.logical_and, result, comparison)
+            return result
+
+        elif kind in (NODE_NARY_OP, NODE_BOOL_OP):
+            result = operands[0]
+            for operand in operands[1:]:
+                result = self.add_result_step(function, result, operand)
+            return result
+
+        else:
+            return self.add_result_step(function, *operands)
+
+
+def _get_needed(expression, elementwise, masked):
+    """ Returns the ids of the sub-expressions whose value is needed to compute expression. The sub-expressions
+    evaluated element by element and the lazy operands of the masked ones are computed separately. """
+    needed = set()
+    to_visit = [expression]
+    while to_visit:
+        expr = to_visit.pop()
+        if id(expr) in needed:
+            continue
+        needed.add(id(expr))
+        if id(expr) in masked:
+            to_visit.append(expr._node.args[0])
+        elif id(expr) not in elementwise and expr._node is not None:
+            to_visit.extend(expr._node.children)
+    return needed
+
+
+def _is_number(value):
+    """ Returns True if value is a (python or numpy) number or boolean """
+    return isinstance(value, (Number, np.number, np.bool_))
+
+
+def _make_string_comparison(symbol):
+    """ Returns the vectorized version of a comparison with a string: the ufunc for arrays of strings, and the python
+    comparison applied element by element for other arrays, that numpy can not compare with strings """
+    ufunc = _BINARY_UFUNCS[symbol]
+    compare_elementwise = _elementwise(_COMPARISON_OPERATORS[symbol], 2)
+
+    def _compare_strings(left, right):
+        if {np.asarray(left).dtype.kind, np.asarray(right).dtype.kind} in ({'U'}, {'S'}):
+            return ufunc(left, right)
+        return compare_elementwise(left, right)
+
+    return _compare_strings
+
+
+def _get_comparison(symbol, operands):
+    """
+    Returns the vectorized version of the comparison of operands: the ufunc if their constants are numbers, see
+    `_make_string_comparison` if one of them is a string, or None. numpy compares the other constants (tuples...) as
+    arrays, or raises errors.
+    """
+    constants = [_constant_value(operand) for operand in operands if _is_constant(operand)]
+    if all(_is_number(constant) for constant in constants):
+        return _BINARY_UFUNCS[symbol]
+    elif all(_is_number(constant) or isinstance(constant, (str, bytes)) for constant in constants):
+        return _make_string_comparison(symbol)
+    return None
+
+
+def _get_lookup_array(container):
+    """ Returns the sorted array of the elements of a set used by np.isin, or None if they are not numbers or strings
+    of the same kind """
+    try:
+        lookup = np.array(sorted(container))
+    except TypeError:
+        return None
+    return lookup if lookup.dtype.kind in 'biufUS' else None
+
+
+def _make_isin(lookup):
+    """ Returns the vectorized version of 'x in container', where lookup is the sorted array of its elements """
+    def _isin(values):
+        return np.isin(values, lookup, assume_unique=True)
+    return _isin
+
+
+def _release_results(steps, result):
+    """ Sets the `release` attribute of each step, so that intermediate arrays are freed as soon as possible """
+    last_use = dict()
+    for i, step in enumerate(steps):
+        if step is not None:
+            for _, index in step.dynamic:
+                last_use[index] = i
+    if isinstance(result, _StepResult):
+        last_use.pop(result.index, None)
+    released = dict()
+    for index, i in last_use.items():
+        released.setdefault(i, []).append(index)
+    for i, indices in released.items():
+        steps[i].release = tuple(indices)
+
+
+def _run(steps, values):
+    """ Executes the steps on the input array and returns the results of all steps that are not released """
+    results = [None] * len(steps)
+    results[0] = values
+    for i in range(1, len(steps)):
+        step = steps[i]
+        args = list(step.args)
+        for position, index in step.dynamic:
+            args[position] = results[index]
+        results[i] = step.function(*args, **step.kwargs)
+        for index in step.release:
+            results[index] = None
+    return results
+
+
+def _is_ufunc_step(step):
+    """ Returns True if step is a call to a ufunc, that can write its result into a preallocated array with `out=` """
+    return isinstance(step.function, np.ufunc) and step.function.nout == 1 and len(step.kwargs) == 0
+
+
+def _assign_buffers(steps, index, dtypes):
+    # type: (...) -> Tuple[Dict[int, int], List[np.dtype]]
+    """
+    Assigns a scratch buffer to each ufunc step whose output dtype is known (`dtypes` maps their index to the dtypes
+    of their inputs and of their output). A buffer is reused by the next steps as soon as the result that it contains is
+    released, in particular by the step releasing it: ufuncs support an output that is exactly one of their inputs. So
+    the number of buffers is the largest number of results alive at the same time, instead of the number of steps.
+
+    :return: a tuple (assignment, buffer_dtypes): the buffer number of each step, and the dtype of each buffer
+    """
+    ufunc_steps = {i for i in range(1, len(steps)) if _is_ufunc_step(steps[i])}
+    # the results used by other functions may be returned as views (x.T, x.real...): their buffer is never reused
+    shared = {j for i in range(1, len(steps)) if i not in ufunc_steps for _, j in steps[i].dynamic}
+
+    assignment = dict()
+    buffer_dtypes = []
+    free = []
+    for i in range(1, len(steps)):
+        free.extend(assignment[j] for j in steps[i].release if j in assignment and j not in shared)
+        if i == index or i not in dtypes:
+            continue
+        dtype = dtypes[i][1]
+        for position, number in enumerate(free):
+            if buffer_dtypes[number] == dtype:
+                assignment[i] = free.pop(position)
+                break
+        else:
+            assignment[i] = len(buffer_dtypes)
+            buffer_dtypes.append(dtype)
+    return assignment, buffer_dtypes
+
+
+def _run_chunk(steps, index, chunk, dtypes, buffers, assignment, target, force_target):
+    """
+    Executes the steps on a chunk of the input array and returns the result of step `index`. The ufunc steps write
+    their result into their scratch buffer, or into `target` for the last one, when the dtypes of their inputs are
+    the ones recorded in `dtypes` (so that the dtype of their output is known too). `force_target` makes the last step
+    write into `target` in all cases, casting its result if needed. The dtypes of the ufunc steps are recorded in
+    `dtypes` when they are not known yet.
+    """
+    results = [None] * len(steps)
+    results[0] = chunk
+    for i in range(1, len(steps)):
+        step = steps[i]
+        args = list(step.args)
+        for position, j in step.dynamic:
+            args[position] = results[j]
+
+        out = None
+        if _is_ufunc_step(step):
+            input_dtypes = tuple(getattr(results[j], 'dtype', None) for _, j in step.dynamic)
+            known = dtypes.get(i)
+            if i == index and target is not None and (force_target or (known is not None and known[0] == input_dtypes)):
+                out = target
+            elif known is not None and known[0] == input_dtypes and i in assignment:
+                out = buffers[assignment[i]][:len(chunk)]
+
+            if out is not None:
+                results[i] = step.function(*args, out=out)
+            else:
+                results[i] = step.function(*args)
+            if known is None:
+                dtypes[i] = input_dtypes, getattr(results[i], 'dtype', None)
+        else:
+            results[i] = step.function(*args, **step.kwargs)
+
+        for j in step.release:
+            results[j] = None
+    return results[index]
+
+
+def _run_chunked(steps, index, values, chunk_size, out):
+    """
+    Executes the steps on consecutive chunks of `chunk_size` elements of values (along their first axis), and writes
+    the results into `out`, or into a new array if `out` is None. After the first chunk, the results of the ufunc steps
+    are written into scratch buffers of the size of a chunk that are allocated once (see `_assign_buffers`): the memory
+    used does not depend on the size of values anymore.
+    """
+    # the ufunc steps dtypes, recorded on the first chunk
+    dtypes = dict()  # type: Dict[int, Tuple[Tuple, np.dtype]]
+    assignment, buffers = dict(), []
+    force_target = out is not None
+
+    for start in range(0, max(len(values), 1), chunk_size):
+        chunk = values[start:start + chunk_size]
+        target = out[start:start + chunk_size] if out is not None else None
+        result = _run_chunk(steps, index, chunk, dtypes, buffers, assignment, target, force_target)
+
+        if start == 0 and chunk_size < len(values):
+            assignment, buffer_dtypes = _assign_buffers(steps, index, dtypes)
+            buffers = [np.empty((chunk_size, ) + values.shape[1:], dtype=dtype) for dtype in buffer_dtypes]
+
+        if result is target:
+            continue
+        result = np.asarray(result)
+        if out is None:
+            out = np.empty(values.shape, dtype=result.dtype)
+            target = out[start:start + chunk_size]
+        elif not force_target and np.result_type(out.dtype, result.dtype) != out.dtype:
+            # the elements of this chunk need a larger dtype than the ones of the previous chunks
+            out = out.astype(np.result_type(out.dtype, result.dtype))
+            target = out[start:start + chunk_size]
+        np.copyto(target, result, casting='same_kind')
+
+    return out
+
+
+def _check_batch_arguments(values, chunk_size, out):
+    """ Raises a ValueError if chunk_size or out can not be used to evaluate values """
+    if chunk_size is not None and (isinstance(chunk_size, bool) or not isinstance(chunk_size, Integral)
+                                   or chunk_size < 1):
+        raise ValueError('chunk_size should be a positive integer, found %r' % (chunk_size, ))
+    if out is not None and (not isinstance(out, np.ndarray) or out.shape != values.shape):
+        raise ValueError('out should be an array with the same shape as the input, %s' % (values.shape, ))
+
+
+def _get_numexpr_function(expression):
+    """ Returns the function evaluating expression with numexpr, or None if numexpr is not installed or can not
+    evaluate it """
+    try:
+        from mini_lambda.numexpr_backend import get_numexpr_function
+    except ImportError:
+        return None
+    return get_numexpr_function(expression)
+
+
+def get_batch_function(expression,       # type: _LambdaExpressionBase
+                       use_numexpr=True  # type: bool
+                       ):
+    # type: (...) -> Callable[..., np.ndarray]
+    """
+    Returns a function evaluating `expression` on each element of an array (see the module documentation). The
+    translation of the expression is performed once, when this function is called.
+
+    The returned function has the same `chunk_size` and `out` optional arguments as `evaluate_batch`.
+
+    :param expression:
+    :param use_numexpr: if True (default) and numexpr is installed, expressions that numexpr can evaluate are evaluated
+        with numexpr in a single pass when the input array has a numeric dtype (see `mini_lambda.numexpr_backend`).
+    :return:
+    """
+    numpy_function = _get_numpy_function(expression)
+    numexpr_function = _get_numexpr_function(expression) if use_numexpr else None
+    if numexpr_function is None:
+        return numpy_function
+
+    from mini_lambda.numexpr_backend import _is_supported_dtype
+
+    def _batch_function(values, chunk_size=None, out=None):
+        values = np.asarray(values)
+        if _is_supported_dtype(values.dtype):
+            # numexpr already evaluates the expression by blocks, without temporary arrays of the size of the input
+            _check_batch_arguments(values, chunk_size, out)
+            return numexpr_function(values, out=out)
+        else:
+            return numpy_function(values, chunk_size=chunk_size, out=out)
+
+    return _batch_function
+
+
+def _get_numpy_function(expression):
+    """ Returns a function evaluating expression on each element of an array with numpy operations """
+    planner = _BatchPlanner()
+    result = planner.plan(expression)
+    steps = planner.steps
+    _release_results(steps, result)
+
+    if isinstance(result, _StepResult):
+        index = result.index
+
+        def _batch_function(values, chunk_size=None, out=None):
+            values = np.asarray(values)
+            _check_batch_arguments(values, chunk_size, out)
+            if values.ndim == 0:
+                result = np.asarray(_run(steps, values)[index])
+                if out is None:
+                    return result
+                np.copyto(out, result, casting='same_kind')
+                return out
+            elif chunk_size is None and out is None:
+                return np.asarray(_run(steps, values)[index])
+            else:
+                return _run_chunked(steps, index, values, int(chunk_size or max(len(values), 1)), out)
+    else:
+        constant = result
+
+        def _batch_function(values, chunk_size=None, out=None):
+            values = np.asarray(values)
+            _check_batch_arguments(values, chunk_size, out)
+            if out is not None:
+                out[...] = constant
+                return out
+            if np.ndim(constant) == 0:
+                return np.full(values.shape, constant)
+            array = np.empty(values.shape, dtype=object)
+            array.fill(constant)
+            return array
+
+    return _batch_function
+
+
+def evaluate_batch(expression,        # type: _LambdaExpressionBase
+                   values,            # type: Any
+                   use_numexpr=True,  # type: bool
+                   chunk_size=None,   # type: int
+                   out=None           # type: np.ndarray
+                   ):
+    # type: (...) -> np.ndarray
+    """
+    Evaluates `expression` on each element of `values` and returns the array of the results (see the module
+    documentation). Use `get_batch_function` or `expression.as_function(vectorize=True)` to translate the expression
+    only once when it is applied to several arrays.
+
+    Divisions by zero and integer overflows follow the numpy semantics: they return inf, nan or 0, or wrap around,
+    instead of raising an error as `expression.evaluate` does. Similarly, fractional powers of negative numbers (such
+    as `x ** 0.5` on negative elements) return nan, where `expression.evaluate` returns a complex number.
+
+    :param expression:
+    :param values: an array, or anything that can be converted to an array with np.asarray
+    :param use_numexpr: if True (default) and numexpr is installed, the expression is evaluated with numexpr when
+        possible (see `get_batch_function`).
+    :param chunk_size: if provided, `values` is evaluated by chunks of `chunk_size` elements along its first axis, and
+        the intermediate results of the numpy operations are written into scratch buffers of the size of a chunk that
+        are reused from one chunk and from one operation to the next. The memory used by the intermediate results then
+        depends on the chunk size instead of the size of `values`. numexpr does not need this.
+    :param out: an optional array with the same shape as `values`, where the results are written and that is
+        returned. The results are cast to its dtype if needed, following the 'same_kind' casting rule of numpy.
+    :return:
+    """
+    return get_batch_function(expression, use_numexpr=use_numexpr)(values, chunk_size=chunk_size, out=out)
@@ -0,0 +1,209 @@
+"""
+Process-wide cache of compiled functions.
+
+Compiling an expression (see `mini_lambda.compiler`) has a one-time cost, that is paid again each time that the same
+expression is created again, for example in each request handler or in each decorator. The functions of this module
+store the compiled functions in a bounded, thread-safe LRU cache keyed by the structure of the expressions (see
+`mini_lambda.nodes.fingerprint`): structurally identical expressions share one compiled function.
+
+Expressions that are only equal to themselves (because they contain constants compared by identity, such as lists
+or closures, or opaque sub-expressions) are never cached: no other expression could reuse their compiled function, and
+the cache would only keep these objects alive. The cached expressions themselves are not kept alive either: the entries
+only hold their flat structure (see `mini_lambda.nodes._get_flat_structure`) and a weak reference to them.
+"""
+from collections import OrderedDict, namedtuple
+import sys
+from threading import Lock
+from types import ModuleType
+from weakref import ref
+
+try:  # python 3.5+
+    from typing import Callable, Any
+except ImportError:
+    pass
+
+from mini_lambda.base import _LambdaExpressionBase
+from mini_lambda.compiler import compile_expression
+from mini_lambda.nodes import walk, fingerprint, _get_flat_structure, _constant_key
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+""" The statistics of a CompileCache: hits, misses and evictions counters, maximum and current number of entries """
+
+
+class CompileCache(object):
+    """
+    A bounded, thread-safe LRU cache of compiled functions, keyed by the structure of the expressions.
+    """
+    __slots__ = ('_entries', '_lock', 'maxsize', 'hits', 'misses', 'evictions')
+
+    def __init__(self,
+                 maxsize=256  # type: int
+                 ):
+        """
+        :param maxsize: the maximum number of compiled functions kept in the cache. 0 disables the cache.
+        """
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self,
+            expression  # type: _LambdaExpressionBase
+            ):
+        # type: (...) -> Callable[[Any], Any]
+        """
+        Returns the compiled function for `expression`, from the cache if a structurally identical expression was
+        compiled before. Otherwise the expression is compiled and the result is stored in the cache.
+
+        :param expression:
+        :return:
+        """
+        if self.maxsize <= 0:
+            with self._lock:
+                self.misses += 1
+            return compile_expression(expression)
+
+        # entries are indexed by fingerprint, and hold the flat structure of the expression to check that it is really
+        # structurally equal, as well as a weak reference to it so that this check is skipped for the same expression
+        key = fingerprint(expression)
+        with self._lock:
+            entry = self._entries.get(key)
+
+        structure = None
+        if entry is not None:
+            if entry[0]() is not expression:
+                structure = _get_flat_structure(expression)
+            if structure is None or structure == entry[1]:
+                with self._lock:
+                    self.hits += 1
+                    if key in self._entries:
+                        self._move_to_end(key)
+                return entry[2]
+
+        with self._lock:
+            self.misses += 1
+
+        # compile outside of the lock: several threads may compile the same expression, the last one is kept
+        compiled = compile_expression(expression)
+        if _is_shareable(expression):
+            if structure is None:
+                structure = _get_flat_structure(expression)
+            with self._lock:
+                self._entries[key] = (ref(expression), structure, compiled)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return compiled
+
+    def _move_to_end(self, key):
+        """ Marks the entry for key as the most recently used one """
+        try:
+            self._entries.move_to_end(key)
+        except AttributeError:
+            # python 2
+            self._entries[key] = self._entries.pop(key)
+
+    def info(self):
+        # type: (...) -> CacheInfo
+        """ Returns the statistics of this cache """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self._entries))
+
+    def clear(self):
+        """ Removes all entries from this cache and resets its statistics """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def resize(self,
+               maxsize  # type: int
+               ):
+        # type: (...) -> int
+        """
+        Changes the maximum number of entries of this cache, evicting the least recently used ones if needed.
+
+        :param maxsize: the new maximum number of entries. 0 disables the cache.
+        :return: the previous maximum number of entries
+        """
+        with self._lock:
+            previous = self.maxsize
+            self.maxsize = maxsize
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return previous
+
+
+def _is_shareable(expression  # type: _LambdaExpressionBase
+                  ):
+    # type: (...) -> bool
+    """ Returns True if expression only contains constants compared by value, and no opaque sub-expression """
+    for expr in walk(expression):
+        node = expr._node
+        if node is None:
+            return False
+        for value in node.constants + (node.method,):
+            if (_constant_key(value)[0] == 'id' or type(value).__hash__ is object.__hash__) and not _is_global(value):
+                # compared by identity
+                return False
+    return True
+
+
+def _is_global(value):
+    # type: (...) -> bool
+    """
+    Returns True if value can be found by its name in its module, such as the classes and functions defined at the top
+    level of a module: the same object is then used by all the expressions referencing it. Other constants compared by
+    identity (closures such as the ones created by a decorator, instances that are not hashed by value...) are created
+    again with each expression, so that the compiled function of an expression containing them would never be reused.
+    """
+    if value is None or isinstance(value, ModuleType):
+        return True
+    try:
+        return getattr(sys.modules[value.__module__], value.__name__) is value
+    except (AttributeError, KeyError, TypeError):
+        return False
+
+
+# the cache used by as_function() and _()
+_COMPILE_CACHE = CompileCache()
+
+
+def get_compiled_function(expression  # type: _LambdaExpressionBase
+                          ):
+    # type: (...) -> Callable[[Any], Any]
+    """
+    Returns the compiled function for `expression` (see `mini_lambda.compile_expression`), reusing the one of a
+    structurally identical expression if it is in the process-wide cache.
+
+    :param expression:
+    :return:
+    """
+    return _COMPILE_CACHE.get(expression)
+
+
+def compile_cache_info():
+    # type: (...) -> CacheInfo
+    """ Returns the statistics (hits, misses, evictions, maxsize, currsize) of the process-wide compile cache """
+    return _COMPILE_CACHE.info()
+
+
+def clear_compile_cache():
+    """ Removes all entries from the process-wide compile cache and resets its statistics """
+    _COMPILE_CACHE.clear()
+
+
+def set_compile_cache_size(maxsize  # type: int
+                           ):
+    # type: (...) -> int
+    """
+    Changes the maximum number of compiled functions kept in the process-wide compile cache (256 by default). 0 disables
+    the cache.
+
+    :param maxsize:
+    :return: the previous maximum size
+    """
+    return _COMPILE_CACHE.resize(maxsize)
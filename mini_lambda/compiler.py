@@ -0,0 +1,590 @@
+"""
+Compilation of lambda expressions into a single, flat python function.
+
+An expression built with mini_lambda is a chain of nested closures: evaluating `x ** 2 + 3 * x - 1` goes through one
+python frame per node, plus the `evaluate` dispatch of each operand. The functions in this module use the
+ExpressionNode describing each node to generate the source code of one equivalent function, for example
+
+    def _compiled(x):
+        return (((x ** _c0) + (_c1 * x)) - _c2)
+
+where the constants `_c0`, `_c1`... are bound as closure variables. This function is then compiled once with the
+python `compile` builtin.
+
+Structurally identical sub-expressions, such as `s.strip()` in `(s.strip() == 'a') | (Len(s.strip()) > 10)`, are
+only evaluated once per call: their result is stored in a temporary variable and reused. Sub-expressions calling
+functions marked as impure (see `mini_lambda.mark_impure`) are not shared.
+"""
+from keyword import iskeyword
+import math
+import operator
+import re
+
+try:  # python 3.5+
+    from typing import Callable, Any, List, Dict, Set, Tuple, Optional
+except ImportError:
+    pass
+
+from mini_lambda.base import _LambdaExpressionBase, _is_impure, NODE_VAR, NODE_CONSTANT, NODE_UNARY_OP, \
+    NODE_BINARY_OP, NODE_LOGICAL_OP, NODE_CALL, NODE_METHOD_CALL, NODE_GETATTR, NODE_GETITEM, NODE_BOOL_OP, \
+    NODE_IF_ELSE, NODE_NARY_OP, NODE_COMPARE_CHAIN, _xor
+from mini_lambda.nodes import walk, _get_structure
+
+
+# maximum nesting of a generated python expression. Deeper sub-expressions are stored in temporary variables, so that
+# the python parser and compiler never see deeply nested code.
+_MAX_NESTING = 32
+
+# maximum nesting of the `if` blocks generated for the short-circuit operators (the python tokenizer does not
+# support more than 100 indentation levels). Deeper lazy operands are compiled to their own function.
+_MAX_BLOCK_DEPTH = 64
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_GENERATED_NAME = re.compile(r'^_[ct][0-9]+$')
+
+# internal actions of the code generator
+_VISIT = 0
+_BUILD = 1
+_OPEN_BLOCK = 2
+_CLOSE_BLOCK = 3
+
+
+def compile_expression(expression  # type: _LambdaExpressionBase
+                       ):
+    # type: (...) -> Callable[[Any], Any]
+    """
+    Compiles the provided lambda expression into a single python function with one argument. Calling this function
+    is equivalent to calling `expression.evaluate`, but does not go through the nested closures of the expression.
+
+    Nodes that can not be described (expressions created with a custom `fun`) are still supported: they are called
+    through their own `evaluate` method from the generated code.
+
+    :param expression: the lambda expression to compile
+    :return: a python function
+    """
+    # the lazy sub-expressions nested too deeply are compiled to their own function, bound as a constant of the
+    # function of their parent. They are generated after their parent and compiled before it.
+    generators = []
+    to_generate = [expression]
+    while len(to_generate) > 0:
+        generator = _CodeGenerator(to_generate.pop())
+        generators.append((generator, generator.generate()))
+        to_generate.extend(generator.nested.values())
+
+    functions = dict()
+    for generator, (source, constants) in reversed(generators):
+        for index, expr in generator.nested.items():
+            constants[index] = functions[id(expr)]
+        namespace = dict()
+        exec(compile(source, '<mini_lambda>', 'exec'), namespace)
+        functions[id(generator.root)] = namespace['_make'](constants)
+    return functions[id(expression)]
+
+
+def generate_source(expression  # type: _LambdaExpressionBase
+                    ):
+    """
+    Returns the python source code generated for `expression`, together with the list of constants to bind. The source
+    defines a factory function `_make(constants)` returning the compiled function. The lazy sub-expressions nested too
+    deeply to be generated in the same function are bound as constants, that `compile_expression` replaces with their
+    own compiled function.
+
+    :param expression: the lambda expression to compile
+    :return: a tuple (source, constants)
+    """
+    return _CodeGenerator(expression).generate()
+
+
+def lower_to_operator(expression  # type: _LambdaExpressionBase
+                      ):
+    # type: (...) -> Optional[Callable[[Any], Any]]
+    """
+    Returns the callable implemented in C by the `operator` module that is equivalent to `expression`, if it is a
+    simple access on its variable:
+
+     * a chain of attributes such as `x.user.name` is lowered to `operator.attrgetter('user.name')`,
+     * an item with a constant key such as `d['price']` or `l[1:3]` is lowered to `operator.itemgetter(key)`,
+     * a method called with constant arguments such as `s.lower()` is lowered to `operator.methodcaller('lower')`.
+
+    Otherwise None is returned.
+
+    :param expression:
+    :return: an operator.attrgetter, itemgetter or methodcaller, or None
+    """
+    node = expression._node
+    if node is None:
+        return None
+
+    if node.kind == NODE_GETATTR:
+        names = []
+        while node is not None and node.kind == NODE_GETATTR and _is_identifier(node.symbol):
+            names.append(node.symbol)
+            node = node.args[0]._node
+        if node is not None and node.kind == NODE_VAR:
+            return operator.attrgetter('.'.join(reversed(names)))
+
+    elif node.kind == NODE_GETITEM:
+        target, key = node.args
+        if target._node is not None and target._node.kind == NODE_VAR and not isinstance(key, _LambdaExpressionBase):
+            return operator.itemgetter(key)
+
+    elif node.kind == NODE_METHOD_CALL:
+        target, method_name = node.args[0]._node, node.symbol
+        if target is not None and method_name == '__call__' and target.kind == NODE_GETATTR:
+            # s.lower() is the call of the attribute s.lower
+            target, method_name = target.args[0]._node, target.symbol
+        if target is not None and target.kind == NODE_VAR \
+                and not any(isinstance(arg, _LambdaExpressionBase) for arg in node.operands[1:]):
+            return operator.methodcaller(method_name, *node.args[1:], **dict(node.kwargs))
+
+    return None
+
+
+class _Operand(object):
+    """ The generated code for one operand: a python expression, its nesting depth and the block it belongs to """
+    __slots__ = ('code', 'depth', 'level', 'block')
+
+    def __init__(self, code, depth, level):
+        self.code = code
+        self.depth = depth
+        self.level = level
+        self.block = None
+
+
+class _CodeGenerator(object):
+    """
+    Generates the source code of a single function equivalent to an expression.
+
+    The expression tree is walked iteratively (so that arbitrarily deep expressions can be compiled), in evaluation
+    order. Each node is turned into a python expression string built from the code of its operands. When a statement
+    has to be generated (a temporary variable or an `if` block for a short-circuit operator), all pending operands that
+    would be evaluated before it are first stored in temporary variables, so that the evaluation order is preserved.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.constants = []          # type: List[Any]
+        self._constant_names = dict()
+        self.nb_temps = 0
+        self.blocks = [[]]           # type: List[List[str]]
+        self.block_ids = [0]         # type: List[int]
+        self.nb_blocks = 1
+        self.operands = []           # type: List[_Operand]
+        self.arg_name = _get_arg_name(root)
+
+        # common sub-expressions: the temporary variable holding the value of each shared key, and its block id
+        self.keys, self.counts, self.unshareable = _get_structural_keys(root)
+        self.shared = dict()         # type: Dict[int, Tuple[str, int]]
+
+        # the lazy sub-expressions nested too deeply, compiled to their own function, by index in the constants
+        self.nested = dict()         # type: Dict[int, _LambdaExpressionBase]
+
+    # ------- helpers
+    def constant(self, value):
+        """ Returns the name of the closure variable bound to `value` """
+        try:
+            return self._constant_names[id(value)]
+        except KeyError:
+            name = '_c%s' % len(self.constants)
+            self.constants.append(value)  # this also guarantees that the id will not be reused
+            self._constant_names[id(value)] = name
+            return name
+
+    def new_temp(self):
+        name = '_t%s' % self.nb_temps
+        self.nb_temps += 1
+        return name
+
+    def emit(self, lines):
+        """ Appends statement lines to the current block, after storing the pending operands of this block """
+        level = len(self.blocks) - 1
+        for operand in self.operands:
+            if operand.level == level and operand.depth > 0:
+                self.spill(operand)
+        self.blocks[-1].extend(lines)
+
+    def spill(self, operand):
+        """ Stores the value of `operand` in a temporary variable, at the end of the current block """
+        temp = self.new_temp()
+        self.blocks[-1].append('%s = %s' % (temp, operand.code))
+        operand.code = temp
+        operand.depth = 0
+
+    def push(self, code, depth):
+        """ Pushes a new operand on the stack. Too deeply nested operands are stored in a temporary variable """
+        operand = _Operand(code, depth, len(self.blocks) - 1)
+        if depth > _MAX_NESTING:
+            self.emit([])
+            self.spill(operand)
+        self.operands.append(operand)
+
+    def pop(self, n):
+        """ Pops the last n operands from the stack """
+        if n == 0:
+            return []
+        popped = self.operands[-n:]
+        del self.operands[-n:]
+        return popped
+
+    # ------- main loop
+    def generate(self):
+        tasks = [(_VISIT, self.root)]
+        while len(tasks) > 0:
+            action, item = tasks.pop()
+            if action == _VISIT:
+                self.visit(item, tasks)
+            elif action == _BUILD:
+                self.build(item)
+            elif action == _OPEN_BLOCK:
+                self.blocks.append([])
+                self.block_ids.append(self.nb_blocks)
+                self.nb_blocks += 1
+            else:
+                # _CLOSE_BLOCK: attach the statements of the block to the operand that was generated inside it
+                block = self.blocks.pop()
+                self.block_ids.pop()
+                operand = self.operands[-1]
+                operand.level = len(self.blocks) - 1
+                operand.block = block
+
+        result = self.operands.pop()
+        body = self.blocks[0] + ['return %s' % result.code]
+
+        lines = ['def _make(_constants):']
+        if len(self.constants) > 0:
+            lines.append('    %s, = _constants' % ', '.join('_c%s' % i for i in range(len(self.constants))))
+        lines.append('    def _compiled(%s):' % self.arg_name)
+        lines += ['        ' + line for line in body]
+        lines.append('    return _compiled')
+        return '\n'.join(lines) + '\n', self.constants
+
+    def visit(self, expr, tasks):
+        """ Schedules the generation of the code for `expr`: first its operands, then the node itself """
+        if not isinstance(expr, _LambdaExpressionBase):
+            # a constant: bind it
+            self.push(self.constant(expr), 0)
+            return
+
+        node = expr._node
+        if node is None:
+            # opaque node: call its own evaluate method
+            self.push('%s(%s)' % (self.constant(expr.evaluate), self.arg_name), 1)
+            return
+        elif _is_lazy(node) and len(self.blocks) > _MAX_BLOCK_DEPTH:
+            # too deeply nested: call its own compiled function, bound in place of the expression
+            name = self.constant(expr)
+            self.nested[int(name[2:])] = expr
+            self.push('%s(%s)' % (name, self.arg_name), 1)
+            return
+
+        if node.kind == NODE_VAR:
+            self.push(self.arg_name, 0)
+            return
+        elif node.kind == NODE_CONSTANT:
+            self.push(self.constant(node.args[0]), 0)
+            return
+
+        # common sub-expression already evaluated in this block or in an enclosing one: reuse its value
+        try:
+            temp, block_id = self.shared[self.keys[id(expr)]]
+            if block_id in self.block_ids:
+                self.push(temp, 0)
+                return
+        except KeyError:
+            pass
+
+        tasks.append((_BUILD, expr))
+        if _is_lazy(node):
+            # short-circuit: each operand after the first one (the first two ones for chained comparisons) is
+            # generated in its own block
+            nb_eager = 2 if node.kind == NODE_COMPARE_CHAIN else 1
+            for arg in reversed(node.args[nb_eager:]):
+                tasks.append((_CLOSE_BLOCK, None))
+                tasks.append((_VISIT, arg))
+                tasks.append((_OPEN_BLOCK, None))
+            for arg in reversed(node.args[:nb_eager]):
+                tasks.append((_VISIT, arg))
+        else:
+            for _, arg in reversed(node.kwargs):
+                tasks.append((_VISIT, arg))
+            for arg in reversed(node.args):
+                tasks.append((_VISIT, arg))
+
+    def build(self, expr):
+        """ Generates the code for `expr`, from the code of its operands that is on the operand stack """
+        node = expr._node
+        kind = node.kind
+
+        if kind == NODE_UNARY_OP:
+            operand, = self.pop(1)
+            self.push('(%s%s)' % (node.symbol, operand.code), operand.depth + 1)
+
+        elif kind == NODE_BINARY_OP:
+            left, right = self.pop(2)
+            self.push('(%s %s %s)' % (left.code, node.symbol, right.code), max(left.depth, right.depth) + 1)
+
+        elif kind == NODE_LOGICAL_OP:
+            self.build_logical(node)
+
+        elif kind == NODE_BOOL_OP:
+            self.build_bool_op(node)
+
+        elif kind == NODE_IF_ELSE:
+            self.build_if_else()
+
+        elif kind == NODE_NARY_OP:
+            self.build_nary_op(node)
+
+        elif kind == NODE_COMPARE_CHAIN:
+            self.build_compare_chain(node)
+
+        elif kind == NODE_CALL:
+            operands = self.pop(len(node.args) + len(node.kwargs))
+            code, depth = self.call_code(self.constant(node.method), operands, node)
+            self.push(code, depth)
+
+        elif kind == NODE_METHOD_CALL:
+            operands = self.pop(len(node.args) + len(node.kwargs))
+            obj = operands[0]
+            if node.symbol == '__call__':
+                func = obj.code
+            elif _is_identifier(node.symbol):
+                func = '%s.%s' % (obj.code, node.symbol)
+            else:
+                func = '%s(%s, %s)' % (self.constant(getattr), obj.code, self.constant(node.symbol))
+            code, depth = self.call_code(func, operands[1:], node, obj.depth)
+            self.push(code, depth)
+
+        elif kind == NODE_GETATTR:
+            obj, = self.pop(1)
+            if _is_identifier(node.symbol):
+                self.push('%s.%s' % (obj.code, node.symbol), obj.depth + 1)
+            else:
+                self.push('%s(%s, %s)' % (self.constant(getattr), obj.code, self.constant(node.symbol)),
+                          obj.depth + 1)
+
+        elif kind == NODE_GETITEM:
+            obj, key = self.pop(2)
+            self.push('%s[%s]' % (obj.code, key.code), max(obj.depth, key.depth) + 1)
+
+        else:
+            raise ValueError('Unsupported node kind: %r' % kind)
+
+        key = self.keys[id(expr)]
+        if self.counts[key] > 1 and key not in self.unshareable:
+            # this sub-expression appears several times: store its value so that the other occurrences can reuse it
+            operand = self.operands[-1]
+            if operand.depth > 0:
+                self.emit([])
+            self.shared[key] = (operand.code, self.block_ids[-1])
+
+    def call_code(self, func, operands, node, depth=0):
+        """ Returns the code and depth of a call to `func` with the operands of the positional and keyword args """
+        nb_args = len(operands) - len(node.kwargs)
+        args = [operand.code for operand in operands[:nb_args]]
+        kwargs = dict()
+        for (arg_name, _), operand in zip(node.kwargs, operands[nb_args:]):
+            if _is_identifier(arg_name):
+                args.append('%s=%s' % (arg_name, operand.code))
+            else:
+                kwargs[arg_name] = operand.code
+        if len(kwargs) > 0:
+            args.append('**{%s}' % ', '.join('%r: %s' % (k, v) for k, v in kwargs.items()))
+        depth = max([depth] + [operand.depth for operand in operands]) + 1
+        return '%s(%s)' % (func, ', '.join(args)), depth
+
+    def build_logical(self, node):
+        """ Generates the code for the &, | and ^ operators of LambdaExpression """
+        left, right = self.pop(2)
+        to_bool = self.constant(bool)
+
+        if node.symbol == '^':
+            self.push('%s(%s, %s)' % (self.constant(_xor), left.code, right.code), max(left.depth, right.depth) + 1)
+
+        elif right.block is None or len(right.block) == 0:
+            # the right operand does not need any statement: use a conditional expression
+            if node.symbol == '&':
+                code = '(%s(%s) if %s else False)' % (to_bool, right.code, left.code)
+            else:
+                code = '(True if %s else %s(%s))' % (left.code, to_bool, right.code)
+            self.push(code, max(left.depth, right.depth) + 1)
+
+        else:
+            # the right operand needs statements: generate an if block
+            temp = self.new_temp()
+            lazy_branch = ['    ' + line for line in right.block] + ['    %s = %s(%s)' % (temp, to_bool, right.code)]
+            if node.symbol == '&':
+                lines = ['if %s:' % left.code] + lazy_branch + ['else:', '    %s = False' % temp]
+            else:
+                lines = ['if %s:' % left.code, '    %s = True' % temp, 'else:'] + lazy_branch
+            self.emit(lines)
+            self.push(temp, 0)
+
+    def build_bool_op(self, node):
+        """ Generates the code for the short-circuit 'and' and 'or' operations (And, Or, All_, Any_) """
+        self.build_short_circuit(self.pop(len(node.args)), node.symbol)
+
+    def build_short_circuit(self, operands, symbol):
+        """ Generates the code for 'operand_0 <symbol> operand_1 ...' where symbol is 'and' or 'or' """
+        first, lazy_operands = operands[0], operands[1:]
+
+        if all(operand.block is None or len(operand.block) == 0 for operand in lazy_operands):
+            # no operand needs any statement: use the python keyword directly
+            code = '(%s)' % (' %s ' % symbol).join(operand.code for operand in operands)
+            self.push(code, max(operand.depth for operand in operands) + 1)
+
+        else:
+            # generate one if block per lazy operand. They are not nested: once the result is decisive, the
+            # conditions of all the next blocks are False.
+            temp = self.new_temp()
+            condition = ('if %s:' if symbol == 'and' else 'if not %s:') % temp
+            lines = ['%s = %s' % (temp, first.code)]
+            for operand in lazy_operands:
+                lines.append(condition)
+                lines += ['    ' + line for line in operand.block or ()]
+                lines.append('    %s = %s' % (temp, operand.code))
+            self.emit(lines)
+            self.push(temp, 0)
+
+    def build_nary_op(self, node):
+        """ Generates the code for the n-ary operations (Sum_, Prod_, AllOf, AnyOf) """
+        operands = self.pop(len(node.args))
+
+        if node.symbol in ('&', '|'):
+            # bool(a and b and c) is a & b & c
+            self.build_short_circuit(operands, 'and' if node.symbol == '&' else 'or')
+            result, = self.pop(1)
+            self.push('%s(%s)' % (self.constant(bool), result.code), result.depth + 1)
+
+        elif node.symbol == 'fsum':
+            code = '%s([%s])' % (self.constant(math.fsum), ', '.join(operand.code for operand in operands))
+            self.push(code, max(operand.depth for operand in operands) + 1)
+
+        else:
+            # a chain of binary operations. Each operation is one more nesting level for the python compiler, so the
+            # partial result is stored in a temporary variable whenever the chain gets too deep
+            code, depth = operands[0].code, operands[0].depth
+            for operand in operands[1:]:
+                if depth >= _MAX_NESTING:
+                    partial = _Operand(code, depth, len(self.blocks) - 1)
+                    self.emit([])
+                    self.spill(partial)
+                    code, depth = partial.code, partial.depth
+                code = '(%s %s %s)' % (code, node.symbol, operand.code)
+                depth = max(depth, operand.depth) + 1
+            self.push(code, depth)
+
+    def build_compare_chain(self, node):
+        """ Generates the code for the chained comparisons created with Between or fuse_comparisons """
+        operands = self.pop(len(node.args))
+
+        if all(operand.block is None or len(operand.block) == 0 for operand in operands[2:]):
+            # no operand needs any statement: use a python chained comparison
+            code = operands[0].code
+            for symbol, operand in zip(node.symbol, operands[1:]):
+                code += ' %s %s' % (symbol, operand.code)
+            self.push('(%s)' % code, max(operand.depth for operand in operands) + 1)
+
+        else:
+            # generate one if block per lazy operand, the right operand of each comparison being the left operand of
+            # the next one
+            temp, left, right = self.new_temp(), self.new_temp(), self.new_temp()
+            lines = ['%s = %s' % (left, operands[0].code), '%s = %s' % (right, operands[1].code),
+                     '%s = (%s %s %s)' % (temp, left, node.symbol[0], right)]
+            for symbol, operand in zip(node.symbol[1:], operands[2:]):
+                lines.append('if %s:' % temp)
+                lines += ['    ' + line for line in operand.block or ()]
+                lines += ['    %s = %s' % (left, right), '    %s = %s' % (right, operand.code),
+                          '    %s = (%s %s %s)' % (temp, left, symbol, right)]
+            self.emit(lines)
+            self.push(temp, 0)
+
+    def build_if_else(self):
+        """ Generates the code for the conditional expressions created with IfElse """
+        condition, then, otherwise = self.pop(3)
+
+        if (then.block is None or len(then.block) == 0) and (otherwise.block is None or len(otherwise.block) == 0):
+            # no branch needs any statement: use a conditional expression
+            code = '(%s if %s else %s)' % (then.code, condition.code, otherwise.code)
+            self.push(code, max(condition.depth, then.depth, otherwise.depth) + 1)
+
+        else:
+            temp = self.new_temp()
+            lines = ['if %s:' % condition.code]
+            lines += ['    ' + line for line in then.block or ()]
+            lines += ['    %s = %s' % (temp, then.code), 'else:']
+            lines += ['    ' + line for line in otherwise.block or ()]
+            lines.append('    %s = %s' % (temp, otherwise.code))
+            self.emit(lines)
+            self.push(temp, 0)
+
+
+def _is_lazy(node):
+    """ Returns True if the operands of node after the first one are only evaluated when needed """
+    return (node.kind in (NODE_LOGICAL_OP, NODE_NARY_OP) and node.symbol in ('&', '|')) \
+        or node.kind in (NODE_BOOL_OP, NODE_IF_ELSE, NODE_COMPARE_CHAIN)
+
+
+def _is_identifier(name):
+    """ Returns True if name can be used as an attribute or keyword argument name in python source code """
+    return isinstance(name, str) and _IDENTIFIER.match(name) is not None and not iskeyword(name) \
+        and name not in ('None', 'True', 'False')
+
+
+def _get_structural_keys(root  # type: _LambdaExpressionBase
+                         ):
+    # type: (...) -> Tuple[Dict[int, int], Dict[int, int], Set[int]]
+    """
+    Identifies the structurally identical sub-expressions of `root`: sub-expressions performing the same operations on
+    the same constants get the same integer key.
+
+    :param root:
+    :return: a tuple (keys, counts, unshareable) where `keys` is a dictionary {id(sub_expr): key}, `counts` contains
+        the number of occurrences of each key, and `unshareable` is the set of keys of the sub-expressions that should
+        be evaluated at each occurrence: opaque sub-expressions, and those calling impure functions.
+    """
+    interned = dict()
+    keys = dict()
+    counts = dict()
+    unshareable = set()
+
+    def key_of(child):
+        return keys[id(child)]
+
+    for expr in walk(root):
+        node = expr._node
+        structure = _get_structure(expr, key_of)
+
+        try:
+            key = interned[structure]
+        except KeyError:
+            key = interned[structure] = len(interned)
+            counts[key] = 0
+            if node is None or _is_impure(node) or any(keys[id(child)] in unshareable for child in node.children):
+                unshareable.add(key)
+            if node is not None:
+                # only the first of identical sub-expressions will be evaluated: count the occurrences of its children
+                for child in node.children:
+                    counts[keys[id(child)]] += 1
+
+        keys[id(expr)] = key
+
+    counts[keys[id(root)]] += 1
+    return keys, counts, unshareable
+
+
+def _get_arg_name(expression):
+    """ Returns the name of the argument of the compiled function: the symbol of the variable when possible """
+    # find the variable
+    to_visit = [expression]
+    while len(to_visit) > 0:
+        expr = to_visit.pop()
+        if isinstance(expr, _LambdaExpressionBase) and expr._node is not None:
+            if expr._node.kind == NODE_VAR:
+                name = expr._node.symbol
+                if _is_identifier(name) and _GENERATED_NAME.match(name) is None:
+                    return name
+                break
+            to_visit.extend(expr._node.args)
+            to_visit.extend(arg for _, arg in expr._node.kwargs)
+    return '_x'
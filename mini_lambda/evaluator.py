@@ -0,0 +1,249 @@
+"""
+Iterative evaluation of lambda expressions.
+
+By default an expression is evaluated through its inner function, that calls the `evaluate` method of its operands.
+This is fast but recursive: each level of the expression consumes python stack frames, so that very deep expressions
+(for example a sum of thousands of terms built programmatically) would exceed the recursion limit.
+
+Expressions deeper than `_MAX_RECURSIVE_DEPTH` are therefore evaluated by the functions of this module: the expression
+is first linearised into a list of instructions (in evaluation order, with jumps for the short-circuit operations),
+and this program is then executed with an explicit stack of values. The python stack depth does not depend on the
+depth of the expression anymore. Executing the program is slower than calling the nested inner functions, so it is
+only used for expressions that would otherwise come close to the recursion limit.
+"""
+import operator
+
+try:  # python 3.5+
+    from typing import Any, List, Tuple
+except ImportError:
+    pass
+
+from mini_lambda.base import _LambdaExpressionBase, NODE_VAR, NODE_CONSTANT, NODE_UNARY_OP, NODE_BINARY_OP, \
+    NODE_LOGICAL_OP, NODE_CALL, NODE_METHOD_CALL, NODE_GETATTR, NODE_GETITEM, NODE_BOOL_OP, NODE_IF_ELSE, \
+    NODE_NARY_OP, NODE_COMPARE_CHAIN, _BINARY_OPERATORS, _xor
+
+
+# instructions. Each instruction is a tuple (opcode, arg1, arg2)
+_INPUT = 0                   # push the input
+_CONSTANT = 1                # push arg1
+_APPLY1 = 2                  # replace the top of the stack v with arg1(v)
+_APPLY2 = 3                  # replace the two values on top of the stack a, b with arg1(a, b)
+_APPLY = 4                   # replace the top arg2[0] values with arg1(*args, **kwargs), arg2[1] being the kwargs names
+_CALL_OPAQUE = 5             # push arg1(input)
+_TO_BOOL = 6                 # replace the top of the stack v with bool(v)
+_JUMP = 7                    # go to instruction arg1
+_POP_JUMP_IF_FALSE = 8       # pop the top of the stack, and go to instruction arg1 if it is falsy
+_JUMP_IF_FALSE_OR_POP = 9    # go to instruction arg1 if the top of the stack is falsy, otherwise pop it
+_JUMP_IF_TRUE_OR_POP = 10    # go to instruction arg1 if the top of the stack is truthy, otherwise pop it
+_FALSE_AND_JUMP_IF_FALSE_OR_POP = 11  # same than _JUMP_IF_FALSE_OR_POP, but replaces the top of the stack with False
+_TRUE_AND_JUMP_IF_TRUE_OR_POP = 12    # same than _JUMP_IF_TRUE_OR_POP, but replaces the top of the stack with True
+_COMPARE_OR_JUMP = 13        # replace the two values on top of the stack a, b with c = arg2(a, b). If c is falsy go to
+                             # instruction arg1, otherwise replace it with b (the left operand of the next comparison)
+
+# internal actions of the linearisation
+_VISIT = 0
+_EMIT = 1
+_LABEL = 2
+
+
+def _method_caller(name):
+    """ Returns a function calling method `name` of its first argument with the other arguments """
+    def call_method(obj, *args, **kwargs):
+        return getattr(obj, name)(*args, **kwargs)
+    return call_method
+
+
+def _call(obj, *args, **kwargs):
+    """ Calls its first argument with the other arguments """
+    return obj(*args, **kwargs)
+
+
+def linearize(expression  # type: _LambdaExpressionBase
+              ):
+    # type: (...) -> List[Tuple[int, Any, Any]]
+    """
+    Returns the program evaluating `expression`: the list of instructions to execute with `run`.
+
+    :param expression:
+    :return:
+    """
+    program = []
+    labels = []  # the instruction index of each label, once known
+    tasks = [(_VISIT, expression)]
+    while len(tasks) > 0:
+        action, item = tasks.pop()
+        if action == _EMIT:
+            program.append(item)
+            continue
+        elif action == _LABEL:
+            labels[item] = len(program)
+            continue
+
+        # _VISIT
+        if not isinstance(item, _LambdaExpressionBase):
+            program.append((_CONSTANT, item, None))
+            continue
+
+        node = item._node
+        if node is None:
+            # opaque expression: call its own evaluate method
+            program.append((_CALL_OPAQUE, item.evaluate, None))
+            continue
+
+        kind = node.kind
+        if kind == NODE_VAR:
+            program.append((_INPUT, None, None))
+            continue
+        elif kind == NODE_CONSTANT:
+            program.append((_CONSTANT, node.args[0], None))
+            continue
+
+        # the sequence of tasks for this node, in order
+        if kind in (NODE_LOGICAL_OP, NODE_NARY_OP) and node.symbol in ('&', '|'):
+            end = len(labels)
+            labels.append(None)
+            jump = _FALSE_AND_JUMP_IF_FALSE_OR_POP if node.symbol == '&' else _TRUE_AND_JUMP_IF_TRUE_OR_POP
+            sequence = [(_VISIT, node.args[0])]
+            for arg in node.args[1:]:
+                sequence += [(_EMIT, (jump, end, None)), (_VISIT, arg)]
+            sequence += [(_EMIT, (_TO_BOOL, None, None)), (_LABEL, end)]
+
+        elif kind == NODE_BOOL_OP:
+            end = len(labels)
+            labels.append(None)
+            jump = _JUMP_IF_FALSE_OR_POP if node.symbol == 'and' else _JUMP_IF_TRUE_OR_POP
+            sequence = [(_VISIT, node.args[0])]
+            for arg in node.args[1:]:
+                sequence += [(_EMIT, (jump, end, None)), (_VISIT, arg)]
+            sequence.append((_LABEL, end))
+
+        elif kind == NODE_COMPARE_CHAIN:
+            end = len(labels)
+            labels.append(None)
+            comparisons = [_BINARY_OPERATORS[symbol] for symbol in node.symbol]
+            sequence = [(_VISIT, node.args[0]), (_VISIT, node.args[1])]
+            for comparison, arg in zip(comparisons[:-1], node.args[2:]):
+                sequence += [(_EMIT, (_COMPARE_OR_JUMP, end, comparison)), (_VISIT, arg)]
+            sequence += [(_EMIT, (_APPLY2, comparisons[-1], None)), (_LABEL, end)]
+
+        elif kind == NODE_IF_ELSE:
+            otherwise, end = len(labels), len(labels) + 1
+            labels += [None, None]
+            sequence = [(_VISIT, node.args[0]), (_EMIT, (_POP_JUMP_IF_FALSE, otherwise, None)),
+                        (_VISIT, node.args[1]), (_EMIT, (_JUMP, end, None)),
+                        (_LABEL, otherwise), (_VISIT, node.args[2]), (_LABEL, end)]
+
+        else:
+            sequence = [(_VISIT, operand) for operand in node.operands]
+            sequence.append((_EMIT, _get_apply_instruction(node)))
+
+        tasks.extend(reversed(sequence))
+
+    # resolve the jump targets
+    return [(op, labels[arg1], arg2) if op >= _JUMP else (op, arg1, arg2) for op, arg1, arg2 in program]
+
+
+def _get_apply_instruction(node):
+    """ Returns the instruction applying the operation of node on the values of its operands """
+    kind = node.kind
+    if kind in (NODE_UNARY_OP, NODE_BINARY_OP, NODE_CALL, NODE_NARY_OP):
+        func = node.method
+    elif kind == NODE_LOGICAL_OP:
+        func = _xor
+    elif kind == NODE_METHOD_CALL:
+        func = _call if node.symbol == '__call__' else _method_caller(node.symbol)
+    elif kind == NODE_GETATTR:
+        func = operator.attrgetter(node.symbol)
+    elif kind == NODE_GETITEM:
+        func = operator.getitem
+    else:
+        raise ValueError('Unsupported node kind: %r' % kind)
+
+    nb_operands = len(node.args) + len(node.kwargs)
+    if len(node.kwargs) == 0 and nb_operands == 1:
+        return _APPLY1, func, None
+    elif len(node.kwargs) == 0 and nb_operands == 2:
+        return _APPLY2, func, None
+    else:
+        return _APPLY, func, (nb_operands, tuple(name for name, _ in node.kwargs))
+
+
+def run(program,  # type: List[Tuple[int, Any, Any]]
+        arg       # type: Any
+        ):
+    # type: (...) -> Any
+    """
+    Executes a program created with `linearize`, with input `arg`.
+
+    :param program:
+    :param arg:
+    :return:
+    """
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    pc = 0
+    end = len(program)
+    while pc < end:
+        op, arg1, arg2 = program[pc]
+        pc += 1
+        if op == _APPLY2:
+            right = pop()
+            stack[-1] = arg1(stack[-1], right)
+        elif op == _CONSTANT:
+            push(arg1)
+        elif op == _INPUT:
+            push(arg)
+        elif op == _APPLY1:
+            stack[-1] = arg1(stack[-1])
+        elif op == _APPLY:
+            nb_operands, kwargs_names = arg2
+            values = stack[-nb_operands:]
+            del stack[-nb_operands:]
+            if len(kwargs_names) > 0:
+                nb_args = nb_operands - len(kwargs_names)
+                push(arg1(*values[:nb_args], **dict(zip(kwargs_names, values[nb_args:]))))
+            else:
+                push(arg1(*values))
+        elif op == _CALL_OPAQUE:
+            push(arg1(arg))
+        elif op == _TO_BOOL:
+            stack[-1] = bool(stack[-1])
+        elif op == _JUMP:
+            pc = arg1
+        elif op == _POP_JUMP_IF_FALSE:
+            if not pop():
+                pc = arg1
+        elif op == _JUMP_IF_FALSE_OR_POP:
+            if not stack[-1]:
+                pc = arg1
+            else:
+                pop()
+        elif op == _JUMP_IF_TRUE_OR_POP:
+            if stack[-1]:
+                pc = arg1
+            else:
+                pop()
+        elif op == _COMPARE_OR_JUMP:
+            right = pop()
+            result = arg2(stack[-1], right)
+            if not result:
+                stack[-1] = result
+                pc = arg1
+            else:
+                stack[-1] = right
+        elif op == _FALSE_AND_JUMP_IF_FALSE_OR_POP:
+            if not stack[-1]:
+                stack[-1] = False
+                pc = arg1
+            else:
+                pop()
+        else:
+            # _TRUE_AND_JUMP_IF_TRUE_OR_POP
+            if stack[-1]:
+                stack[-1] = True
+                pc = arg1
+            else:
+                pop()
+
+    return stack[0]
@@ -1,3 +1,4 @@
+from types import FunctionType
 from warnings import warn
 import sys
 
@@ -11,10 +12,14 @@ try:  # python 3.5+
 except ImportError:
     pass
 
-from mini_lambda.base import get_repr, _PRECEDENCE_BITWISE_AND, _PRECEDENCE_BITWISE_OR, _PRECEDENCE_BITWISE_XOR, \
-    _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF, evaluate, _PRECEDENCE_EXPONENTIATION, \
-    _PRECEDENCE_POS_NEG_BITWISE_NOT, _get_root_var, FunctionDefinitionError
+from mini_lambda.base import _PRECEDENCE_BITWISE_AND, _PRECEDENCE_BITWISE_OR, _PRECEDENCE_BITWISE_XOR, \
+    _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF, evaluate, _PRECEDENCE_EXPONENTIATION, _get_root_var, \
+    FunctionDefinitionError, mark_impure, ExpressionNode, NODE_LOGICAL_OP, NODE_CALL, NODE_METHOD_CALL, NODE_GETATTR, \
+    NODE_GETITEM, _binary_op_node, _make_call_function, _constant_key, _CONSTANT_KEY_FUNCTIONS, _PURE_CALLABLES, \
+    _xor
 from mini_lambda.generated_magic import _LambdaExpressionGenerated
+from mini_lambda.cache import get_compiled_function
+from mini_lambda.compiler import lower_to_operator, compile_expression
 
 
 this_module = sys.modules[__name__]
@@ -45,51 +50,119 @@ class LambdaExpression(_LambdaExpressionGenerated):
     If the code generation gets more powerful it will be able to handle those exceptions later on...
     """
 
-    class LambdaFunction:
+    class LambdaFunction(object):
         """ A view on a lambda expression, that is only capable of evaluating but is able to do it in a more friendly
         way: simply calling it with arguments is ok, instead of calling .evaluate() like for the LambdaExpression.
         Another side effect is that this object is representable: you can call str() on it. You may return to the
-        associated expression """
+        associated expression
 
-        def __init__(self, expression):
+        Calling this object directly calls the evaluation function, stored in its `__call__` slot: python finds it
+        through the slot descriptor of the class, so that no intermediate python frame is created. """
+        __slots__ = ('expression', '__call__', '_str_expr', '__weakref__')
+
+        def __init__(self, expression, fun=None, str_expr=None):
             """
             Constructor from a mandatory existing LambdaExpression.
-            :param expression:
+            :param expression: the expression, or None for a function detached from its expression (see
+                `as_function(detach=True)`). In that case `fun` and `str_expr` are mandatory.
+            :param fun: an optional function equivalent to `expression.evaluate`, for example the function compiled from
+                the expression. By default `expression.evaluate` is used.
+            :param str_expr: the string representation of a detached function
             """
             self.expression = expression
+            self.__call__ = fun if fun is not None else expression.evaluate
+            self._str_expr = str_expr
 
-        def __call__(self, arg):
-            """
-            Calling this object is actually evaluating the inner expression with the given arguments.
-            So it behaves like a normal function.
-
-            :param args:
-            :param kwargs:
-            :return:
-            """
-            return self.expression.evaluate(arg)
+        @property
+        def _evaluate(self):
+            """ The function evaluating the expression, called when this object is called """
+            return self.__call__
 
         def as_expression(self):
             """
             Returns the underlying expression self.expression
             :return:
             """
+            if self.expression is None:
+                raise ValueError('This function was detached from its expression with as_function(detach=True)')
             return self.expression
 
         def __str__(self):
-            return self.expression._str_expr
+            if self.expression is None:
+                return self._str_expr
+            return self.expression.to_string()
 
         def __repr__(self):
             return "<LambdaFunction: %s>" % str(self)
 
-    def as_function(self):
+    def as_function(self,
+                    compile=True,  # type: bool
+                    native=False,  # type: bool
+                    detach=False,  # type: bool
+                    vectorize=False,   # type: bool
+                    pandas_eval=False  # type: bool
+                    ):
         """
         freezes this expression so that it can be called directly, in other words that calling it actually calls
         'evaluate' instead of creating a new expression.
 
+        :param compile: if True (default), the whole expression is compiled into a single python function (see
+            `mini_lambda.compiler.compile_expression`), so that calling the result does not go through the nested
+            closures of each node anymore. Compiled functions are stored in a process-wide cache keyed by the structure
+            of the expression (see `mini_lambda.cache`), so that the compilation cost is only paid once for
+            structurally identical expressions. Simple attribute, item or method accesses such as `x.user.name` are
+            not compiled but lowered to the equivalent `operator.attrgetter`, `itemgetter` or `methodcaller` (see
+            `mini_lambda.compiler.lower_to_operator`). If False, the function evaluates the expression node by node.
+        :param native: if True, the compiled function itself is returned instead of a LambdaFunction wrapping it, so
+            that calling it does not go through any intermediate call. Since the string representation of a python
+            function can not be customized, its `__name__` is the string representation of the expression. The
+            expression is available as its `expression` attribute, and through its `as_expression()` attribute.
+        :param detach: if True, the returned function only keeps the compiled function (its code and bound constants)
+            and the string representation of the expression, but no reference to the expression itself: the
+            expression and its sub-expressions may then be garbage-collected. `as_expression()` is not available on
+            such functions. The compile cache is not used in this case, since it would keep the expression alive. This
+            requires `compile=True`.
+        :param vectorize: if True, the returned function evaluates the expression on each element of the array that it
+            receives, and returns the array of the results (see `mini_lambda.batch`). The expression is translated to
+            numpy operations once, when this method is called. This requires numpy, and can not be combined with
+            `detach=True`.
+        :param pandas_eval: if True, the returned function evaluates the expression on a data frame with a single
+            `DataFrame.eval` call, when it can be translated (see `mini_lambda.pandas_eval`). Otherwise it evaluates the
+            expression as with `compile=True`. This can not be combined with `detach=True`.
         :return: a callable object created by freezing this input expression
         """
-        return LambdaExpression.LambdaFunction(self)
+        if pandas_eval:
+            if detach:
+                raise ValueError('pandas_eval=True can not be combined with detach=True')
+            from mini_lambda.pandas_eval import get_pandas_function
+            if native:
+                return _make_native_function(self.to_string(), get_pandas_function(self), self)
+            else:
+                return LambdaExpression.LambdaFunction(self, get_pandas_function(self))
+        elif vectorize:
+            if detach:
+                raise ValueError('vectorize=True can not be combined with detach=True')
+            from mini_lambda.batch import get_batch_function
+            if native:
+                return _make_native_function(self.to_string(), get_batch_function(self), self)
+            else:
+                return LambdaExpression.LambdaFunction(self, get_batch_function(self))
+        elif detach:
+            if not compile:
+                raise ValueError('detach=True requires compile=True')
+            # the compile cache is not used, since its entries would keep the expression alive
+            if native:
+                return _make_native_function(self.to_string(), compile_expression(self))
+            else:
+                return LambdaExpression.LambdaFunction(None, _get_frozen_function(self, use_cache=False),
+                                                       str_expr=self.to_string())
+        elif native:
+            return _make_native_function(self.to_string(), get_compiled_function(self) if compile else self.evaluate,
+                                         self)
+        elif compile:
+            return LambdaExpression.LambdaFunction(self, _get_frozen_function(self))
+        else:
+            return LambdaExpression.LambdaFunction(self)
 
     # Special case: List comprehensions
     def __iter__(self):
@@ -154,11 +227,10 @@ class LambdaExpression(_LambdaExpressionGenerated):
                     # evaluate the right part
                     return bool(evaluate(other, input))
 
-            string_expr = get_repr(self, _PRECEDENCE_BITWISE_AND) + ' & ' + get_repr(other, _PRECEDENCE_BITWISE_AND)
+            node = ExpressionNode(NODE_LOGICAL_OP, '&', (self, other))
             return LambdaExpression(fun=evaluate_both_inner_functions_and_combine,
                                     precedence_level=_PRECEDENCE_BITWISE_AND,
-                                    str_expr=string_expr,
-                                    root_var=root_var, repr_on=self.repr_on)
+                                    root_var=root_var, repr_on=self.repr_on, node=node)
 
     def __or__(self, other):
         """
@@ -204,11 +276,10 @@ class LambdaExpression(_LambdaExpressionGenerated):
                     # evaluate the right part
                     return bool(evaluate(other, input))
 
-            string_expr = get_repr(self, _PRECEDENCE_BITWISE_OR) + ' | ' + get_repr(other, _PRECEDENCE_BITWISE_OR)
+            node = ExpressionNode(NODE_LOGICAL_OP, '|', (self, other))
             return LambdaExpression(fun=evaluate_both_inner_functions_and_combine,
                                     precedence_level=_PRECEDENCE_BITWISE_OR,
-                                    str_expr=string_expr,
-                                    root_var=root_var, repr_on=self.repr_on)
+                                    root_var=root_var, repr_on=self.repr_on, node=node)
 
     def __xor__(self, other):
         """
@@ -243,20 +314,16 @@ class LambdaExpression(_LambdaExpressionGenerated):
                 # evaluate the right part
                 right = evaluate(other, input)
 
-                return (left and not right) or (not left and right)
+                return _xor(left, right)
 
-            string_expr = get_repr(self, _PRECEDENCE_BITWISE_XOR) + ' ^ ' + get_repr(other, _PRECEDENCE_BITWISE_XOR)
+            node = ExpressionNode(NODE_LOGICAL_OP, '^', (self, other))
             return LambdaExpression(fun=evaluate_both_inner_functions_and_combine,
                                     precedence_level=_PRECEDENCE_BITWISE_XOR,
-                                    str_expr=string_expr,
-                                    root_var=root_var, repr_on=self.repr_on)
+                                    root_var=root_var, repr_on=self.repr_on, node=node)
 
     def not_(self):
         """ Returns a new LambdaExpression performing 'not x' on the result of this expression's evaluation """
-        def __not(x):
-            return not x
-
-        return self.add_unbound_method_to_stack(__not)
+        return self.add_unbound_method_to_stack(_not)
 
     def any_(self):
         """ Returns a new LambdaExpression performing 'any(x)' on the result of this expression's evaluation """
@@ -282,16 +349,13 @@ class LambdaExpression(_LambdaExpressionGenerated):
                                       'as well as an In() method')
 
     def is_in(self, container):
-        """ Returns a new LambdaExpression performing 'res in container' where res is the result of evaluating self"""
-        def _item_in(x):
-            return x in container
-        return self.add_unbound_method_to_stack(_item_in)
+        """ Returns a new LambdaExpression performing 'res in container' where res is the result of evaluating self.
+        This is the same expression as `In(self, container)`. """
+        return self._get_expression_for_method_with_args(_is_in, self, _hashed_container(container))
 
     def contains(self, item):
         """ Returns a new LambdaExpression performing 'item in res' on the result of this expression's evaluation """
-        def _item_in(x):
-            return item in x
-        return self.add_unbound_method_to_stack(_item_in)
+        return self._get_expression_for_method_with_args(_contains, self, item)
 
     # Special case for the string representation
     def __getattr__(self, name):
@@ -304,30 +368,22 @@ class LambdaExpression(_LambdaExpressionGenerated):
             return getattr(r, evaluate(name, input))
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        string_expr = get_repr(self, _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF) + '.' + name
+        node = ExpressionNode(NODE_GETATTR, name, (self,))
         return type(self)(fun=___getattr__, precedence_level=_PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF,
-                          str_expr=string_expr, root_var=root_var, repr_on=self.repr_on)
+                          root_var=root_var, repr_on=self.repr_on, node=node)
 
     # Special case for the string representation
     def __call__(self, *args, **kwargs):
         """ Returns a new LambdaExpression performing '<r>.__call__(*args, **kwargs)' on the result <r> of this expression's evaluation """
         # return self.add_bound_method_to_stack('__call__', *args, **kwargs)
         root_var, _ = _get_root_var(self, *args, **kwargs)
-        def ___call__(input):
-            # first evaluate the inner function
-            r = self.evaluate(input)
-            # then call the method
-            return r.__call__(*[evaluate(other, input) for other in args],
-                              **{arg_name: evaluate(other, input) for arg_name, other in kwargs.items()})
+        # first evaluate the inner function, then call the result
+        ___call__ = _make_call_function(None, (self,) + args, kwargs, method_name='__call__')
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        # Note: we use precedence=None for coma-separated items inside the parenthesis
-        string_expr = get_repr(self, _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF) \
-                      + '(' + ', '.join([get_repr(arg, None) for arg in args]) \
-                      + (', ' if (len(args) > 0 and len(kwargs) > 0) else '')\
-                      + ', '.join([arg_name + '=' + get_repr(arg, None) for arg_name, arg in kwargs.items()]) + ')'
+        node = ExpressionNode(NODE_METHOD_CALL, '__call__', (self,) + args, tuple(kwargs.items()))
         return type(self)(fun=___call__, precedence_level=_PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF,
-                          str_expr=string_expr, root_var=root_var, repr_on=self.repr_on)
+                          root_var=root_var, repr_on=self.repr_on, node=node)
 
     # Special case for the string representation
     def __getitem__(self, key):
@@ -341,11 +397,9 @@ class LambdaExpression(_LambdaExpressionGenerated):
             return r.__getitem__(evaluate(key, input))
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        # Note: we use precedence=None for coma-separated items inside the parenthesis
-        string_expr = get_repr(self, _PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF) \
-                      + '[' + get_repr(key, None) + ']'
+        node = ExpressionNode(NODE_GETITEM, None, (self, key))
         return type(self)(fun=___getitem__, precedence_level=_PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF,
-                          str_expr=string_expr, root_var=root_var, repr_on=self.repr_on)
+                          root_var=root_var, repr_on=self.repr_on, node=node)
 
     # Special case for string representation because pow is asymetric in precedence
     def __pow__(self, other):
@@ -358,10 +412,9 @@ class LambdaExpression(_LambdaExpressionGenerated):
             return r ** evaluate(other, input)
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        string_expr = get_repr(self, _PRECEDENCE_EXPONENTIATION) + ' ** ' \
-                      + get_repr(other, _PRECEDENCE_POS_NEG_BITWISE_NOT)
-        return type(self)(fun=___pow__, precedence_level=13, str_expr=string_expr, root_var=root_var,
-                          repr_on=self.repr_on)
+        node = _binary_op_node('**', self, other)
+        return type(self)(fun=___pow__, precedence_level=_PRECEDENCE_EXPONENTIATION, root_var=root_var,
+                          repr_on=self.repr_on, node=node)
 
     # Special case for string representation because pow is asymetric in precedence
     def __rpow__(self, other):
@@ -374,10 +427,9 @@ class LambdaExpression(_LambdaExpressionGenerated):
             return evaluate(other, input) ** r
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        string_expr = get_repr(other, _PRECEDENCE_EXPONENTIATION) + ' ** ' \
-                      + get_repr(self, _PRECEDENCE_POS_NEG_BITWISE_NOT)
-        return type(self)(fun=___rpow__, precedence_level=13, str_expr=string_expr, root_var=root_var,
-                          repr_on=self.repr_on)
+        node = _binary_op_node('**', other, self)
+        return type(self)(fun=___rpow__, precedence_level=_PRECEDENCE_EXPONENTIATION, root_var=root_var,
+                          repr_on=self.repr_on, node=node)
 
     # Special case : unbound function call but with left/right
     def __divmod__(self, other):
@@ -391,10 +443,9 @@ class LambdaExpression(_LambdaExpressionGenerated):
             return divmod(r, evaluate(other, input))
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        # Note: we use precedence=None for coma-separated items inside the parenthesis
-        string_expr = 'divmod(' + get_repr(self, None) + ', ' + get_repr(other, None) + ')'
+        node = ExpressionNode(NODE_CALL, 'divmod', (self, other), method=divmod)
         return type(self)(fun=___divmod__, precedence_level=_PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF,
-                          str_expr=string_expr, root_var=root_var, repr_on=self.repr_on)
+                          root_var=root_var, repr_on=self.repr_on, node=node)
 
     # Special case : unbound function call but with left/right
     def __rdivmod__(self, other):
@@ -408,10 +459,9 @@ class LambdaExpression(_LambdaExpressionGenerated):
             return divmod(evaluate(other, input), r)
 
         # return a new LambdaExpression of the same type than self, with the new function as inner function
-        # Note: we use precedence=None for coma-separated items inside the parenthesis
-        string_expr = 'divmod(' + get_repr(other, None) + ', ' + get_repr(self, None) + ')'
+        node = ExpressionNode(NODE_CALL, 'divmod', (other, self), method=divmod)
         return type(self)(fun=___rdivmod__, precedence_level=_PRECEDENCE_SUBSCRIPTION_SLICING_CALL_ATTRREF,
-                          str_expr=string_expr, root_var=root_var, repr_on=self.repr_on)
+                          root_var=root_var, repr_on=self.repr_on, node=node)
 
     # special case: format(x, args) does not work but x.format() works
     def __format__(self, *args):
@@ -443,34 +493,169 @@ def Not(expression  # type: LambdaExpression
 
 
 # Logical combinations 'and' and 'or'
-def _and(a, b):
-    return a and b
-
-
 def And(a, b):
     """
-    Equivalent of 'a and b'.
+    Equivalent of 'a and b'. Just like the python keyword, b is only evaluated if a is truthy.
 
     :param a: left operand
     :param b: right operand
     :return: expression evaluating the and combination
     """
-    return LambdaExpression._get_expression_for_method_with_args(_and, a, b)
-
-
-def _or(a, b):
-    return a or b
+    return LambdaExpression._get_expression_for_bool_op('and', a, b)
 
 
 def Or(a, b):
     """
-    Equivalent of 'a or b'.
+    Equivalent of 'a or b'. Just like the python keyword, b is only evaluated if a is falsy.
 
     :param a: left operand
     :param b: right operand
     :return: expression evaluating the or combination
     """
-    return LambdaExpression._get_expression_for_method_with_args(_or, a, b)
+    return LambdaExpression._get_expression_for_bool_op('or', a, b)
+
+
+def All_(*operands):
+    """
+    Equivalent of 'a and b and c...'. The operands are evaluated from left to right, and the evaluation stops at the
+    first falsy one, that is returned. Otherwise the last operand is returned. All_() is True.
+
+    :param operands:
+    :return: expression evaluating the and combination
+    """
+    if len(operands) == 0:
+        return True
+    elif len(operands) == 1:
+        return operands[0]
+    else:
+        return LambdaExpression._get_expression_for_bool_op('and', *operands)
+
+
+def Any_(*operands):
+    """
+    Equivalent of 'a or b or c...'. The operands are evaluated from left to right, and the evaluation stops at the
+    first truthy one, that is returned. Otherwise the last operand is returned. Any_() is False.
+
+    :param operands:
+    :return: expression evaluating the or combination
+    """
+    if len(operands) == 0:
+        return False
+    elif len(operands) == 1:
+        return operands[0]
+    else:
+        return LambdaExpression._get_expression_for_bool_op('or', *operands)
+
+
+def Sum_(*operands, **kwargs):
+    """
+    Equivalent of 'a + b + c...', as a single flat operation: the operands are evaluated and added from left to right
+    in one loop, instead of going through a chain of binary operations. This is the preferred way to build sums with
+    many terms programmatically. Sum_() is 0.
+
+    If `fsum=True` is passed, the result is the accurate floating point sum math.fsum([a, b, c...]) instead.
+
+    :param operands:
+    :param fsum: a boolean (default False) indicating if math.fsum should be used
+    :return: expression evaluating the sum
+    """
+    fsum = kwargs.pop('fsum', False)
+    if len(kwargs) > 0:
+        raise TypeError("Sum_() got unexpected keyword arguments: %s" % list(kwargs.keys()))
+
+    if fsum:
+        return LambdaExpression._get_expression_for_nary_op('fsum', *operands)
+    elif len(operands) == 0:
+        return 0
+    elif len(operands) == 1:
+        return operands[0]
+    else:
+        return LambdaExpression._get_expression_for_nary_op('+', *operands)
+
+
+def Prod_(*operands):
+    """
+    Equivalent of 'a * b * c...', as a single flat operation: the operands are evaluated and multiplied from left to
+    right in one loop, instead of going through a chain of binary operations. Prod_() is 1.
+
+    :param operands:
+    :return: expression evaluating the product
+    """
+    if len(operands) == 0:
+        return 1
+    elif len(operands) == 1:
+        return operands[0]
+    else:
+        return LambdaExpression._get_expression_for_nary_op('*', *operands)
+
+
+def AllOf(*predicates):
+    """
+    Equivalent of 'a & b & c...', as a single flat operation: the predicates are evaluated from left to right, and the
+    evaluation stops at the first falsy one. The result is a boolean. AllOf() is True.
+
+    :param predicates:
+    :return: expression evaluating the & combination
+    """
+    if len(predicates) == 0:
+        return True
+    else:
+        return LambdaExpression._get_expression_for_nary_op('&', *predicates)
+
+
+def AnyOf(*predicates):
+    """
+    Equivalent of 'a | b | c...', as a single flat operation: the predicates are evaluated from left to right, and the
+    evaluation stops at the first truthy one. The result is a boolean. AnyOf() is False.
+
+    :param predicates:
+    :return: expression evaluating the | combination
+    """
+    if len(predicates) == 0:
+        return False
+    else:
+        return LambdaExpression._get_expression_for_nary_op('|', *predicates)
+
+
+def IfElse(condition, then, otherwise):
+    """
+    Equivalent of 'then if condition else otherwise'. Only the branch selected by the condition is evaluated.
+
+    :param condition:
+    :param then: the value if condition is truthy
+    :param otherwise: the value if condition is falsy
+    :return: expression evaluating the conditional expression
+    """
+    return LambdaExpression._get_expression_for_if_else(condition, then, otherwise)
+
+
+Where = IfElse
+""" Alias for 'IfElse' """
+
+
+_BETWEEN_SYMBOLS = {'both': ('<=', '<='), 'neither': ('<', '<'), 'left': ('<=', '<'), 'right': ('<', '<=')}
+
+
+def Between(value, low, high, inclusive=True):
+    """
+    Equivalent of the chained comparison 'low <= value <= high', that can not be written directly with expressions.
+    `value` is evaluated only once, and `high` is only evaluated if the first comparison is true.
+
+    :param value:
+    :param low: the lower bound
+    :param high: the upper bound
+    :param inclusive: True or 'both' (default) to include both bounds, False or 'neither' to exclude them, 'left' or
+        'right' to only include the lower or the upper bound
+    :return: expression evaluating the chained comparison
+    """
+    if inclusive is True or inclusive is False:
+        inclusive = 'both' if inclusive else 'neither'
+    try:
+        symbols = _BETWEEN_SYMBOLS[inclusive]
+    except (KeyError, TypeError):
+        raise ValueError("inclusive should be True, False, 'both', 'neither', 'left' or 'right', found: %r"
+                         % (inclusive, ))
+    return LambdaExpression._get_expression_for_compare_chain(symbols, low, value, high)
 
 
 # Special case: we do not want to use format() but type(value).format. So we override the generated method
@@ -505,20 +690,89 @@ def Get(container, key):
 
 # ************** All of these could be generated
 
+class _HashedContainer(frozenset):
+    """
+    The set of the elements of a constant list or tuple, used by `In` and `is_in` so that membership tests do not scan
+    the container. The original container is kept for the string representation, and for the items that are not
+    hashable.
+    """
+    __slots__ = ('container', )
+
+    def __new__(cls, container):
+        self = super(_HashedContainer, cls).__new__(cls, container)
+        self.container = container
+        return self
+
+    def __repr__(self):
+        return repr(self.container)
+
+    def __reduce__(self):
+        return _HashedContainer, (self.container, )
+
+
+def _hashed_container_key(value):
+    """ Returns the key identifying a _HashedContainer (see `_constant_key`): the one of its original container, that
+    it evaluates and prints like """
+    key = _constant_key(tuple(value.container))
+    if key[0] == 'value':
+        return 'value', _HashedContainer, type(value.container), key
+    return 'id', id(value)
+
+
+_CONSTANT_KEY_FUNCTIONS[_HashedContainer] = _hashed_container_key
+
+
+def _hashed_container(container):
+    """
+    Returns a `_HashedContainer` for lists and tuples of hashable elements, and the container itself otherwise. Lists
+    are copied so that the set and the string representation do not depend on later modifications of the list.
+
+    :param container:
+    :return:
+    """
+    if type(container) in (list, tuple):
+        try:
+            return _HashedContainer(type(container)(container))
+        except TypeError:
+            # some elements are not hashable
+            pass
+    return container
+
+
 def _is_in(a, b):
     """ Method used only in `In` """
-    return a in b
+    try:
+        return a in b
+    except TypeError:
+        if type(b) is _HashedContainer:
+            # a is not hashable: scan the original container
+            return a in b.container
+        raise
+
+
+def _contains(a, b):
+    """ Method used only in `<expr>.contains` """
+    return b in a
+
+
+def _not(x):
+    """ Method used only in `Not` """
+    return not x
+
+
+_PURE_CALLABLES.update((_is_in, _contains, _not))
 
 
 def In(item, container):
     """
-    Equivalent of 'item in container'.
+    Equivalent of 'item in container'. Constant lists and tuples of hashable elements are converted to a set when the
+    expression is created, so that each evaluation performs a hashed lookup instead of a scan.
 
     :param item:
     :param container:
     :return:
     """
-    return LambdaExpression._get_expression_for_method_with_args(_is_in, item, container)
+    return LambdaExpression._get_expression_for_method_with_args(_is_in, item, _hashed_container(container))
 
 
 def Slice(*args, **kwargs):
@@ -534,6 +788,61 @@ def Slice(*args, **kwargs):
 # ************************
 
 
+def _get_frozen_function(expression,    # type: LambdaExpression
+                         use_cache=True  # type: bool
+                         ):
+    # type: (...) -> Callable[[Any], Any]
+    """
+    Returns the function used by the LambdaFunction frozen from `expression`: the equivalent callable of the `operator`
+    module if the expression is a simple attribute, item or method access on its variable (see
+    `mini_lambda.compiler.lower_to_operator`), or the compiled function otherwise.
+
+    :param expression:
+    :param use_cache: if False the expression is compiled again instead of going through the compile cache
+    :return:
+    """
+    lowered = lower_to_operator(expression)
+    if lowered is not None:
+        return lowered
+    return get_compiled_function(expression) if use_cache else compile_expression(expression)
+
+
+def _make_native_function(name,            # type: str
+                          fun,             # type: Callable
+                          expression=None  # type: LambdaExpression
+                          ):
+    # type: (...) -> Callable
+    """
+    Returns a copy of the python function `fun` (that may be shared through the compile cache) named `name`, the string
+    representation of the expression. If `expression` is provided, the function holds `expression` and
+    `as_expression()` attributes.
+
+    :param name:
+    :param fun: a python function, or another callable such as the bound method expression.evaluate or an
+        operator.attrgetter
+    :param expression:
+    :return:
+    """
+    if not isinstance(fun, FunctionType):
+        # bound method or other callable: wrap it in a dedicated function
+        method = fun
+
+        def fun(arg):
+            return method(arg)
+
+    native = FunctionType(fun.__code__, fun.__globals__, fun.__name__, fun.__defaults__, fun.__closure__)
+    native.__name__ = native.__qualname__ = name
+
+    if expression is not None:
+        native.expression = expression
+
+        def as_expression():
+            return expression
+
+        native.as_expression = as_expression
+    return native
+
+
 def _(*expressions  # type: LambdaExpression
       ):
     # type: (...) -> Union[LambdaExpression.LambdaFunction, Tuple[LambdaExpression.LambdaFunction, ...]]
@@ -618,8 +927,9 @@ def make_lambda_friendly_class(typ,       # type: Type[T]
     return Constant(typ, name=name)
 
 
-def make_lambda_friendly_method(method,    # type: Callable
-                                name=None  # type: str
+def make_lambda_friendly_method(method,     # type: Callable
+                                name=None,  # type: str
+                                pure=True   # type: bool
                                 ):
     # type: (...) -> LambdaExpression
     """
@@ -709,8 +1019,13 @@ def make_lambda_friendly_method(method,    # type: Callable
     :param method:
     :param name: an optional name for the method when used to display the expressions. It is mandatory if the method
     does not have a name, otherwise the default name is method.__name__
+    :param pure: False should be used if the method may return different results for the same arguments (random
+    numbers, current time...) or has side effects. It will then be called at each evaluation, even in expressions
+    folded explicitly with `fold_constants`, see `mark_impure`.
     :return:
     """
+    if not pure:
+        mark_impure(method)
     return Constant(method, name)
 
 
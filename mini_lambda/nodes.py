@@ -0,0 +1,553 @@
+"""
+Structural view on lambda expressions.
+
+Each lambda expression holds an immutable ExpressionNode describing the operation it performs (its kind, its operands
+and the callable it applies), the operands being themselves either expressions or constants. The whole expression is
+therefore a graph of nodes, that this module allows to inspect and transform:
+
+ * `get_node(expr)` returns the node of an expression,
+ * `walk(expr)` iterates over all sub-expressions, children first,
+ * `NodeVisitor` calls a `visit_<kind>` method for each sub-expression,
+ * `NodeTransformer` rebuilds an expression bottom-up, replacing each sub-expression with the result of its
+   `visit_<kind>` method,
+ * `rebuild(expr, args, kwargs)` creates the same operation than `expr`, on other operands,
+ * `fold_constants(expr)` precomputes all sub-expressions that only depend on constants,
+ * `fuse_comparisons(expr)` rewrites conjunctions of comparisons such as `(0 < x) & (x < 1)` into chained comparisons,
+ * `fingerprint(expr)` and `structurally_equal(expr1, expr2)` compare expressions by structure (also available as
+   methods of the expressions), and `StructuralKey(expr)` wraps an expression so that it can be used in a dict or set.
+
+All of these are iterative, so they support arbitrarily deep expressions.
+"""
+try:  # python 3.5+
+    from typing import Any, Tuple, Iterator, Optional, Callable
+except ImportError:
+    pass
+
+from mini_lambda.base import _LambdaExpressionBase, ExpressionNode, _CONSTANT_VAR_ID, _fold, _constant_key, \
+    _is_impure, NODE_VAR, NODE_CONSTANT, NODE_UNARY_OP, NODE_BINARY_OP, NODE_LOGICAL_OP, NODE_CALL, NODE_METHOD_CALL, \
+    NODE_GETATTR, NODE_GETITEM, NODE_BOOL_OP, NODE_IF_ELSE, NODE_NARY_OP, NODE_COMPARE_CHAIN
+
+
+def get_node(expression  # type: _LambdaExpressionBase
+             ):
+    # type: (...) -> Optional[ExpressionNode]
+    """
+    Returns the ExpressionNode describing the operation performed by `expression`, or None if the expression is opaque
+    (created with a custom inner function).
+
+    :param expression:
+    :return:
+    """
+    return expression._node
+
+
+def walk(expression  # type: _LambdaExpressionBase
+         ):
+    # type: (...) -> Iterator[_LambdaExpressionBase]
+    """
+    Iterates over all sub-expressions of `expression` (including itself), children first. A sub-expression that is
+    shared by several parents is only yielded once.
+
+    :param expression:
+    :return:
+    """
+    seen = set()
+    stack = [(expression, False)]
+    while len(stack) > 0:
+        expr, children_done = stack.pop()
+        if children_done:
+            yield expr
+        elif id(expr) not in seen:
+            seen.add(id(expr))
+            stack.append((expr, True))
+            if expr._node is not None:
+                for child in reversed(expr._node.children):
+                    if id(child) not in seen:
+                        stack.append((child, False))
+
+
+class NodeVisitor(object):
+    """
+    Base class for visitors of lambda expressions. `visit(expr)` walks all sub-expressions of expr (children first)
+    and for each of them calls `self.visit_<kind>(sub_expr, node)` where kind is the kind of its node (for example
+    `visit_binary_op`), or `self.generic_visit(sub_expr, node)` if no such method is defined. Opaque expressions are
+    visited with `visit_opaque`.
+    """
+
+    def visit(self,
+              expression  # type: _LambdaExpressionBase
+              ):
+        """
+        Visits all sub-expressions of `expression`.
+
+        :param expression:
+        :return: self, for convenience
+        """
+        for expr in walk(expression):
+            self._get_visitor(expr._node)(expr, expr._node)
+        return self
+
+    def _get_visitor(self, node):
+        return getattr(self, 'visit_' + (node.kind if node is not None else 'opaque'), self.generic_visit)
+
+    def generic_visit(self,
+                      expression,  # type: _LambdaExpressionBase
+                      node         # type: Optional[ExpressionNode]
+                      ):
+        """ Called for sub-expressions for which there is no specific visit method. Does nothing by default. """
+        pass
+
+
+class NodeTransformer(NodeVisitor):
+    """
+    Base class for transformers of lambda expressions. `transform(expr)` rebuilds the expression bottom-up: each
+    sub-expression is first rebuilt on top of its transformed operands (see `rebuild`), and then replaced with the
+    value returned by `self.visit_<kind>(sub_expr, node)` or `self.generic_visit(sub_expr, node)`. These methods may
+    return an expression, or a plain value that will be used as a constant by the parent operations.
+
+    `generic_visit` returns the sub-expression unchanged, so subclasses only need to implement the visit methods for
+    the kinds of nodes that they wish to transform.
+    """
+
+    def transform(self,
+                  expression  # type: _LambdaExpressionBase
+                  ):
+        # type: (...) -> _LambdaExpressionBase
+        """
+        Returns the transformed version of `expression`. It is always an expression: if the transformation results in
+        a plain value, it is returned as a constant expression.
+
+        :param expression:
+        :return:
+        """
+        results = dict()
+        for expr in walk(expression):
+            node = expr._node
+            new_expr = expr
+            if node is not None and len(node.children) > 0:
+                # rebuild the expression on top of the transformed operands, if any of them was changed
+                args = tuple(_transformed(arg, results) for arg in node.args)
+                kwargs = tuple((name, _transformed(arg, results)) for name, arg in node.kwargs)
+                if any(new is not old for new, old in zip(args, node.args)) \
+                        or any(new is not old for (_, new), (_, old) in zip(kwargs, node.kwargs)):
+                    new_expr = rebuild(expr, args, kwargs)
+
+            if isinstance(new_expr, _LambdaExpressionBase):
+                new_expr = self._get_visitor(new_expr._node)(new_expr, new_expr._node)
+
+            results[id(expr)] = new_expr
+
+        result = results[id(expression)]
+        if not isinstance(result, _LambdaExpressionBase):
+            result = type(expression).constant(result)
+        return result
+
+    def generic_visit(self,
+                      expression,  # type: _LambdaExpressionBase
+                      node         # type: Optional[ExpressionNode]
+                      ):
+        """ Called for sub-expressions for which there is no specific visit method. Returns the expression unchanged """
+        return expression
+
+
+def _transformed(arg, results):
+    """ Returns the transformed version of operand arg """
+    if isinstance(arg, _LambdaExpressionBase):
+        return results[id(arg)]
+    else:
+        return arg
+
+
+def rebuild(expression,  # type: _LambdaExpressionBase
+            args,        # type: Tuple
+            kwargs=()    # type: Tuple[Tuple[str, Any], ...]
+            ):
+    # type: (...) -> Any
+    """
+    Creates an expression performing the same operation than `expression`, but on the provided operands. This is done
+    by applying the operation symbolically, so that the new expression has its own inner function, node and string
+    representation. If none of the operands is an expression, the operation is performed immediately and its result
+    is returned.
+
+    :param expression: the expression whose operation should be reproduced
+    :param args: the new positional operands
+    :param kwargs: the new keyword operands, as a tuple of (name, operand) pairs
+    :return: a new expression, or a plain value
+    """
+    node = expression._node
+    if node is None:
+        raise ValueError('Opaque expressions cannot be rebuilt')
+
+    kind = node.kind
+    if kind in (NODE_VAR, NODE_CONSTANT):
+        return expression
+
+    if not any(isinstance(arg, _LambdaExpressionBase) for arg in args + tuple(arg for _, arg in kwargs)):
+        return node.apply(args, kwargs)
+
+    cls = type(expression)
+    if kind in (NODE_UNARY_OP, NODE_BINARY_OP):
+        # the python operator dispatches to the (possibly reflected) magic method of the expression
+        return node.method(*args)
+
+    elif kind == NODE_CALL:
+        return cls._get_expression_for_method_with_args(node.method, *args, **dict(kwargs))
+
+    elif kind == NODE_BOOL_OP:
+        return cls._get_expression_for_bool_op(node.symbol, *args)
+
+    elif kind == NODE_IF_ELSE:
+        return cls._get_expression_for_if_else(*args)
+
+    elif kind == NODE_NARY_OP:
+        return cls._get_expression_for_nary_op(node.symbol, *args)
+
+    elif kind == NODE_COMPARE_CHAIN:
+        return cls._get_expression_for_compare_chain(node.symbol, *args)
+
+    # all other kinds are methods of the first operand: make sure that it is an expression
+    obj = args[0]
+    if not isinstance(obj, _LambdaExpressionBase):
+        obj = cls.constant(obj, name=repr(obj))
+
+    if kind == NODE_LOGICAL_OP:
+        if node.symbol == '&':
+            return cls.__and__(obj, args[1])
+        elif node.symbol == '|':
+            return cls.__or__(obj, args[1])
+        else:
+            return cls.__xor__(obj, args[1])
+
+    elif kind == NODE_METHOD_CALL:
+        if node.symbol == '__call__':
+            return cls.__call__(obj, *args[1:], **dict(kwargs))
+        else:
+            return obj.add_bound_method_to_stack(node.symbol, *args[1:], **dict(kwargs))
+
+    elif kind == NODE_GETATTR:
+        return cls.__getattr__(obj, node.symbol)
+
+    elif kind == NODE_GETITEM:
+        return cls.__getitem__(obj, args[1])
+
+    else:
+        raise ValueError('Unsupported node kind: %r' % kind)
+
+
+class _ConstantFolder(NodeTransformer):
+    """ Replaces the sub-expressions that only depend on constants with their precomputed value """
+
+    def generic_visit(self, expression, node):
+        if expression._root_var != _CONSTANT_VAR_ID or node is None or node.kind == NODE_CONSTANT:
+            return expression
+
+        fun, new_node = _fold(expression._fun, node)
+        if new_node is node:
+            # the folding failed
+            return expression
+
+        return type(expression)(fun=fun, precedence_level=expression._precedence_level, root_var=_CONSTANT_VAR_ID,
+                                repr_on=expression.repr_on, node=new_node)
+
+
+def fold_constants(expression  # type: _LambdaExpressionBase
+                   ):
+    # type: (...) -> _LambdaExpressionBase
+    """
+    Returns an expression equivalent to `expression`, where all sub-expressions that only depend on constants are
+    replaced with their precomputed value. This is done automatically when expressions are created, unless constant
+    folding has been disabled with `set_constant_folding(False)`. The folded expression is displayed the same way than
+    the original one.
+
+    :param expression:
+    :return:
+    """
+    return _ConstantFolder().transform(expression)
+
+
+# the comparison symbols to use when the operands of a comparison are swapped
+_SWAPPED_COMPARISONS = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '==', '!=': '!='}
+
+
+def _as_comparison_chain(operand):
+    # type: (...) -> Optional[Tuple[Tuple, Tuple[str, ...]]]
+    """ Returns the (operands, symbols) of operand if it is a comparison or a chained comparison, or None """
+    if isinstance(operand, _LambdaExpressionBase) and operand._node is not None:
+        node = operand._node
+        if node.kind == NODE_COMPARE_CHAIN:
+            return node.args, node.symbol
+        elif node.kind == NODE_BINARY_OP and node.symbol in _SWAPPED_COMPARISONS:
+            return node.args, (node.symbol, )
+    return None
+
+
+def _is_pure(operand):
+    """ Returns True if evaluating operand has no side effect, so that it can be evaluated once or in another order """
+    if not isinstance(operand, _LambdaExpressionBase):
+        return True
+    return all(expr._node is not None and not _is_impure(expr._node) for expr in walk(operand))
+
+
+def _merge_comparisons(left, right):
+    """
+    Returns the chained comparison equivalent to 'left and right' if left and right are comparisons sharing an operand
+    (for example '0 < x' and 'x < 1', or 'x > 0' and 'x < 1'), or None.
+    """
+    left_chain, right_chain = _as_comparison_chain(left), _as_comparison_chain(right)
+    if left_chain is None or right_chain is None:
+        return None
+
+    # the candidates for each side: as is, or swapped for simple comparisons with pure operands
+    left_candidates, right_candidates = [left_chain], [right_chain]
+    for chain, candidates in ((left_chain, left_candidates), (right_chain, right_candidates)):
+        operands, symbols = chain
+        if len(symbols) == 1 and all(_is_pure(operand) for operand in operands):
+            candidates.append((operands[::-1], (_SWAPPED_COMPARISONS[symbols[0]], )))
+
+    for left_operands, left_symbols in left_candidates:
+        shared = left_operands[-1]
+        if not isinstance(shared, _LambdaExpressionBase) or not _is_pure(shared):
+            continue
+        for right_operands, right_symbols in right_candidates:
+            if isinstance(right_operands[0], _LambdaExpressionBase) \
+                    and structurally_equal(shared, right_operands[0]):
+                return type(shared)._get_expression_for_compare_chain(left_symbols + right_symbols,
+                                                                      *(left_operands + right_operands[1:]))
+    return None
+
+
+class _ComparisonFuser(NodeTransformer):
+    """ Rewrites the conjunctions of comparisons sharing an operand into chained comparisons """
+
+    def _fuse(self, operands):
+        """ Returns the operands of the conjunction, where consecutive comparisons were merged when possible """
+        fused = [operands[0]]
+        for operand in operands[1:]:
+            merged = _merge_comparisons(fused[-1], operand)
+            if merged is not None:
+                fused[-1] = merged
+            else:
+                fused.append(operand)
+        return fused
+
+    def visit_logical_op(self, expression, node):
+        if node.symbol == '&':
+            fused = self._fuse(node.args)
+            if len(fused) == 1:
+                return fused[0]
+        return expression
+
+    def visit_bool_op(self, expression, node):
+        if node.symbol == 'and':
+            fused = self._fuse(node.args)
+            if len(fused) < len(node.args):
+                return fused[0] if len(fused) == 1 else type(expression)._get_expression_for_bool_op('and', *fused)
+        return expression
+
+    def visit_nary_op(self, expression, node):
+        if node.symbol == '&':
+            fused = self._fuse(node.args)
+            if len(fused) < len(node.args):
+                return fused[0] if len(fused) == 1 else type(expression)._get_expression_for_nary_op('&', *fused)
+        return expression
+
+
+def fuse_comparisons(expression  # type: _LambdaExpressionBase
+                     ):
+    # type: (...) -> _LambdaExpressionBase
+    """
+    Returns an expression equivalent to `expression`, where the conjunctions ('&', And, All_, AllOf) of comparisons
+    sharing an operand are rewritten into chained comparisons: for example `(0 < x) & (x < 1)` or `(x > 0) & (x < 1)`
+    become `0 < x < 1`, where x is only evaluated once. The shared operand must not call impure functions.
+
+    Note that the result of a chained comparison is the result of its last evaluated comparison, while '&' always
+    returns a boolean: both are the same for the usual comparisons, that return booleans.
+
+    :param expression:
+    :return:
+    """
+    return _ComparisonFuser().transform(expression)
+
+
+def _get_structure(expression,  # type: _LambdaExpressionBase
+                   key_of       # type: Callable[[_LambdaExpressionBase], Any]
+                   ):
+    # type: (...) -> Tuple
+    """
+    Returns a hashable tuple describing the operation performed by `expression`, where the child expressions are
+    described by `key_of(child)`. Two expressions with equal structures perform the same operation on structurally
+    equal operands.
+
+    Constants are described by their type and value when their equality means that they behave the same, and by their
+    identity otherwise (see `mini_lambda.base._constant_key`). Variables are described by their symbol, and opaque
+    expressions by their identity. Folded constants are described by their value only.
+    """
+    node = expression._node
+    if node is None:
+        return 'opaque', id(expression)
+    elif node.kind == NODE_CONSTANT:
+        return NODE_CONSTANT, node.symbol, _constant_key(node.args[0])
+    elif node.kind == NODE_VAR:
+        return NODE_VAR, node.symbol
+    else:
+        return (node.kind, node.symbol, _constant_key(node.method), tuple(name for name, _ in node.kwargs),
+                tuple(key_of(operand) if isinstance(operand, _LambdaExpressionBase) else _constant_key(operand)
+                      for operand in node.operands))
+
+
+def fingerprint(expression  # type: _LambdaExpressionBase
+                ):
+    # type: (...) -> int
+    """
+    Returns the structural hash of `expression`. Structurally equal expressions (see `structurally_equal`) have the
+    same fingerprint, even if they are distinct objects. It is computed once per sub-expression and then cached, so
+    that the fingerprint of an expression built on top of already fingerprinted ones only costs one hash.
+
+    The fingerprint relies on the python hash of the constants: it is stable during the life of the process.
+
+    :param expression:
+    :return:
+    """
+    if expression._fingerprint is not None:
+        return expression._fingerprint
+
+    # iterative post-order traversal, that does not enter the sub-expressions that are already fingerprinted
+    stack = [(expression, False)]
+    while len(stack) > 0:
+        expr, children_done = stack.pop()
+        if expr._fingerprint is not None:
+            continue
+        elif children_done or expr._node is None:
+            expr._fingerprint = hash(_get_structure(expr, _get_fingerprint))
+        else:
+            stack.append((expr, True))
+            stack.extend((child, False) for child in expr._node.children if child._fingerprint is None)
+
+    return expression._fingerprint
+
+
+def _get_fingerprint(expression):
+    """ Returns the fingerprint of a sub-expression whose fingerprint has already been computed """
+    return expression._fingerprint
+
+
+def _get_flat_structure(expression  # type: _LambdaExpressionBase
+                        ):
+    # type: (...) -> Tuple
+    """
+    Returns a hashable tuple describing the whole structure of `expression`, without any reference to the expression
+    or its sub-expressions: the distinct structures of its sub-expressions (see `_get_structure`) in post-order, where
+    the child expressions are described by the position of their structure in the tuple. Structurally equal
+    expressions have equal flat structures, whether or not they share their identical sub-expressions.
+
+    :param expression:
+    :return:
+    """
+    positions = dict()   # id of a sub-expression -> position of its structure
+    indices = dict()     # structure -> position
+    structures = []
+
+    def position_of(child):
+        return positions[id(child)]
+
+    stack = [(expression, False)]
+    while len(stack) > 0:
+        expr, children_done = stack.pop()
+        if id(expr) in positions:
+            continue
+        elif children_done or expr._node is None:
+            structure = _get_structure(expr, position_of)
+            position = indices.get(structure)
+            if position is None:
+                position = indices[structure] = len(structures)
+                structures.append(structure)
+            positions[id(expr)] = position
+        else:
+            stack.append((expr, True))
+            stack.extend((child, False) for child in expr._node.children if id(child) not in positions)
+
+    return tuple(structures)
+
+
+def structurally_equal(expression,  # type: _LambdaExpressionBase
+                       other        # type: Any
+                       ):
+    # type: (...) -> bool
+    """
+    Returns True if `expression` and `other` perform the same operations on the same constants and variables, even if
+    they are distinct objects. For example two expressions created by evaluating `x + 1` twice are structurally equal,
+    while `x + 1` and `1 + x` are not. Numbers, strings, and tuples of such constants are compared by type and value,
+    other constants by identity.
+
+    Fingerprints are used to detect differences early, so comparing distinct expressions is usually immediate.
+
+    :param expression:
+    :param other:
+    :return:
+    """
+    if not isinstance(other, _LambdaExpressionBase):
+        return False
+
+    compared = set()
+    stack = [(expression, other)]
+    while len(stack) > 0:
+        expr, other_expr = stack.pop()
+        if expr is other_expr or (id(expr), id(other_expr)) in compared:
+            continue
+        compared.add((id(expr), id(other_expr)))
+
+        if fingerprint(expr) != fingerprint(other_expr):
+            return False
+
+        # same fingerprint: check the operations, and compare the child expressions afterwards
+        node, other_node = expr._node, other_expr._node
+        if node is None or other_node is None:
+            # opaque expressions are only equal to themselves
+            return False
+        elif node.kind != other_node.kind or node.symbol != other_node.symbol:
+            return False
+        elif node.kind == NODE_CONSTANT:
+            if _constant_key(node.args[0]) != _constant_key(other_node.args[0]):
+                return False
+        elif node.kind != NODE_VAR:
+            if _constant_key(node.method) != _constant_key(other_node.method) \
+                    or len(node.args) != len(other_node.args) or len(node.kwargs) != len(other_node.kwargs) \
+                    or any(name != other_name for (name, _), (other_name, _) in zip(node.kwargs, other_node.kwargs)):
+                return False
+            for operand, other_operand in zip(node.operands, other_node.operands):
+                if isinstance(operand, _LambdaExpressionBase):
+                    if not isinstance(other_operand, _LambdaExpressionBase):
+                        return False
+                    stack.append((operand, other_operand))
+                elif isinstance(other_operand, _LambdaExpressionBase) \
+                        or _constant_key(operand) != _constant_key(other_operand):
+                    return False
+
+    return True
+
+
+class StructuralKey(object):
+    """
+    Wraps an expression so that it can be used as a dictionary key or set member: the hash is the fingerprint of the
+    expression, and equality is structural equality. The expression is available as `key.expression`.
+
+    >>> unique_rules = set(StructuralKey(rule) for rule in rules)
+    """
+    __slots__ = ('expression',)
+
+    def __init__(self,
+                 expression  # type: _LambdaExpressionBase
+                 ):
+        self.expression = expression
+
+    def __hash__(self):
+        return fingerprint(self.expression)
+
+    def __eq__(self, other):
+        return isinstance(other, StructuralKey) and structurally_equal(self.expression, other.expression)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return 'StructuralKey(%s)' % self.expression.to_string()
@@ -0,0 +1,290 @@
+"""
+numexpr backend of the batch evaluation.
+
+The numpy translation of `mini_lambda.batch` allocates a full temporary array for each operation: evaluating
+`3 * X ** 2 + 2 * X * Y - Y` creates five temporaries of the size of the input. numexpr evaluates the same operations
+from a string such as `((3 * (x ** 2)) + ((2 * x) * x)) - x` in a single pass over the input, by blocks sized to fit
+in the cache, and on several threads.
+
+`to_numexpr(expr)` translates an expression to this string. Only arithmetic operators, comparisons (including
+chained comparisons), logical operators (`&`, `|`, `^`, `Not`, `AllOf`, `AnyOf`), `IfElse` and the functions
+supported by numexpr (`Sqrt`, `Log`, `Exp`, `abs`...) combining the variable and numeric constants can be
+translated. The exponents of the powers must be constants, and the left operands of the floor divisions must not be
+constants. Just like for the numeric values in python, the operands of the logical operators are true if they are
+not zero.
+
+`mini_lambda.batch.get_batch_function` uses this backend automatically when numexpr is installed, the expression can
+be translated and the input array has one of the dtypes natively supported by numexpr (int32, int64, float32 and
+float64).
+
+This module requires numexpr.
+"""
+from keyword import iskeyword
+import math
+import re
+
+try:  # python 3+
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+import numexpr
+import numpy as np
+
+try:  # python 3.5+
+    from typing import Any, Callable, Dict, Optional, Tuple
+except ImportError:
+    pass
+
+from mini_lambda.base import _LambdaExpressionBase, NODE_VAR, NODE_CONSTANT, NODE_UNARY_OP, NODE_BINARY_OP, \
+    NODE_LOGICAL_OP, NODE_CALL, NODE_METHOD_CALL, NODE_IF_ELSE, NODE_NARY_OP, NODE_COMPARE_CHAIN, \
+    _COMPARISON_SYMBOLS
+from mini_lambda.nodes import walk
+from mini_lambda.backends import _is_array_exponent, _is_constant, _is_not, _get_callee, _literal, _is_negative
+
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# the name of the variable in the generated code, when its symbol can not be used
+_DEFAULT_NAME = 'x0'
+
+_ARITHMETIC_OPERATORS = {'+', '-', '*', '/', '//', '%', '**'}
+
+# the smallest and largest integer constants supported by numexpr
+_MIN_INT = -2 ** 63
+_MAX_INT = 2 ** 63 - 1
+
+
+def _get_functions():
+    # type: (...) -> Dict[Callable, Tuple[str, int]]
+    """ Returns the names of the numexpr versions of the math functions, with their numbers of arguments. floor, ceil
+    and trunc are not included: numexpr returns floats for integer arrays. """
+    names = {'sqrt': 'sqrt', 'exp': 'exp', 'expm1': 'expm1', 'log10': 'log10', 'log2': 'log2', 'log1p': 'log1p',
+             'sin': 'sin', 'cos': 'cos', 'tan': 'tan', 'asin': 'arcsin', 'acos': 'arccos', 'atan': 'arctan',
+             'sinh': 'sinh', 'cosh': 'cosh', 'tanh': 'tanh', 'asinh': 'arcsinh', 'acosh': 'arccosh',
+             'atanh': 'arctanh', 'fabs': 'abs', 'isnan': 'isnan', 'isinf': 'isinf', 'isfinite': 'isfinite'}
+    binary_names = {'atan2': 'arctan2', 'hypot': 'hypot', 'copysign': 'copysign', 'fmod': 'fmod'}
+
+    functions = dict()
+    for names_, nb_args in ((names, 1), (binary_names, 2)):
+        for name, numexpr_name in names_.items():
+            if hasattr(math, name) and numexpr_name in numexpr.expressions.functions:
+                functions[getattr(math, name)] = numexpr_name, nb_args
+    return functions
+
+
+_FUNCTIONS = _get_functions()
+
+
+# the dtypes on which numexpr computes the same values as numpy. numexpr converts the smaller integer types to int32
+# and does not support arithmetic operations on booleans.
+_SUPPORTED_DTYPES = {np.dtype(np.int32), np.dtype(np.int64), np.dtype(np.float32), np.dtype(np.float64)}
+
+
+def _is_supported_dtype(dtype):
+    """ Returns True if numexpr computes the same values as numpy for arrays of this dtype """
+    return dtype in _SUPPORTED_DTYPES
+
+
+def _numexpr_literal(value):
+    # type: (...) -> str
+    """ Returns the code of a numeric constant, or raises a ValueError. numexpr only supports 64 bits integers. """
+    if isinstance(value, int) and not isinstance(value, bool) and not _MIN_INT <= value <= _MAX_INT:
+        raise ValueError('constant %r can not be used by numexpr' % (value, ))
+    return _literal(value)
+
+
+class _NumexprGenerator(object):
+    """ Generates the code of the sub-expressions of an expression, children first """
+
+    def __init__(self, name):
+        self.name = name
+        # the code of each sub-expression, whether it is atomic, and whether it is a boolean
+        self.codes = dict()  # type: Dict[int, Tuple[Optional[str], bool, bool]]
+
+    def operand(self, operand, atomic=True):
+        # type: (...) -> str
+        """ Returns the code of an operand, parenthesized if it is not atomic and `atomic` is True """
+        code, is_atom, _ = self.get(operand)
+        return code if (is_atom or not atomic) else '(%s)' % code
+
+    def get(self, operand):
+        # type: (...) -> Tuple[str, bool, bool]
+        """ Returns the code of an operand, whether it is atomic and whether it is a boolean """
+        if not isinstance(operand, _LambdaExpressionBase):
+            return _numexpr_literal(operand), not _is_negative(operand), isinstance(operand, bool)
+        code, is_atom, is_bool = self.codes[id(operand)]
+        if code is None:
+            raise ValueError('%s can not be used as an operand by numexpr' % operand.to_string())
+        return code, is_atom, is_bool
+
+    def number(self, operand):
+        # type: (...) -> str
+        """ Returns the code of an operand of an arithmetic operation. numexpr does not support booleans there. """
+        if self.get(operand)[2]:
+            raise ValueError('booleans can not be used in arithmetic operations by numexpr')
+        return self.operand(operand)
+
+    def power(self, base, exponent):
+        # type: (...) -> str
+        """ Returns the code of base ** exponent. numexpr returns 0 instead of raising an error for negative integer
+        exponents on integer arrays, so only the constant exponents that are positive integers or floats are
+        supported. """
+        if not _is_array_exponent(exponent):
+            raise ValueError('only constant exponents that are positive integers or floats can be used by numexpr')
+        return '%s ** %s' % (self.number(base), self.number(exponent))
+
+    def condition(self, operand):
+        # type: (...) -> str
+        """ Returns the code of the truth value of operand: itself if it is a boolean, `operand != 0` otherwise """
+        code, is_atom, is_bool = self.get(operand)
+        if is_bool:
+            return code if is_atom else '(%s)' % code
+        return '(%s != 0)' % code
+
+    def generate(self, expression):
+        # type: (...) -> Tuple[Optional[str], bool, bool]
+        """ Returns the code of expression, whether it is atomic and whether it is a boolean, or raises a ValueError """
+        node = expression._node
+        if node is None:
+            raise ValueError('opaque expressions can not be used by numexpr')
+
+        kind = node.kind
+        if kind == NODE_VAR:
+            return self.name, True, False
+
+        elif kind == NODE_CONSTANT:
+            value = node.args[0]
+            try:
+                return _numexpr_literal(value), not _is_negative(value), isinstance(value, bool)
+            except ValueError:
+                # this may be a function called by its parent, see NODE_METHOD_CALL
+                return None, True, False
+
+        elif kind == NODE_UNARY_OP and node.symbol in ('-', '+'):
+            return '%s%s' % (node.symbol, self.number(node.args[0])), False, False
+
+        elif kind == NODE_BINARY_OP and node.symbol == '**':
+            return self.power(*node.args), False, False
+
+        elif kind == NODE_BINARY_OP and node.symbol in _ARITHMETIC_OPERATORS:
+            if node.symbol == '//' and _is_constant(node.args[0]):
+                # numexpr only supports the floor division of an array
+                raise ValueError('the left operand of // must be an array to be used by numexpr')
+            left, right = (self.number(arg) for arg in node.args)
+            return '%s %s %s' % (left, node.symbol, right), False, False
+
+        elif kind == NODE_BINARY_OP and node.symbol in _COMPARISON_SYMBOLS:
+            left, right = (self.operand(arg) for arg in node.args)
+            return '%s %s %s' % (left, node.symbol, right), False, True
+
+        elif kind == NODE_COMPARE_CHAIN:
+            operands = [self.operand(arg) for arg in node.args]
+            return ' & '.join('(%s %s %s)' % (operands[i], symbol, operands[i + 1])
+                              for i, symbol in enumerate(node.symbol)), False, True
+
+        elif kind in (NODE_LOGICAL_OP, NODE_NARY_OP) and node.symbol in ('&', '|'):
+            return (' %s ' % node.symbol).join(self.condition(arg) for arg in node.args), False, True
+
+        elif kind == NODE_LOGICAL_OP and node.symbol == '^':
+            return '%s != %s' % tuple(self.condition(arg) for arg in node.args), False, True
+
+        elif kind == NODE_IF_ELSE:
+            condition, then, otherwise = node.args
+            is_bool = self.get(then)[2]
+            if self.get(otherwise)[2] != is_bool:
+                raise ValueError('the branches of a conditional expression evaluated by numexpr must both be booleans '
+                                 'or both be numbers')
+            return 'where(%s, %s, %s)' % (self.condition(condition), self.operand(then, atomic=False),
+                                          self.operand(otherwise, atomic=False)), True, is_bool
+
+        elif _is_not(node):
+            return '~%s' % self.condition(node.args[0]), False, True
+
+        elif kind in (NODE_CALL, NODE_METHOD_CALL) and len(node.kwargs) == 0:
+            function, args = _get_callee(node)
+            if function is math.log and len(args) in (1, 2):
+                code = 'log(%s)' % self.operand(args[0], atomic=False)
+                if len(args) == 2:
+                    code = '%s / log(%s)' % (code, self.operand(args[1], atomic=False))
+                return code, len(args) == 1, False
+            elif function is builtins.pow and len(args) == 2:
+                return self.power(*args), False, False
+            elif function is builtins.abs and len(args) == 1:
+                # numexpr's abs returns floats for integer arrays
+                code = self.number(args[0])
+                return 'where(%s < 0, -%s, %s)' % (code, code, code), True, False
+
+            try:
+                numexpr_name, nb_args = _FUNCTIONS[function]
+            except (KeyError, TypeError):
+                # unknown or unhashable function
+                pass
+            else:
+                if len(args) == nb_args:
+                    is_bool = numexpr_name in ('isnan', 'isinf', 'isfinite')
+                    return '%s(%s)' % (numexpr_name, ', '.join(self.operand(arg, atomic=False) for arg in args)), \
+                        True, is_bool
+
+        raise ValueError('%s can not be evaluated by numexpr' % expression.to_string())
+
+
+def _get_name(expression):
+    """ Returns the name of the variable in the generated code """
+    for expr in walk(expression):
+        if expr._node is not None and expr._node.kind == NODE_VAR:
+            symbol = expr._node.symbol
+            if _IDENTIFIER.match(symbol) and not iskeyword(symbol) and symbol not in numexpr.expressions.functions \
+                    and symbol not in ('True', 'False', 'None'):
+                return symbol
+            break
+    return _DEFAULT_NAME
+
+
+def to_numexpr(expression  # type: _LambdaExpressionBase
+               ):
+    # type: (...) -> Tuple[str, str]
+    """
+    Returns the numexpr code evaluating `expression` (see the module documentation), and the name of the variable in
+    this code.
+
+    :param expression:
+    :return: a tuple (code, name)
+    :raises ValueError: if the expression can not be translated
+    """
+    name = _get_name(expression)
+    generator = _NumexprGenerator(name)
+    for expr in walk(expression):
+        generator.codes[id(expr)] = generator.generate(expr)
+    return generator.operand(expression, atomic=False), name
+
+
+def get_numexpr_function(expression  # type: _LambdaExpressionBase
+                         ):
+    # type: (...) -> Optional[Callable[[np.ndarray], np.ndarray]]
+    """
+    Returns a function evaluating `expression` on each element of an array with numexpr, or None if the expression
+    can not be translated (see `to_numexpr`), does not depend on the variable, or if numexpr can not compile the
+    translated code. The returned function only supports arrays with a numeric dtype supported by numexpr (see
+    `_is_supported_dtype`). Its optional `out` argument is an array where the results are written.
+
+    :param expression:
+    :return:
+    """
+    try:
+        code, name = to_numexpr(expression)
+    except ValueError:
+        return None
+    if not re.search(r'\b%s\b' % re.escape(name), code):
+        # constant expression
+        return None
+    try:
+        numexpr.NumExpr(code, signature=[(name, np.float64)])
+    except (KeyError, NotImplementedError, SyntaxError, TypeError, ValueError):
+        # numexpr does not support the operation on these operands
+        return None
+
+    def _numexpr_function(values, out=None):
+        return numexpr.evaluate(code, local_dict={name: values}, global_dict={}, out=out, casting='same_kind')
+
+    return _numexpr_function
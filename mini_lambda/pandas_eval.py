@@ -0,0 +1,290 @@
+"""
+Evaluation of lambda expressions on pandas data frames with `DataFrame.eval`.
+
+Evaluating `df['a'] * 2 + df['b'] > 10` on a data frame creates a temporary series for each operation. pandas can
+evaluate the same operations in a single `DataFrame.eval` call (that uses numexpr when it is installed) from a string
+such as `((a * 2) + b) > 10`. `to_pandas_query(expr)` returns this string, that can also be given to `DataFrame.query`
+to filter rows, and `get_pandas_function(expr)` returns a function evaluating the expression on a data frame with
+`DataFrame.eval`.
+
+Only the expressions using the variable to access columns (`df['a']`), and combining them with constants, arithmetic
+operators, comparisons (including chained comparisons), logical operators (`&`, `|`, `Not`, `And`, `Or`, `AllOf`,
+`AnyOf`...), membership tests (`In`) and the functions supported by `DataFrame.eval` (`Sqrt`, `Log`, `Exp`...) can be
+translated. `abs` is only translated for float operands, since `DataFrame.eval` returns floats for integers. The
+exponents of the powers must be constants that are positive integers or floats, since pandas returns 0 for the negative
+integer powers of integer columns instead of raising an error. Since the logical operators of pandas are bitwise
+operators on integers, the operands of `&`, `|` and `Not` that are not booleans are compared to 0, and `And` and `Or`
+(that return one of their operands) are only translated when their operands are booleans. The columns named as a
+constant or a function of `DataFrame.eval` (`inf`, `abs`, `sqrt`...) can not be used, even quoted with backticks.
+"""
+from keyword import iskeyword
+import math
+import re
+
+try:  # python 3.5+
+    from typing import Any, Callable, Dict, Optional, Tuple
+except ImportError:
+    pass
+
+from mini_lambda.base import _LambdaExpressionBase, NODE_VAR, NODE_CONSTANT, NODE_UNARY_OP, NODE_BINARY_OP, \
+    NODE_LOGICAL_OP, NODE_CALL, NODE_METHOD_CALL, NODE_GETITEM, NODE_BOOL_OP, NODE_NARY_OP, NODE_COMPARE_CHAIN, \
+    _COMPARISON_SYMBOLS
+from mini_lambda.nodes import walk
+from mini_lambda.backends import _is_array_exponent, _is_not, _get_callee, _literal, _is_negative
+from mini_lambda.main import _is_in, _get_frozen_function
+
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# the operators supported by DataFrame.eval
+_UNARY_OPERATORS = {'-', '+', '~'}
+_BINARY_OPERATORS = {'+', '-', '*', '/', '//', '%', '**', '<', '<=', '==', '!=', '>', '>='}
+_LOGICAL_OPERATORS = {'&': '&', '|': '|', 'and': '&', 'or': '|'}
+
+# the names that DataFrame.eval reads as constants or functions (of pandas or numexpr), even when a column has this name
+# and is quoted with backticks
+_EVAL_NAMES = {'inf', 'Inf', 'abs', 'sqrt', 'exp', 'expm1', 'log', 'log1p', 'log2', 'log10', 'sin', 'cos', 'tan',
+               'arcsin', 'arccos', 'arctan', 'arctan2', 'sinh', 'cosh', 'tanh', 'arcsinh', 'arccosh', 'arctanh',
+               'floor', 'ceil', 'trunc', 'round', 'sign', 'signbit', 'copysign', 'nextafter', 'fmod', 'hypot',
+               'maximum', 'minimum', 'isnan', 'isinf', 'isfinite', 'where', 'real', 'imag', 'complex', 'conj',
+               'contains', 'sum', 'prod', 'min', 'max', 'copy', 'ones_like'}
+
+
+def _get_functions():
+    # type: (...) -> Dict[Callable, Tuple[str, int]]
+    """ Returns the names of the functions supported by DataFrame.eval, with their number of arguments """
+    functions = {abs: ('abs', 1)}
+    names = {'sqrt': 'sqrt', 'exp': 'exp', 'expm1': 'expm1', 'log': 'log', 'log1p': 'log1p', 'log10': 'log10',
+             'sin': 'sin', 'cos': 'cos', 'tan': 'tan', 'asin': 'arcsin', 'acos': 'arccos', 'atan': 'arctan',
+             'sinh': 'sinh', 'cosh': 'cosh', 'tanh': 'tanh', 'asinh': 'arcsinh', 'acosh': 'arccosh',
+             'atanh': 'arctanh', 'floor': 'floor', 'ceil': 'ceil'}
+    for name, pandas_name in names.items():
+        if hasattr(math, name):
+            functions[getattr(math, name)] = pandas_name, 1
+    functions[math.atan2] = 'arctan2', 2
+    return functions
+
+
+_FUNCTIONS = _get_functions()
+
+
+def _get_elementwise_functions():
+    """ Returns the pandas operators corresponding to the functions of `mini_lambda.batch.elementwise`, if numpy is
+    installed """
+    try:
+        from mini_lambda.batch import logical_and, logical_or, logical_not
+    except ImportError:
+        return dict()
+    return {logical_and: '&', logical_or: '|', logical_not: '~'}
+
+
+def _column(key):
+    # type: (...) -> str
+    """ Returns the code of a column in a pandas query, or raises a ValueError. Backticks only change the names that
+    are not identifiers: the columns named as a constant or a function of DataFrame.eval can not be used. """
+    if not isinstance(key, str):
+        raise ValueError('column %r can not be used in a pandas query: only string names are supported' % (key, ))
+    elif key in _EVAL_NAMES or (key.startswith('__') and key.endswith('__')):
+        raise ValueError('column %r can not be used in a pandas query: DataFrame.eval reserves this name' % (key, ))
+    elif _IDENTIFIER.match(key) and not iskeyword(key):
+        return key
+    elif '`' not in key:
+        return '`%s`' % key
+    raise ValueError('column %r can not be used in a pandas query' % (key, ))
+
+
+class _QueryGenerator(object):
+    """ Generates the code of the sub-expressions of an expression, children first """
+
+    def __init__(self):
+        # the code of each sub-expression, whether it is atomic, and whether it is a boolean
+        self.codes = dict()  # type: Dict[int, Tuple[Optional[str], bool, bool]]
+        self.elementwise_functions = _get_elementwise_functions()
+        # the ids of the sub-expressions that are known to return floats
+        self.floats = set()
+
+    def get(self, operand):
+        # type: (...) -> Tuple[str, bool, bool]
+        """ Returns the code of an operand, whether it is atomic and whether it is a boolean """
+        if not isinstance(operand, _LambdaExpressionBase):
+            return _literal(operand, strings=True), not _is_negative(operand), isinstance(operand, bool)
+        code, is_atom, is_bool = self.codes[id(operand)]
+        if code is None:
+            raise ValueError('%s can not be used as an operand in a pandas query' % operand.to_string())
+        return code, is_atom, is_bool
+
+    def operand(self, operand, atomic=True):
+        # type: (...) -> str
+        """ Returns the code of an operand, parenthesized if it is not atomic and `atomic` is True """
+        code, is_atom, _ = self.get(operand)
+        return code if (is_atom or not atomic) else '(%s)' % code
+
+    def is_float(self, operand):
+        """ Returns True if operand is known to be a float """
+        if not isinstance(operand, _LambdaExpressionBase):
+            return isinstance(operand, float)
+        return id(operand) in self.floats
+
+    def returns_float(self, expression):
+        """ Returns True if expression is known to return floats, from the floats among its operands """
+        node = expression._node
+        if node.kind == NODE_CONSTANT:
+            return isinstance(node.args[0], float)
+        elif node.kind == NODE_UNARY_OP and node.symbol in ('-', '+'):
+            return self.is_float(node.args[0])
+        elif node.kind == NODE_BINARY_OP and node.symbol not in _COMPARISON_SYMBOLS:
+            return node.symbol == '/' or any(self.is_float(arg) for arg in node.args)
+        elif node.kind in (NODE_CALL, NODE_METHOD_CALL):
+            function, args = _get_callee(node)
+            try:
+                pandas_name, _ = _FUNCTIONS.get(function, (None, None))
+            except TypeError:
+                # unhashable function
+                return False
+            if pandas_name == 'abs':
+                return len(args) == 1 and self.is_float(args[0])
+            # the functions of the math module return floats, except floor and ceil
+            return pandas_name is not None and pandas_name not in ('floor', 'ceil')
+        return False
+
+    def condition(self, operand):
+        # type: (...) -> str
+        """ Returns the code of the truth value of operand: itself if it is a boolean, `operand != 0` otherwise. The
+        logical operators of pandas are bitwise operators on other dtypes. """
+        if self.get(operand)[2]:
+            return self.operand(operand)
+        return '(%s != 0)' % self.operand(operand)
+
+    def generate(self, expression):
+        # type: (...) -> Tuple[Optional[str], bool, bool]
+        """ Returns the code of expression, whether it is atomic and whether it is a boolean, or raises a ValueError """
+        node = expression._node
+        if node is None:
+            raise ValueError('opaque expressions can not be used in a pandas query')
+
+        kind = node.kind
+        if kind == NODE_CONSTANT:
+            try:
+                value = node.args[0]
+                return _literal(value, strings=True), not _is_negative(value), isinstance(value, bool)
+            except ValueError:
+                # this may be a function called by its parent, see NODE_METHOD_CALL
+                return None, True, False
+
+        elif kind == NODE_VAR:
+            # only allowed as the frame whose columns are accessed: see NODE_GETITEM
+            return None, True, False
+
+        elif kind == NODE_GETITEM:
+            obj = node.args[0]
+            if isinstance(obj, _LambdaExpressionBase) and obj._node is not None and obj._node.kind == NODE_VAR \
+                    and not isinstance(node.args[1], _LambdaExpressionBase):
+                return _column(node.args[1]), True, False
+
+        elif kind == NODE_UNARY_OP and node.symbol in ('-', '+') and self.get(node.args[0])[2]:
+            # DataFrame.eval raises a NotImplementedError for -(a > 0)
+            raise ValueError('-, + can not be applied to booleans in a pandas query')
+
+        elif kind == NODE_UNARY_OP and node.symbol in _UNARY_OPERATORS:
+            return '%s%s' % (node.symbol, self.operand(node.args[0])), False, False
+
+        elif kind == NODE_BINARY_OP and node.symbol == '**':
+            if not _is_array_exponent(node.args[1]):
+                raise ValueError('only constant exponents that are positive integers or floats can be used in a pandas '
+                                 'query')
+            return '%s ** %s' % (self.operand(node.args[0]), self.operand(node.args[1])), False, False
+
+        elif kind == NODE_BINARY_OP and node.symbol in _BINARY_OPERATORS:
+            return '%s %s %s' % (self.operand(node.args[0]), node.symbol, self.operand(node.args[1])), False, \
+                node.symbol in _COMPARISON_SYMBOLS
+
+        elif kind == NODE_COMPARE_CHAIN:
+            code = self.operand(node.args[0])
+            for symbol, operand in zip(node.symbol, node.args[1:]):
+                code += ' %s %s' % (symbol, self.operand(operand))
+            return code, False, True
+
+        elif kind in (NODE_LOGICAL_OP, NODE_NARY_OP) and node.symbol in _LOGICAL_OPERATORS \
+                and all(isinstance(arg, _LambdaExpressionBase) for arg in node.args):
+            separator = ' %s ' % _LOGICAL_OPERATORS[node.symbol]
+            return separator.join(self.condition(arg) for arg in node.args), False, True
+
+        elif kind == NODE_BOOL_OP and node.symbol in _LOGICAL_OPERATORS \
+                and all(isinstance(arg, _LambdaExpressionBase) and self.get(arg)[2] for arg in node.args):
+            # 'and' and 'or' return one of their operands: only booleans give the same results
+            separator = ' %s ' % _LOGICAL_OPERATORS[node.symbol]
+            return separator.join(self.operand(arg) for arg in node.args), False, True
+
+        elif kind in (NODE_CALL, NODE_METHOD_CALL) and len(node.kwargs) == 0:
+            function, args = _get_callee(node)
+            if _is_not(node):
+                return '~%s' % self.condition(args[0]), False, True
+            elif function is _is_in and isinstance(args[1], (list, tuple, set, frozenset)):
+                container = getattr(args[1], 'container', args[1])
+                elements = ', '.join(_literal(element, strings=True) for element in container)
+                return '%s in [%s]' % (self.operand(args[0]), elements), False, True
+
+            try:
+                operator_ = self.elementwise_functions.get(function)
+                pandas_name, nb_args = _FUNCTIONS.get(function, (None, None))
+            except TypeError:
+                # unhashable function
+                operator_ = pandas_name = nb_args = None
+
+            if operator_ is not None and all(isinstance(arg, _LambdaExpressionBase) for arg in args):
+                if operator_ == '~':
+                    # logical_not is np.logical_not on non-boolean arrays
+                    return '~%s' % self.condition(args[0]), False, True
+                # logical_and, logical_or and logical_xor are bitwise operations on integers, as in pandas
+                return (' %s ' % operator_).join(self.operand(arg) for arg in args), False, \
+                    all(self.get(arg)[2] for arg in args)
+            elif pandas_name == 'abs' and not self.is_float(args[0]):
+                # DataFrame.eval returns floats for the absolute values of integers
+                raise ValueError('abs can only be used in a pandas query on floats')
+            elif pandas_name is not None and len(args) == nb_args:
+                return '%s(%s)' % (pandas_name, ', '.join(self.operand(arg, atomic=False) for arg in args)), True, \
+                    False
+
+        raise ValueError('%s can not be used in a pandas query' % expression.to_string())
+
+
+def to_pandas_query(expression  # type: _LambdaExpressionBase
+                    ):
+    # type: (...) -> str
+    """
+    Returns the string that `DataFrame.eval` and `DataFrame.query` can use to evaluate `expression`, where the
+    variable is the data frame (see the module documentation). For example `df['a'] * 2 + df['b'] > 10` is translated
+    to `((a * 2) + b) > 10`.
+
+    :param expression:
+    :return:
+    :raises ValueError: if the expression can not be translated
+    """
+    generator = _QueryGenerator()
+    for expr in walk(expression):
+        generator.codes[id(expr)] = generator.generate(expr)
+        if generator.returns_float(expr):
+            generator.floats.add(id(expr))
+
+    return generator.operand(expression, atomic=False)
+
+
+def get_pandas_function(expression  # type: _LambdaExpressionBase
+                        ):
+    # type: (...) -> Callable[[Any], Any]
+    """
+    Returns a function evaluating `expression` on a data frame with a single `DataFrame.eval` call. If the expression
+    can not be translated (see `to_pandas_query`), the returned function evaluates it as `as_function()` does.
+
+    :param expression:
+    :return:
+    """
+    try:
+        query = to_pandas_query(expression)
+    except ValueError:
+        return _get_frozen_function(expression)
+
+    def _pandas_eval(frame):
+        return frame.eval(query)
+
+    return _pandas_eval
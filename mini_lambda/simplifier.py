@@ -0,0 +1,412 @@
+"""
+Algebraic simplification of lambda expressions.
+
+Expressions generated programmatically, for example from configuration files, often contain operations that are
+useless or that could be computed more efficiently. `simplify(expr, types)` returns an equivalent expression where
+
+ * the identities are removed: `x + 0`, `x - 0`, `x * 1`, `1 * x`, `x / 1` and `x ** 1` become `x`,
+ * the double negations are removed: `Not(Not(e))` becomes `bool(e)` (or `e` if it is already a boolean), and
+   `-(-x)` becomes `x`,
+ * the squares of the variable are computed with a multiplication: `x ** 2` becomes `x * x`,
+ * the modular powers are fused: `(x ** n) % m` becomes `pow(x, n, m)`,
+ * the polynomials of the variable are rewritten in Horner form: `3 * x ** 2 + 2 * x + 1` becomes
+   `(3 * x + 2) * x + 1`.
+
+All of these rewrites are only valid for numbers: `x + 0` raises an error for a string, and `x * 1` creates a new
+list for a list. The `types` argument declares the types that the variable may have (`int`, `float` or both), from
+which the type of each sub-expression is inferred: a rewrite is only applied when the inferred types guarantee that
+the result is the same. Without `types`, only the rewrites that are valid for any type are applied.
+
+The rewrites that may change the rounding of floating point results (`x ** 2` and the Horner form of polynomials for
+floats) are only applied with `fast_math=True`, as well as the removal of `x + 0` for floats: `-0.0 + 0` is `0.0`.
+"""
+import math
+
+try:  # python 3.5+
+    from typing import Any, Dict, FrozenSet, Optional, Tuple, Type, Union
+except ImportError:
+    pass
+
+from mini_lambda.base import _LambdaExpressionBase, NODE_VAR, NODE_CONSTANT, NODE_UNARY_OP, NODE_BINARY_OP, \
+    NODE_LOGICAL_OP, NODE_CALL, NODE_NARY_OP, NODE_IF_ELSE, NODE_COMPARE_CHAIN, _COMPARISON_SYMBOLS
+from mini_lambda.nodes import NodeTransformer, walk
+from mini_lambda.backends import _is_constant, _constant_value, _is_not
+
+
+# the types for which the numeric rewrites are valid
+_NUMERIC_TYPES = frozenset((int, float))
+_BOOL_TYPES = frozenset((bool, ))
+
+# the maximum degree of the polynomials rewritten in Horner form
+_MAX_DEGREE = 32
+
+
+def simplify(expression,      # type: _LambdaExpressionBase
+             types=None,      # type: Union[Type, Tuple[Type, ...]]
+             fast_math=False  # type: bool
+             ):
+    # type: (...) -> _LambdaExpressionBase
+    """
+    Returns an expression equivalent to `expression`, where identities, double negations, squares, modular powers and
+    polynomials of the variable are simplified (see the module documentation).
+
+    :param expression:
+    :param types: the type, or tuple of types, that the variable may have. The numeric rewrites are only applied if
+        they are `int` and/or `float`. If None (default), only the rewrites that are valid for any type are applied.
+    :param fast_math: if True, the rewrites that may change the rounding of floating point results are also applied
+        for floats: `x ** 2` becomes `x * x` (an overflow then returns inf instead of raising an OverflowError), and
+        polynomials are rewritten in Horner form.
+    :return:
+    """
+    if types is None:
+        var_types = None
+    else:
+        var_types = frozenset(types if isinstance(types, tuple) else (types, ))
+        if not var_types <= _NUMERIC_TYPES:
+            var_types = None
+
+    if var_types is not None:
+        expression = _HornerRewriter(_get_horner_forms(expression, var_types, fast_math)).transform(expression)
+    return _Simplifier(var_types, fast_math).transform(expression)
+
+
+# ------- type inference
+def _constant_types(value):
+    # type: (...) -> Optional[FrozenSet[Type]]
+    """ Returns the type of a constant operand as a set, if it is a number. bool is not considered as a number """
+    if isinstance(value, _LambdaExpressionBase):
+        node = value._node
+        if node is None or node.kind != NODE_CONSTANT:
+            return None
+        value = node.args[0]
+    return frozenset((type(value), )) if type(value) in _NUMERIC_TYPES else None
+
+
+def _arithmetic_types(left, right):
+    """ Returns the result types of +, -, * // and % between numbers of the given types """
+    return frozenset(int if (a is int and b is int) else float for a in left for b in right)
+
+
+class _TypeInference(object):
+    """ Infers the set of possible types of each sub-expression, from the types of the variable """
+
+    def __init__(self, var_types):
+        self.var_types = var_types
+        self._types = dict()  # id -> (expression, types). The expression is kept so that the id is not reused
+
+    def get(self, operand):
+        # type: (...) -> Optional[FrozenSet[Type]]
+        """ Returns the set of possible types of operand, or None if they are unknown """
+        if not isinstance(operand, _LambdaExpressionBase):
+            return _constant_types(operand)
+        try:
+            return self._types[id(operand)][1]
+        except KeyError:
+            types = None
+            for expr in walk(operand):
+                if id(expr) not in self._types:
+                    types = self._infer(expr)
+                    self._types[id(expr)] = (expr, types)
+            return self._types[id(operand)][1]
+
+    def is_numeric(self, operand):
+        types = self.get(operand)
+        return types is not None and types <= _NUMERIC_TYPES
+
+    def _infer(self, expression):
+        """ Returns the types of expression, the types of its operands being known """
+        node = expression._node
+        if node is None:
+            return None
+
+        kind = node.kind
+        if kind == NODE_VAR:
+            return self.var_types
+        elif kind == NODE_CONSTANT:
+            return _constant_types(expression)
+
+        operands = [self.get(arg) for arg in node.args]
+        numeric = len(node.kwargs) == 0 and all(t is not None and t <= _NUMERIC_TYPES for t in operands)
+
+        if kind == NODE_UNARY_OP:
+            if numeric and node.symbol in ('-', '+'):
+                return operands[0]
+
+        elif kind == NODE_BINARY_OP:
+            if not numeric:
+                return None
+            left, right = operands
+            if node.symbol in _COMPARISON_SYMBOLS:
+                return _BOOL_TYPES
+            elif node.symbol in ('+', '-', '*', '//', '%'):
+                return _arithmetic_types(left, right)
+            elif node.symbol == '/':
+                return frozenset((float, ))
+            elif node.symbol == '**' and _is_constant(node.args[1]) and type(_constant_value(node.args[1])) is int \
+                    and _constant_value(node.args[1]) >= 0:
+                return left
+
+        elif kind == NODE_NARY_OP:
+            if node.symbol in ('&', '|'):
+                return _BOOL_TYPES
+            elif numeric and node.symbol in ('+', '*'):
+                result = operands[0]
+                for types in operands[1:]:
+                    result = _arithmetic_types(result, types)
+                return result
+
+        elif kind == NODE_LOGICAL_OP:
+            if node.symbol in ('&', '|'):
+                return _BOOL_TYPES
+
+        elif kind == NODE_COMPARE_CHAIN:
+            if numeric:
+                return _BOOL_TYPES
+
+        elif kind == NODE_CALL:
+            if _is_not(node) or node.method is bool:
+                return _BOOL_TYPES
+            elif numeric and node.method is abs:
+                return operands[0]
+
+        elif kind == NODE_IF_ELSE:
+            then, otherwise = operands[1:]
+            if then is not None and otherwise is not None:
+                return then | otherwise
+
+        return None
+
+
+# ------- helpers
+def _is_number(operand, value):
+    """ Returns True if operand is the constant number `value` (booleans excluded) """
+    return _is_constant(operand) and type(_constant_value(operand)) in _NUMERIC_TYPES \
+        and _constant_value(operand) == value
+
+
+def _is_var(operand):
+    return isinstance(operand, _LambdaExpressionBase) and operand._node is not None and operand._node.kind == NODE_VAR
+
+
+# ------- identities, double negations, squares and modular powers
+class _Simplifier(NodeTransformer):
+    """ Applies the local rewrites, bottom-up """
+
+    def __init__(self, var_types, fast_math):
+        self.types = _TypeInference(var_types)
+        self.fast_math = fast_math
+
+    def _same_types(self, expression, operand):
+        """ Returns True if replacing expression with operand does not change the type of the result """
+        return self.types.is_numeric(operand) and self.types.get(expression) == self.types.get(operand)
+
+    def _is_exact_addition(self, operand, zero):
+        """ Returns True if adding the constant `zero` to operand returns operand: always for ints, but for floats only
+        if zero is -0.0 since -0.0 + 0.0 is 0.0, unless fast_math is enabled """
+        return self.types.get(operand) == frozenset((int, )) or self.fast_math \
+            or (type(_constant_value(zero)) is float and math.copysign(1., _constant_value(zero)) < 0)
+
+    def visit_unary_op(self, expression, node):
+        operand = node.args[0]
+        if node.symbol == '+' and self._same_types(expression, operand):
+            return operand
+        elif node.symbol == '-' and isinstance(operand, _LambdaExpressionBase) and operand._node is not None \
+                and operand._node.kind == NODE_UNARY_OP and operand._node.symbol == '-' \
+                and self._same_types(expression, operand._node.args[0]):
+            return operand._node.args[0]
+        return expression
+
+    def visit_binary_op(self, expression, node):
+        symbol = node.symbol
+        left, right = node.args
+
+        # identities
+        if (symbol in ('+', '-') and _is_number(right, 0)) or (symbol in ('*', '/', '**') and _is_number(right, 1)):
+            if self._same_types(expression, left) and (symbol != '+' or self._is_exact_addition(left, right)) \
+                    and (symbol != '-' or self._is_exact_addition(left, -float(_constant_value(right)))):
+                return left
+        elif (symbol == '+' and _is_number(left, 0)) or (symbol == '*' and _is_number(left, 1)):
+            if self._same_types(expression, right) and (symbol != '+' or self._is_exact_addition(right, left)):
+                return right
+
+        # squares of the variable
+        elif symbol == '**' and _is_var(left) and _is_number(right, 2) and type(_constant_value(right)) is int:
+            types = self.types.get(left)
+            if types is not None and (types == frozenset((int, )) or (self.fast_math and types <= _NUMERIC_TYPES)):
+                return left * left
+
+        # modular powers
+        elif symbol == '%' and _is_constant(right) and type(_constant_value(right)) is int \
+                and _constant_value(right) != 0 and isinstance(left, _LambdaExpressionBase) and left._node is not None \
+                and left._node.kind == NODE_BINARY_OP and left._node.symbol == '**':
+            base, exponent = left._node.args
+            if self.types.get(base) == frozenset((int, )) and _is_constant(exponent) \
+                    and type(_constant_value(exponent)) is int and _constant_value(exponent) >= 0:
+                return type(expression)._get_expression_for_method_with_args(pow, base, _constant_value(exponent),
+                                                                             _constant_value(right))
+        return expression
+
+    def visit_call(self, expression, node):
+        if _is_not(node):
+            operand = node.args[0]
+            if isinstance(operand, _LambdaExpressionBase) and operand._node is not None and _is_not(operand._node):
+                # not not e is bool(e)
+                inner = operand._node.args[0]
+                if self.types.get(inner) == _BOOL_TYPES:
+                    return inner
+                return type(expression)._get_expression_for_method_with_args(bool, inner)
+        return expression
+
+
+# ------- Horner form of polynomials
+def _add_polynomials(left, right, sign=1):
+    result = dict(left)
+    for degree, coefficient in right.items():
+        result[degree] = result.get(degree, 0) + sign * coefficient
+    return result
+
+
+def _multiply_polynomials(left, right):
+    result = dict()
+    for left_degree, left_coefficient in left.items():
+        for right_degree, right_coefficient in right.items():
+            degree = left_degree + right_degree
+            if degree > _MAX_DEGREE:
+                return None
+            result[degree] = result.get(degree, 0) + left_coefficient * right_coefficient
+    return result
+
+
+def _get_polynomial(expression, polynomials):
+    # type: (...) -> Optional[Dict[int, Any]]
+    """
+    Returns the coefficients {degree: coefficient} of expression if it is a polynomial of the variable, or None. The
+    polynomials of its operands are read from `polynomials`.
+    """
+    node = expression._node
+    if node is None:
+        return None
+    elif node.kind == NODE_VAR:
+        return {1: 1}
+    elif node.kind == NODE_CONSTANT:
+        return {0: node.args[0]} if _constant_types(expression) is not None else None
+
+    operands = []
+    for arg in node.args:
+        if isinstance(arg, _LambdaExpressionBase):
+            operands.append(polynomials.get(id(arg)))
+        else:
+            operands.append({0: arg} if _constant_types(arg) is not None else None)
+    if len(node.kwargs) > 0 or any(operand is None for operand in operands):
+        return None
+
+    if node.kind == NODE_UNARY_OP and node.symbol in ('-', '+'):
+        return _add_polynomials({}, operands[0], sign=-1 if node.symbol == '-' else 1)
+
+    elif node.kind in (NODE_BINARY_OP, NODE_NARY_OP) and node.symbol in ('+', '*'):
+        result = operands[0]
+        for operand in operands[1:]:
+            if node.symbol == '+':
+                result = _add_polynomials(result, operand)
+            else:
+                result = _multiply_polynomials(result, operand)
+                if result is None:
+                    return None
+        return result
+
+    elif node.kind == NODE_BINARY_OP and node.symbol == '-':
+        return _add_polynomials(operands[0], operands[1], sign=-1)
+
+    elif node.kind == NODE_BINARY_OP and node.symbol == '**':
+        exponent = operands[1]
+        if set(exponent) != {0} or type(exponent[0]) is not int or not 0 <= exponent[0] <= _MAX_DEGREE:
+            return None
+        # p ** 0 is 1.0 if p is a float
+        result = {0: 1.0 if any(type(c) is float for c in operands[0].values()) else 1}
+        for _ in range(exponent[0]):
+            result = _multiply_polynomials(result, operands[0])
+            if result is None:
+                return None
+        return result
+
+    return None
+
+
+def _is_sum(node):
+    return node is not None and ((node.kind == NODE_BINARY_OP and node.symbol in ('+', '-'))
+                                 or (node.kind == NODE_NARY_OP and node.symbol == '+'))
+
+
+def _get_horner_forms(expression, var_types, fast_math):
+    # type: (...) -> Dict[int, _LambdaExpressionBase]
+    """
+    Returns the Horner form of the largest polynomials of the variable contained in expression, indexed by the id of
+    the sub-expression that they replace.
+    """
+    polynomials = dict()
+    inner = set()
+    var = None
+    for expr in walk(expression):
+        if expr._node is not None and expr._node.kind == NODE_VAR:
+            var = expr
+        polynomial = _get_polynomial(expr, polynomials)
+        if polynomial is not None:
+            polynomials[id(expr)] = polynomial
+            inner.update(id(child) for child in expr._node.children)
+
+    horner_forms = dict()
+    for expr in walk(expression):
+        polynomial = polynomials.get(id(expr))
+        if polynomial is None or id(expr) in inner or not _is_sum(expr._node):
+            continue
+
+        # the rewrite changes the order of the floating point operations
+        exact = var_types == frozenset((int, )) and all(type(c) is int for c in polynomial.values())
+        if not (exact or fast_math):
+            continue
+
+        coefficients = dict((degree, c) for degree, c in polynomial.items() if c != 0)
+        if len(coefficients) == 0 or max(coefficients) < 2:
+            continue
+        elif any(type(c) is float for c in polynomial.values()) \
+                and not any(type(c) is float for c in coefficients.values()):
+            # the float zero terms make the result a float
+            continue
+
+        # the powers are replaced with multiplications, and the number of operations should not increase
+        horner = _horner(var, coefficients)
+        if sum(1 for _ in walk(horner)) <= sum(1 for _ in walk(expr)):
+            horner_forms[id(expr)] = horner
+    return horner_forms
+
+
+def _horner(var, coefficients):
+    """ Returns the Horner form of the polynomial of var with the given non-zero coefficients """
+    degree = max(coefficients)
+    result = coefficients[degree]
+    for d in range(degree - 1, -1, -1):
+        if isinstance(result, _LambdaExpressionBase):
+            result = result * var
+        elif type(result) is int and result == 1:
+            result = var
+        elif type(result) is int and result == -1:
+            result = -var
+        else:
+            result = result * var
+
+        coefficient = coefficients.get(d, 0)
+        if coefficient > 0:
+            result = result + coefficient
+        elif coefficient < 0:
+            result = result - (-coefficient)
+    return result
+
+
+class _HornerRewriter(NodeTransformer):
+    """ Replaces the polynomials with their Horner form """
+
+    def __init__(self, horner_forms):
+        self.horner_forms = horner_forms
+
+    def generic_visit(self, expression, node):
+        return self.horner_forms.get(id(expression), expression)
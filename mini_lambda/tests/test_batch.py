@@ -0,0 +1,301 @@
+import math
+
+import numpy as np
+import pytest
+
+from mini_lambda import x, s, In, IfElse, Between, C, Sum_, make_lambda_friendly_method, Not, And, Or, AllOf, All_
+from mini_lambda.batch import get_batch_function, elementwise, _BatchPlanner
+from mini_lambda.symbols.builtins import Pow
+from mini_lambda.symbols.math_ import Log, Sqrt, Exp, Floor, Pow as MathPow
+
+
+def _get_step_names(expr):
+    planner = _BatchPlanner()
+    planner.plan(expr)
+    return [step.function.__name__ for step in planner.steps[1:]]
+
+
+def _safe_log(v):
+    return math.log(v)
+
+
+SafeLog = make_lambda_friendly_method(_safe_log)
+
+
+@pytest.mark.parametrize('expr, steps', [
+    (x ** 2 + 3 * x, ['_as_number', 'power', 'multiply', 'add']),
+    (Sqrt(x) * Exp(-x) + abs(x - 5), ['_as_number', 'sqrt', 'negative', 'exp', 'multiply', 'subtract', 'absolute',
+                                      'add']),
+    (Log(x, 10) + Floor(x), ['_as_number', '_log', 'floor', 'add']),
+    (Sum_(x, 2 * x, 1), ['_as_number', 'multiply', 'add', 'add']),
+    (Between(x, 2, 5), ['less_equal', 'less_equal', 'logical_and']),
+    (In(x, [1, 2, 3]), ['_isin']),
+    (x.is_in((1, 2, 3)), ['_isin']),
+    (IfElse(x > 3, Log(x), -1), ['greater', '_where_lazy']),
+    (IfElse(x > 3, x * 2, -x), ['greater', '_as_number', 'multiply', 'negative', '_where']),
+    ((x > 0) & (x < 5), ['greater', 'less', 'logical_and']),
+    ((x < 1) | (x > 5) ^ (x > 9), ['less', 'greater', 'greater', 'logical_xor', 'logical_or']),
+    (Not(x > 3) | AllOf(x > 1, x < 4), ['greater', 'logical_not', 'greater', 'less', 'logical_and', 'logical_or']),
+    (And(x > 3, x - 5), ['greater', '_as_number', 'subtract', '_and_values']),
+    (Or(x - 5, 7), ['_as_number', 'subtract', '_or_values']),
+    # not translatable: evaluated element by element
+    (C(round)(x) * 2, ['_apply_elementwise', '_as_number', 'multiply']),
+    (IfElse(x > 3, SafeLog(x - 3.1), -1), ['_apply_elementwise']),
+])
+def test_evaluate_batch(expr, steps):
+    """ Tests that evaluate_batch translates the nodes to numpy operations and returns the same results as evaluate """
+
+    assert _get_step_names(expr) == steps
+
+    values = np.linspace(0.5, 10, 20)
+    expected = np.array([expr.evaluate(v) for v in values])
+    result = expr.evaluate_batch(values)
+    assert isinstance(result, np.ndarray) and result.shape == values.shape
+    assert result.dtype != object
+    np.testing.assert_allclose(result.astype(float), expected.astype(float))
+
+
+def test_evaluate_batch_booleans():
+    """ Tests that arithmetic operations on booleans give the same results as python, where True + True is 2 """
+
+    values = np.array([1, 2])
+    for expr in ((x == 1) + (x > -1) + 2, -(x > 1), ~(x > 1), (x > 1) - (x > 0), (x > 0) * 3 + True, abs(x > 1),
+                 Sqrt(x > 1) * 1000.1, x + x):
+        for inputs in (values, values == 1):
+            expected = [expr.evaluate(v) for v in inputs.tolist()]
+            assert expr.evaluate_batch(inputs, use_numexpr=False).tolist() == expected
+            assert expr.evaluate_batch(inputs).tolist() == expected
+
+    expr = (x == 1) + (x > -1) + 2
+    assert _get_step_names(expr) == ['equal', 'greater', '_as_number', '_as_number', 'add', 'add']
+    assert expr.evaluate_batch(values).tolist() == [4, 3]
+
+
+def test_evaluate_batch_negative_powers():
+    """ Tests that the negative integer powers of integers are floats, as in python, instead of raising an error """
+
+    values = np.array([1, 2, 4])
+    for expr in (x ** -1, 2 ** -x, x ** C(-2), Pow(x, -1), x ** (x - 2), MathPow(x, -2), MathPow(x, 2)):
+        expected = [expr.evaluate(v) for v in values.tolist()]
+        for chunk_size in (None, 2):
+            np.testing.assert_array_equal(expr.evaluate_batch(values, use_numexpr=False, chunk_size=chunk_size),
+                                          expected)
+        np.testing.assert_array_equal(expr.evaluate_batch(values), expected)
+
+    # the positive constant exponents still use np.power
+    assert _get_step_names(x ** 2) == ['_as_number', 'power']
+    assert _get_step_names(x ** -1) == ['_as_number', '_power']
+
+
+def test_evaluate_batch_mixed_branches():
+    """ Tests that the branches of different kinds are not converted to a common dtype """
+
+    values = np.array([1, -2, 3])
+    for expr in (IfElse(x > 0, x, 'neg'), IfElse(x > 0, 'pos', Log(-x)), Or(x - 1, 'one'), And(x > 0, 'pos')):
+        expected = [expr.evaluate(v) for v in values.tolist()]
+        for chunk_size in (None, 2):
+            result = expr.evaluate_batch(values, chunk_size=chunk_size)
+            assert result.dtype == object
+            assert result.tolist() == expected
+
+    # numbers of different kinds still share a numeric dtype
+    assert IfElse(x > 0, x, 0.5).evaluate_batch(values).tolist() == [1., 0.5, 3.]
+
+
+def test_evaluate_batch_non_numeric_comparisons():
+    """ Tests that the comparisons that numpy can not perform are performed element by element """
+
+    numbers, strings = np.arange(3), np.array(['a', 'b', 'c'])
+    for expr, inputs in ((x == 'a', (numbers, strings)), (x != b'a', (numbers, strings)),
+                         (x == (1, 2), (numbers, strings)), (x == None, (numbers, strings)),
+                         (Between(x, 'a', 'b'), (strings, )), (Between(x, 0, 1) | (x == 'c'), (numbers, ))):
+        for values in inputs:
+            expected = [expr.evaluate(v) for v in values.tolist()]
+            assert expr.evaluate_batch(values).tolist() == expected
+
+    # numpy still compares strings with strings
+    assert _get_step_names(x == 'a') == ['_compare_strings']
+    with pytest.raises(TypeError):
+        (x < 'a').evaluate_batch(numbers)
+
+
+def test_evaluate_batch_lazy():
+    """ Tests that the lazy operands that may fail are only evaluated on the elements where they are selected """
+    import warnings
+
+    values = np.array([-2, -1, 0, 1, 3])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        for expr, steps in ((IfElse(x >= 0, 2 ** x, 0), ['greater_equal', '_where_lazy']),
+                            (IfElse(x > 0, Sqrt(x), -1), ['greater', '_where_lazy']),
+                            ((x > 0) & (Log(x) > 0), ['greater', '_and_lazy']),
+                            ((x <= 0) | (Log(x) > 0), ['less_equal', '_or_lazy']),
+                            (All_(x > 0, x != 1, 1 / Log(x)), ['greater', '_and_values_lazy', '_and_values_lazy']),
+                            (Or(x <= 0, Log(x)), ['less_equal', '_or_values_lazy']),
+                            (IfElse(x > 0, IfElse(x > 1, 1 // (x - 1), Log(x)), 0), ['greater', '_where_lazy'])):
+            assert _get_step_names(expr) == steps
+            expected = [expr.evaluate(v) for v in values.tolist()]
+            for chunk_size in (None, 2):
+                result = expr.evaluate_batch(values, use_numexpr=False, chunk_size=chunk_size)
+                np.testing.assert_array_equal(result, expected)
+
+
+def test_evaluate_batch_fallbacks():
+    """ Tests the element by element evaluation of nodes that can not be translated """
+
+    # non-numeric results stay arrays of objects
+    expr = s.upper() + '!'
+    np.testing.assert_array_equal(expr.evaluate_batch(['a', 'b']), ['A!', 'B!'])
+
+    # the right operand of & can not be translated: it is only evaluated where the left one is true
+    expr = (x > 0) & (SafeLog(x) > 0)
+    assert _get_step_names(expr) == ['_apply_elementwise']
+    np.testing.assert_array_equal(expr.evaluate_batch(np.array([0, 1, 2])), [False, False, True])
+
+    # constant expressions are broadcast
+    np.testing.assert_array_equal(C(2).evaluate_batch(np.zeros(3)), [2, 2, 2])
+
+
+def test_as_function_vectorize():
+    """ Tests as_function(vectorize=True) """
+
+    f = (x ** 2 + 3 * x).as_function(vectorize=True)
+    np.testing.assert_array_equal(f(np.array([1., 2.])), [4., 10.])
+    np.testing.assert_array_equal(f([1, 2]), [4, 10])
+    assert str(f) == 'x ** 2 + 3 * x'
+
+    g = (x ** 2).as_function(vectorize=True, native=True)
+    np.testing.assert_array_equal(g(np.arange(3)), [0, 1, 4])
+    assert g.__name__ == 'x ** 2'
+
+    with pytest.raises(ValueError):
+        x.as_function(vectorize=True, detach=True)
+
+    # the translation is performed once
+    assert get_batch_function(x + 1)(np.arange(2)).tolist() == [1, 2]
+
+
+def test_elementwise():
+    """ Tests that elementwise() makes the logical operators work on arrays and series """
+    from mini_lambda.vars.numpy_ import X
+    from mini_lambda.vars.pandas_ import df
+    import pandas as pd
+
+    mask = (X > 0) & (X < 1) | Not(X == 2)
+    with pytest.raises(ValueError):
+        mask.evaluate(np.array([0.5, 2.]))
+
+    mask = elementwise(mask)
+    assert mask.to_string() == 'logical_or(logical_and(X > 0, X < 1), logical_not(X == 2))'
+    values = np.array([-1., 0.5, 2., 3.])
+    np.testing.assert_array_equal(mask.evaluate(values), [True, True, False, True])
+    np.testing.assert_array_equal(mask.as_function()(values), [True, True, False, True])
+    np.testing.assert_array_equal(mask.evaluate_batch(values), [True, True, False, True])
+
+    # integer arrays use the bitwise operators, as numpy does
+    np.testing.assert_array_equal(elementwise(X & (X - 1)).evaluate(np.array([1, 2, 3])), [0, 0, 2])
+
+    # series
+    frame = pd.DataFrame({'a': [0, 2, 3], 'b': [1, 2, 5]})
+    assert elementwise((df['a'] > 1) & (df['b'] < 3)).evaluate(frame).tolist() == [False, True, False]
+
+    # scalars keep the logical semantics
+    assert elementwise(x & (x - 1)).evaluate(3) is True
+
+
+@pytest.mark.parametrize('chunk_size', [None, 1, 7, 64])
+def test_evaluate_batch_chunks(chunk_size):
+    """ Tests that evaluate_batch gives the same results by chunks and writes them into the provided array """
+    values = np.linspace(-3, 3, 100)
+    for expr in (Sqrt(abs(x)) * Exp(-x) + abs(x - 5) * x, IfElse(x > 0, Log(x + 4), x * 2), In(x, [0., 3.]) | (x > 2),
+                 SafeLog(x + 4) * 2, x, C(2)):
+        expected = expr.evaluate_batch(values, use_numexpr=False)
+        result = expr.evaluate_batch(values, use_numexpr=False, chunk_size=chunk_size)
+        assert result.dtype == expected.dtype
+        np.testing.assert_allclose(result, expected)
+
+        out = np.zeros(values.shape)
+        assert expr.evaluate_batch(values, chunk_size=chunk_size, out=out) is out
+        np.testing.assert_allclose(out, expected)
+
+    # the chunks needing a larger dtype
+    expr = make_lambda_friendly_method(lambda v: v if v < 0 else int(v), 'f')(x) * 2
+    np.testing.assert_array_equal(expr.evaluate_batch(values, chunk_size=chunk_size),
+                                  expr.evaluate_batch(values))
+
+    with pytest.raises(ValueError):
+        x.evaluate_batch(values, chunk_size=chunk_size, out=np.zeros(3))
+
+
+def test_evaluate_batch_chunks_buffers():
+    """ Tests that the scratch buffers are reused from one operation to the next """
+    from mini_lambda.batch import _assign_buffers, _release_results, _is_ufunc_step
+
+    expr = (x + 1) * (x + 2) * (x + 3) * (x + 4)
+    planner = _BatchPlanner()
+    result = planner.plan(expr)
+    _release_results(planner.steps, result)
+    dtypes = {i: ((np.dtype(float), ), np.dtype(float)) for i in range(1, len(planner.steps))
+              if _is_ufunc_step(planner.steps[i])}
+    assignment, buffer_dtypes = _assign_buffers(planner.steps, result.index, dtypes)
+    assert len(planner.steps) - 1 == 8
+    assert buffer_dtypes == [np.dtype(float)] * 2
+
+    with pytest.raises(ValueError):
+        x.evaluate_batch([1, 2], chunk_size=0)
+    with pytest.raises(ValueError):
+        x.evaluate_batch([1, 2], chunk_size=True)
+
+    # chunk sizes computed with numpy
+    np.testing.assert_array_equal((x * 2).evaluate_batch(np.arange(5), use_numexpr=False, chunk_size=np.int64(2)),
+                                  [0, 2, 4, 6, 8])
+
+
+@pytest.mark.parametrize('expr, code', [
+    (3 * x ** 2 + 2 * x - 1, '((3 * (x ** 2)) + (2 * x)) - 1'),
+    (x * (-2) - (-1), '(x * (-2)) - (-1)'),
+    (Between(x, 2, 5) | Not(x), '((2 <= x) & (x <= 5)) | (~(x != 0))'),
+    (IfElse(x > 0, abs(x - 1), Log(x + 10, 2)), 'where((x > 0), where((x - 1) < 0, -(x - 1), (x - 1)), '
+                                                'log(x + 10) / log(2))'),
+    (Sqrt(abs(x)) % 2 // 1, '(sqrt(where(x < 0, -x, x)) % 2) // 1'),
+])
+def test_numexpr(expr, code):
+    """ Tests that the expressions supported by numexpr are evaluated with it, with the same results as numpy """
+    pytest.importorskip('numexpr')
+    from mini_lambda.numexpr_backend import to_numexpr
+
+    assert to_numexpr(expr) == (code, 'x')
+    for values in (np.arange(-5, 5), np.linspace(-5, 5, 20), np.linspace(-5, 5, 20).astype(np.float32)):
+        result = expr.evaluate_batch(values)
+        expected = expr.evaluate_batch(values, use_numexpr=False)
+        assert result.dtype == expected.dtype
+        np.testing.assert_allclose(result, expected, rtol=1e-6)
+
+
+def test_numexpr_unsupported():
+    """ Tests the expressions that numexpr does not evaluate """
+    pytest.importorskip('numexpr')
+    from mini_lambda.numexpr_backend import to_numexpr, get_numexpr_function
+
+    # numexpr does not raise an error for negative integer exponents, nor support non-numeric operations
+    for expr in (2 ** x, x ** C(-1), Floor(x), In(x, [1, 2]), SafeLog(x), s.upper(), 7 // x, 2.0 // x):
+        with pytest.raises(ValueError):
+            to_numexpr(expr)
+        assert get_numexpr_function(expr) is None
+
+    # numexpr only supports the floor division of an array: numpy is used
+    np.testing.assert_array_equal((7 // x).evaluate_batch(np.array([1, 2, 3])), [7, 3, 2])
+    np.testing.assert_array_equal((2.0 // x).evaluate_batch(np.array([1, 2, 3])), [2., 1., 0.])
+
+
+def test_numexpr_compilation_error(monkeypatch):
+    """ Tests that the code that numexpr can not compile is not used """
+    pytest.importorskip('numexpr')
+    from mini_lambda import numexpr_backend
+
+    monkeypatch.setattr(numexpr_backend, 'to_numexpr', lambda expression: ('7 // x', 'x'))
+    assert numexpr_backend.get_numexpr_function(7 // x) is None
+
+    # arrays with other dtypes use numpy
+    expr = x + 200
+    assert expr.evaluate_batch(np.array([100], dtype=np.uint8)).dtype == np.uint8
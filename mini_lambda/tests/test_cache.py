@@ -0,0 +1,147 @@
+from decimal import Decimal
+from threading import Thread
+
+import pytest
+
+from mini_lambda import x, s, Len, C, _, Not, Int
+from mini_lambda.symbols.math_ import Log
+from mini_lambda.cache import CompileCache, compile_cache_info, clear_compile_cache, set_compile_cache_size
+
+
+@pytest.fixture
+def empty_cache():
+    clear_compile_cache()
+    yield
+    clear_compile_cache()
+
+
+def test_compile_cache_shared(empty_cache):
+    """ Tests that structurally identical expressions share one compiled function, through as_function and _ """
+
+    def make_validator():
+        return (Len(s.strip()) > 2) & s.startswith('a')
+
+    f1 = _(make_validator())
+    f2 = make_validator().as_function()
+    assert f1._evaluate is f2._evaluate
+    assert f1('abc') is True and f1(' ab ') is False
+    assert str(f2) == "(len(s.strip()) > 2) & s.startswith('a')"
+
+    info = compile_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+
+    # different constants or operations are not shared
+    f3 = _((Len(s.strip()) > 3) & s.startswith('a'))
+    assert f3._evaluate is not f1._evaluate
+    assert compile_cache_info().misses == 2
+
+    # expressions that are only equal to themselves are compiled but not stored
+    f4 = _(x + [1])
+    assert f4(['a']) == ['a', 1]
+    assert compile_cache_info().currsize == 2
+
+    # the cache can be disabled
+    previous = set_compile_cache_size(0)
+    try:
+        assert _(make_validator())._evaluate is not f1._evaluate
+        assert compile_cache_info().currsize == 0
+    finally:
+        set_compile_cache_size(previous)
+
+
+def test_compile_cache_identity_constants(empty_cache):
+    """ Tests that expressions containing closures or objects hashed by identity are not stored """
+
+    class Foo(object):
+        def __radd__(self, other):
+            return other
+
+    def is_false(v):
+        return not v
+
+    assert _(C(is_false)(x))(0) is True
+    assert _(x + Foo())(1) == 1
+    assert compile_cache_info().currsize == 0
+
+    # functions and classes defined at the top level of a module are shared
+    _(Log(x))
+    _(Int(x))
+    _(Not(x))
+    _(s.contains('a'))
+    assert compile_cache_info().currsize == 4
+    assert _(Not(x))(0) is True and _(s.contains('a'))('ba') is True
+    assert compile_cache_info().hits == 2
+
+
+def test_compile_cache_equal_constants(empty_cache):
+    """ Tests that expressions with equal constants that do not behave the same do not share a compiled function """
+
+    assert str(_(x + Decimal('1.0'))(Decimal(1))) == '2.0'
+    assert str(_(x + Decimal('1.00'))(Decimal(1))) == '2.00'
+
+    assert _(x + (1, ))(()) == (1, )
+    assert _(x + (1.0, ))(()) == (1.0, ) and type(_(x + (1.0, ))(())[0]) is float
+    assert compile_cache_info().hits == 1
+
+
+def test_compile_cache_no_reference(empty_cache):
+    """ Tests that the cache does not keep the expressions alive, and still shares their compiled function """
+
+    import gc
+    import weakref
+
+    expr = (x + 1) * (x + 1)
+    expr_ref = weakref.ref(expr)
+    compiled = _(expr)._evaluate
+    del expr
+    gc.collect()
+    assert expr_ref() is None
+
+    # structurally equal, with or without a shared sub-expression
+    shared = x + 1
+    assert _(shared * shared)._evaluate is compiled
+    assert _((x + 1) * (x + 1))._evaluate is compiled
+    assert _((x + 1) * (x + 2))._evaluate is not compiled
+    assert compile_cache_info().hits == 2
+
+
+def test_compile_cache_lru():
+    """ Tests that the least recently used entries are evicted """
+
+    cache = CompileCache(maxsize=2)
+    f0 = cache.get(x + 0)
+    cache.get(x + 1)
+    assert cache.get(x + 0) is f0
+    cache.get(x + 2)  # evicts x + 1
+    assert cache.get(x + 0) is f0
+    cache.get(x + 1)
+
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions, info.maxsize, info.currsize) == (2, 4, 2, 2, 2)
+
+    cache.resize(1)
+    assert cache.info().evictions == 3
+    cache.clear()
+    assert cache.info() == (0, 0, 0, 1, 0)
+
+
+def test_compile_cache_threads():
+    """ Tests that the cache can be used from several threads """
+
+    cache = CompileCache(maxsize=8)
+    results = []
+
+    def work():
+        for i in range(200):
+            results.append(cache.get(x * (i % 10) + C(1))(2) == 2 * (i % 10) + 1)
+
+    threads = [Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 800 and all(results)
+    info = cache.info()
+    assert info.hits + info.misses == 800
+    assert info.currsize <= 8
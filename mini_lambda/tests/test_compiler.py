@@ -0,0 +1,180 @@
+from functools import reduce
+from operator import add, or_, attrgetter, itemgetter, methodcaller
+
+import pytest
+
+from mini_lambda import InputVar, _, C, Len, Not, And, Or, All_, Any_, Get, Slice, Str, x, s, l, \
+    make_lambda_friendly_method, IfElse, Sum_, Prod_, AllOf, AnyOf, Between
+from mini_lambda.compiler import compile_expression, generate_source, lower_to_operator
+from mini_lambda.symbols.math_ import Log
+
+
+def test_compile_flat_function():
+    """ Tests that an arithmetic expression is compiled into a single flat function with bound constants """
+
+    expr = x ** 2 + 3 * x - 1
+    source, constants = generate_source(expr)
+
+    assert 'return (((x ** _c0) + (_c1 * x)) - _c2)' in source
+    assert constants == [2, 3, 1]
+
+    f = expr.as_function(compile=True)
+    assert f(2) == 9
+    assert str(f) == 'x ** 2 + 3 * x - 1'
+
+
+@pytest.mark.parametrize('expr, inputs', [
+    (-x ** -x, [1, 2.5]),
+    (divmod(x, 3) + divmod(17, x), [2, 5]),
+    (Log(10 ** x, 10), [1.5, 3]),
+    ((2 <= Len(s)) & (Len(s) < 3), ['a', 'ab', 'abcd']),
+    ((Len(s) < 2) | (s.upper() == 'AB'), ['a', 'ab', 'abcd']),
+    ((Len(s) < 2) ^ s.startswith('a'), ['a', 'b', 'ab', 'bc']),
+    (And(Len(s) > 0, s[0] == 'a'), ['a', 'ba']),
+    (Or(Len(s) > 3, s.lower()), ['', 'a', 'ABCD']),
+    (All_(Len(s) > 0, s[0] == 'a', s.upper()), ['', 'a', 'ba']),
+    (Any_(Len(s) > 3, s[0] == 'a', s.count('b') & (s[-1] == 'b')), ['a', 'b', 'bab', 'c']),
+    (IfElse(Len(s) > 1, s[1], IfElse(s == '', None, (s == 'a') | s.isupper())), ['', 'a', 'b', 'B', 'ab']),
+    (Sum_(x, x ** 2, 3) * Prod_(x, -x, 2) + Sum_(x, 0.1, fsum=True), [1, 2.5]),
+    (Sum_(*[x * i for i in range(100)]), [1, -2]),
+    (AllOf(Len(s) > 0, s[0] == 'a', s.upper()) | AnyOf(s == 'b', IfElse(s == '', 'c', s)), ['', 'a', 'ab', 'b']),
+    (Between(Len(s), 1, Len(s.strip()) + 1, inclusive='left') | (s == ''), ['', 'a', ' a ', 'abc']),
+    (Not(s.isupper()), ['a', 'A']),
+    (s.format('yes').split(sep='e'), ['{}!']),
+    (Str.format('{} {}', s, s), ['hello']),
+    (s.is_in(['a', 'b']) | s.contains('c'), ['a', 'c', 'ddd']),
+    (l[0:2] + l[1:], [[1, 2, 3], [1]]),
+    (Get([5, 6, 7], Slice(1, Len(l))), [[0], [0, 0, 0]]),
+    (C(abs)(x) + C(min)(x, 0), [-1, 2]),
+])
+def test_compile_same_results(expr, inputs):
+    """ Tests that the compiled function returns the same results than the expression's evaluation """
+
+    f = compile_expression(expr)
+    for i in inputs:
+        assert f(i) == expr.evaluate(i)
+
+
+def test_compile_short_circuit():
+    """ Tests that the lazy operand of & and | is only evaluated when needed in the compiled function """
+
+    calls = []
+
+    def record(v):
+        calls.append(v)
+        return v
+
+    Record = C(record)
+    f = ((x > 0) & (Record(x) > 1) | Record(x)).as_function(compile=True)
+
+    assert f(2)
+    assert calls == [2]
+    assert not f(0)
+    assert calls == [2, 0]
+
+
+def test_compile_deep_expressions():
+    """ Tests that very deep expressions can be compiled, with their evaluation order preserved """
+
+    deep_sum = reduce(add, [x] * 3000)
+    assert compile_expression(deep_sum)(1) == 3000
+
+    many_clauses = reduce(or_, [x == i for i in range(2000)])
+    f = compile_expression(many_clauses)
+    assert f(1999)
+    assert not f(-1)
+
+    right_deep = x == 0
+    for i in range(1, 300):
+        right_deep = (x == i) | right_deep
+    f = compile_expression(right_deep)
+    assert f(0)
+    assert not f(-1)
+
+
+def test_compile_arg_name():
+    """ Tests that the variable name is used as the argument name of the compiled function when possible """
+
+    assert 'def _compiled(s):' in generate_source(s + 'a')[0]
+    assert 'def _compiled(_x):' in generate_source(InputVar('class') + 1)[0]
+    assert 'def _compiled(_x):' in generate_source(InputVar('_c0') + 1)[0]
+    assert compile_expression(InputVar('_c0') + 1)(1) == 2
+
+
+def test_compile_common_subexpressions():
+    """ Tests that identical sub-expressions are evaluated once per call in the compiled function """
+
+    calls = []
+
+    def strip(v):
+        calls.append(v)
+        return v.strip()
+
+    Strip = C(strip)
+    expr = (Strip(s).lower() == 'a') | (Strip(s).lower() == 'b') | (Len(Strip(s)) > 10)
+    source, _ = generate_source(expr)
+    assert source.count('.lower()') == 1
+
+    f = compile_expression(expr)
+    for i in [' A ', 'b', ' c ']:
+        expected = expr.evaluate(i)
+        del calls[:]
+        assert f(i) == expected
+        assert len(calls) == 1
+
+    # sub-expressions evaluated in a short-circuit branch are not reused outside of it
+    expr = ((Len(s) > 0) & (Strip(s) == 'a')) | (Strip(s) == 'b')
+    f = compile_expression(expr)
+    for i in ['', 'a', 'b', 'c']:
+        assert f(i) == expr.evaluate(i)
+
+
+def test_compile_impure():
+    """ Tests that sub-expressions calling impure functions are neither shared nor folded """
+
+    counter = []
+
+    def count():
+        counter.append(1)
+        return len(counter)
+
+    Count = make_lambda_friendly_method(count, pure=False)
+    constant_expr = Count() * 10
+    assert len(counter) == 0
+    assert constant_expr.evaluate(None) == 10
+    assert constant_expr.evaluate(None) == 20
+
+    f = compile_expression(Count() + x + Count())
+    assert f(0) == 3 + 4
+
+    f = compile_expression(l.pop() - l.pop())
+    assert f([1, 2, 3]) == 1
+
+
+def test_lower_to_operator():
+    """ Tests that simple accesses on the variable are lowered to the callables of the operator module """
+
+    class Obj(object):
+        pass
+
+    record = Obj()
+    record.user = Obj()
+    record.user.name = 'bob'
+
+    d = InputVar('d')
+    for expr, typ, arg, expected in [(x.user.name, attrgetter, record, 'bob'),
+                                     (d['price'], itemgetter, {'price': 3}, 3),
+                                     (l[1:], itemgetter, [1, 2, 3], [2, 3]),
+                                     (s.lower(), methodcaller, 'AB', 'ab'),
+                                     (s.split(',', 1), methodcaller, 'a,b,c', ['a', 'b,c'])]:
+        assert isinstance(lower_to_operator(expr), typ)
+        f = _(expr)
+        assert f(arg) == expected
+        assert str(f) == expr.to_string()
+        assert f.as_expression() is expr
+
+    # other expressions are compiled
+    for expr in [x.user.name.upper(), d[d], s.replace(s, 'a'), s.strip().lower(), Len(s), x]:
+        assert lower_to_operator(expr) is None
+
+    assert sorted(['b', 'A', 'c'], key=_(s.lower())) == ['A', 'b', 'c']
@@ -0,0 +1,72 @@
+import sys
+from functools import reduce
+from operator import add, or_
+
+import pytest
+
+from mini_lambda import x, s, l, C, Len, And, All_, Any_, IfElse, Sum_, AnyOf, Between, make_lambda_friendly_method
+from mini_lambda.base import _MAX_RECURSIVE_DEPTH
+from mini_lambda.evaluator import linearize, run
+
+
+@pytest.mark.parametrize('expr, reference, inputs', [
+    ((x + 1) * 2 - abs(x), lambda v: (v + 1) * 2 - abs(v), [-3, 4]),
+    ((Len(s) < 2) | (s.upper() == 'AB'), lambda v: len(v) < 2 or v.upper() == 'AB', ['a', 'ab', 'abcd']),
+    ((Len(s) < 2) & (s[1] == 'b'), lambda v: len(v) < 2 and v[1] == 'b', ['ab', 'abc', 'bcd']),
+    (All_(Len(s) > 0, s[0] == 'a', s.upper()), lambda v: len(v) > 0 and v[0] == 'a' and v.upper(), ['', 'ba', 'a']),
+    (Any_(Len(s) > 3, s.lower(), s), lambda v: len(v) > 3 or v.lower() or v, ['', 'A', 'abcd']),
+    (IfElse(Len(s) > 1, s[1], IfElse(s == '', None, s * 2)),
+     lambda v: v[1] if len(v) > 1 else (None if v == '' else v * 2), ['', 'a', 'ab']),
+    (s.format('yes').split(sep='e')[0], lambda v: v.format('yes').split(sep='e')[0], ['{}!']),
+    (l[0:2] + l[1:] * 2, lambda v: v[0:2] + v[1:] * 2, [[1, 2, 3], [1]]),
+    (C(max)(x, -x, key=abs) + 1, lambda v: max(v, -v, key=abs) + 1, [-1, 2]),
+    (Sum_(x, x * 2, -x) * 3, lambda v: (v + v * 2 - v) * 3, [1, 2]),
+    (AnyOf(x > 2, x < 0, abs(x) == 1) | (x == 0), lambda v: v > 2 or v < 0 or abs(v) == 1 or v == 0, [-1, 1, 2, 3]),
+    (Between(x * 2, -1, abs(x) + 1, inclusive=False) & (x != 0), lambda v: -1 < v * 2 < abs(v) + 1 and v != 0,
+     [-1, 0, 0.5, 3]),
+])
+def test_iterative_evaluation(expr, reference, inputs):
+    """ Tests that the linearised program returns the same results than the expression """
+
+    program = linearize(expr)
+    for i in inputs:
+        assert run(program, i) == reference(i)
+        assert expr.evaluate(i) == reference(i)
+
+
+def test_deep_expressions():
+    """ Tests that arbitrarily deep expressions can be evaluated without reaching the recursion limit """
+
+    depth = sys.getrecursionlimit() * 3
+
+    deep_sum = reduce(add, [x] * depth)
+    assert deep_sum.evaluate(1) == depth
+
+    deep_or = reduce(or_, [x == i for i in range(depth)])
+    assert deep_or.evaluate(depth - 1) is True
+    assert deep_or.evaluate(-1) is False
+
+    deep_if = x
+    for i in range(depth):
+        deep_if = IfElse(x > i, deep_if + 1, -1)
+    assert deep_if.evaluate(depth) == 2 * depth
+    assert deep_if.evaluate(0) == -1
+
+    # the deepest expressions evaluated through the nested inner functions do not reach the recursion limit either
+    shallow_if = x
+    for i in range(_MAX_RECURSIVE_DEPTH // 3):
+        shallow_if = IfElse(x > i, shallow_if.real + 1, -1)
+    assert _MAX_RECURSIVE_DEPTH - 3 < shallow_if._depth <= _MAX_RECURSIVE_DEPTH
+    assert shallow_if.evaluate(1000) == 1000 + _MAX_RECURSIVE_DEPTH // 3
+
+    # opaque and lazy operands are still evaluated only when needed
+    calls = []
+
+    def record(v):
+        calls.append(v)
+        return v
+
+    Record = make_lambda_friendly_method(record, pure=False)
+    deep_and = reduce(lambda a, b: And(a, b), [Record(x) > i for i in range(depth)])
+    assert deep_and.evaluate(1) is False
+    assert calls == [1, 1]
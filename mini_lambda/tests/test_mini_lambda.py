@@ -2,8 +2,8 @@ import pytest
 import sys
 
 from mini_lambda import InputVar, Len, Str, Int, Repr, Bytes, Sizeof, Hash, Bool, Complex, Float, Oct, Iter, \
-    Any, All, _, Slice, Get, Not, FunctionDefinitionError, Format, C, And, Or, Round, as_function, \
-    is_mini_lambda_expr, x
+    Any, All, _, Slice, Get, Not, FunctionDefinitionError, Format, C, And, Or, All_, Any_, Round, as_function, \
+    is_mini_lambda_expr, x, IfElse, Where, Sum_, Prod_, AllOf, AnyOf, Between, In
 from math import cos
 from numbers import Real
 
@@ -356,6 +356,150 @@ def test_evaluator_logical_or():
     assert r(11)
 
 
+def test_evaluator_logical_short_circuit():
+    """ Object: Tests that And, Or, All_ and Any_ only evaluate the operands that are needed, like and/or """
+
+    s = InputVar('s', str)
+    calls = []
+
+    def expensive(v):
+        calls.append(v)
+        return v.upper()
+
+    Expensive = C(expensive)
+
+    r = And(Len(s) > 0, Expensive(s))
+    assert r.to_string() == 'len(s) > 0 and expensive(s)'
+    assert r.evaluate('') is False
+    assert calls == []
+    assert r.evaluate('a') == 'A'
+    assert calls == ['a']
+
+    r = Or(Len(s) == 0, Expensive(s))
+    assert r.evaluate('') is True
+    assert calls == ['a']
+
+    r = All_(Len(s) > 0, s[0] == 'a', Expensive(s))
+    assert r.to_string() == "len(s) > 0 and s[0] == 'a' and expensive(s)"
+    assert r.evaluate('b') is False
+    assert calls == ['a']
+    assert r.evaluate('ab') == 'AB'
+
+    r = Any_(s == 'a', Len(s) > 2, Expensive(s))
+    assert r.evaluate('abc') is True
+    assert r.evaluate('b') == 'B'
+    assert calls == ['a', 'ab', 'b']
+
+    assert All_() is True
+    assert Any_() is False
+    assert All_(1, 0, 2) == 0
+
+
+def test_evaluator_if_else():
+    """ Object: Tests that IfElse only evaluates the selected branch, and is displayed as a conditional expression """
+
+    x = InputVar('x', int)
+    calls = []
+
+    def lookup(v):
+        calls.append(v)
+        return v * 10
+
+    Lookup = C(lookup)
+
+    r = IfElse(x > 0, x + 1, Lookup(x))
+    assert r.to_string() == 'x + 1 if x > 0 else lookup(x)'
+    assert r.evaluate(1) == 2
+    assert calls == []
+    assert r.evaluate(-1) == -10
+    assert calls == [-1]
+
+    r = Where(x > 0, IfElse(x > 5, 'big', 'small'), IfElse(x < -5, 'neg', 'zero')) + '!'
+    assert r.to_string() == "(('big' if x > 5 else 'small') if x > 0 else 'neg' if x < -5 else 'zero') + '!'"
+    assert [r.evaluate(i) for i in (10, 1, -10, 0)] == ['big!', 'small!', 'neg!', 'zero!']
+
+    assert IfElse(True, 1, 2) == 1
+
+
+def test_evaluator_between():
+    """ Object: Tests that Between creates a chained comparison, where the value is evaluated once """
+
+    x = InputVar('x', float)
+    s = InputVar('s', str)
+
+    r = Between(x, 0, 1)
+    assert r.to_string() == '0 <= x <= 1'
+    assert [r.evaluate(i) for i in (-1, 0, 0.5, 1, 2)] == [False, True, True, True, False]
+    assert [Between(x, 0, 1, inclusive=False).evaluate(i) for i in (0, 0.5, 1)] == [False, True, False]
+    assert [Between(x, 0, 1, inclusive='left').evaluate(i) for i in (0, 1)] == [True, False]
+    assert [Between(x, 0, 1, inclusive='right').evaluate(i) for i in (0, 1)] == [False, True]
+    with pytest.raises(ValueError):
+        Between(x, 0, 1, inclusive='yes')
+
+    calls = []
+
+    def length(v):
+        calls.append(v)
+        return len(v)
+
+    # the value is evaluated once, and the upper bound only if needed
+    r = Between(C(length)(s), 1, C(length)(s.strip()) + 1) | (s == 'z')
+    assert r.to_string() == "(1 <= length(s) <= length(s.strip()) + 1) | (s == 'z')"
+    assert r.evaluate('') is False
+    assert calls == ['']
+    assert r.evaluate(' a ') is False
+    assert calls == ['', ' a ', 'a']
+
+    assert Between(2, 0, 1) is False
+
+
+def test_evaluator_nary():
+    """ Object: Tests that Sum_, Prod_, AllOf and AnyOf create a single flat operation """
+
+    x = InputVar('x', float)
+    s = InputVar('s', str)
+
+    r = Sum_(x, x * 2, 3, -x)
+    assert r.to_string() == 'x + x * 2 + 3 + -x'
+    assert r.evaluate(2) == 7
+    assert (2 - Sum_(x, 1)).to_string() == '2 - (x + 1)'
+
+    r = Prod_(x, x - 1, 2) + 1
+    assert r.to_string() == 'x * (x - 1) * 2 + 1'
+    assert r.evaluate(3) == 13
+
+    r = Sum_(x, 0.1, 0.1, fsum=True)
+    assert r.to_string() == 'fsum([x, 0.1, 0.1])'
+    assert r.evaluate(0.1) == 0.30000000000000004
+
+    # hundreds of operands
+    r = Sum_(*[x * i for i in range(500)])
+    assert r.evaluate(1) == sum(range(500))
+
+    calls = []
+
+    def expensive(v):
+        calls.append(v)
+        return v.isupper()
+
+    r = AllOf(Len(s) > 0, s[0] == 'A', C(expensive)(s))
+    assert r.to_string() == "(len(s) > 0) & (s[0] == 'A') & expensive(s)"
+    assert r.evaluate('a') is False
+    assert calls == []
+    assert r.evaluate('Ab') is False
+    assert r.evaluate('AB') is True
+    assert calls == ['Ab', 'AB']
+
+    r = AnyOf(*[s == str(i) for i in range(500)])
+    assert r.evaluate('499') is True
+    assert r.evaluate('a') is False
+
+    assert Sum_() == 0 and Prod_() == 1 and AllOf() is True and AnyOf() is False
+    assert Sum_(1, 2) == 3 and AllOf(1, 0) is False
+    with pytest.raises(TypeError):
+        Sum_(x, 1, fsm=True)
+
+
 # Object: .__getattr__
 def test_evaluator_attribute():
     """ Object: Tests that obj.foo_field works """
@@ -443,6 +587,32 @@ def test_evaluator_container():
     assert not is_one_in([0, 0, 0])
 
 
+def test_evaluator_membership_hashed():
+    """ Tests that In and is_in look constant lists and tuples up in a set, with a fallback for unhashable items """
+
+    codes = list(range(1000)) + [[1]]
+    for expr in (In(x, codes), x.is_in(codes), In(x, tuple(range(1000))), x.is_in(list(range(1000)))):
+        assert expr.evaluate(999)
+        assert not expr.evaluate(-1)
+        assert not expr.evaluate({})
+
+    # the lists are copied, and still displayed as lists
+    allowed = ['a', 'b']
+    expr = In(x, allowed)
+    allowed.append('c')
+    assert expr.to_string() == "_is_in(x, ['a', 'b'])"
+    assert not expr.evaluate('c')
+
+    # unhashable elements or items
+    assert In(x, [[1], 2]).evaluate([1])
+    assert In(x, [1, 2]).evaluate([1]) is False
+    assert x.is_in([[1], 2]).as_function()([1])
+
+    # is_in creates the same expression as In
+    assert x.is_in([1, 2]).to_string() == "_is_in(x, [1, 2])"
+    assert x.is_in([1, 2]).structurally_equal(In(x, [1, 2]))
+
+
 # Sized Container .__len__,  >> Len
 def test_evaluator_sized():
     """ Sized Container Object: tests that len() raises the appropriate error but that the equivalent Len() works """
@@ -604,6 +774,39 @@ def test_evaluator_print_pow():
     x = InputVar('x', int)
     po = -x ** -x
     assert po.to_string() == '-x ** -x'  # and not -x ** (-x)
+    assert ((x ** 2) ** 3).to_string() == '(x ** 2) ** 3'
+    assert (x ** 2 ** x).to_string() == 'x ** 2 ** x'
+
+
+def test_evaluator_print_associativity():
+    """ Asserts that operands with the same precedence level are surrounded with parenthesis when needed """
+
+    x = InputVar('x', int)
+    assert (x - 1 - 2).to_string() == 'x - 1 - 2'
+    assert (x - (x - 1)).to_string() == 'x - (x - 1)'
+    assert ((x < 1) == (x > 2)).to_string() == '(x < 1) == (x > 2)'
+    assert (round(x, 2) + divmod(x, 3)[0]).to_string() == 'round(x, 2) + divmod(x, 3)[0]'
+
+
+def test_evaluator_lazy_str():
+    """ Asserts that the string representation is only rendered when needed, and that constants can be truncated """
+
+    x = InputVar('x', int)
+    big = list(range(1000))
+    expr = x + C(big) + big
+    assert expr._str_expr is None
+
+    assert expr.to_string(max_constant_length=10) == 'x + [0, 1, 2, ... + [0, 1, 2, ...'
+    assert expr._str_expr is None
+
+    assert expr.to_string() == 'x + %s + %r' % (big, big)
+    assert expr._str_expr is not None
+
+    # very long expressions can be rendered
+    long_sum = x
+    for i in range(5000):
+        long_sum = long_sum + i
+    assert long_sum.to_string().endswith(' + 4998 + 4999')
 
 
 # Type conversion
@@ -832,3 +1035,111 @@ def test_as_function():
     def foo(x):
         pass
     assert as_function(foo) is foo
+
+
+def test_as_function_native():
+    """Tests that `as_function(native=True)` returns a python function, still giving access to the expression"""
+
+    from types import FunctionType
+
+    expr = (x + 1) * 2
+    f = expr.as_function(native=True)
+    assert type(f) is FunctionType
+    assert f.__name__ == '(x + 1) * 2'
+    assert f.as_expression() is expr and f.expression is expr
+    assert list(map(f, [1, 2])) == [4, 6]
+    assert sorted([3, -5, 1], key=expr.as_function(native=True)) == [-5, 1, 3]
+
+    # each call returns a new function, so that their attributes are not shared through the compile cache
+    g = ((x + 1) * 2).as_function(native=True)
+    assert g is not f and g.expression is not expr
+
+    # without compilation
+    h = expr.as_function(compile=False, native=True)
+    assert type(h) is FunctionType and h(1) == 4 and h.__name__ == '(x + 1) * 2'
+
+
+def test_as_function_detach():
+    """Tests that `as_function(detach=True)` does not keep the expression alive"""
+
+    import gc
+    import weakref
+
+    expr = (x + 1) * 2
+    expr_ref = weakref.ref(expr)
+    f = expr.as_function(detach=True)
+    g = expr.as_function(detach=True, native=True)
+    del expr
+    gc.collect()
+    assert expr_ref() is None
+
+    assert f(1) == 4 and g(1) == 4
+    assert str(f) == g.__name__ == '(x + 1) * 2'
+    assert repr(f) == '<LambdaFunction: (x + 1) * 2>'
+    with pytest.raises(ValueError):
+        f.as_expression()
+    assert not hasattr(g, 'as_expression')
+
+    with pytest.raises(ValueError):
+        (x + 1).as_function(compile=False, detach=True)
+
+    # the lazy sub-expressions too deeply nested to be generated in the same function are compiled separately
+    expr = x
+    refs = []
+    for i in range(80):
+        expr = IfElse(x > i, expr, -i)
+        refs.append(weakref.ref(expr))
+    expected = [expr.evaluate(i) for i in (-1, 0, 50, 100)]
+    f = expr.as_function(detach=True)
+    del expr
+    gc.collect()
+    assert all(ref() is None for ref in refs)
+    assert [f(i) for i in (-1, 0, 50, 100)] == expected
+
+
+def test_evaluator_constant_operands():
+    """ Object: Tests that operations give the same results with constant and expression operands """
+
+    x = InputVar('x', float)
+    s = InputVar('s', str)
+    one = x ** 0
+
+    for r, r_expr in [(x + 1, x + one), (1 - x, one - x), (x * 3, x * (one * 3)), (2 ** x, (one * 2) ** x),
+                      (x > 1, x > one), (divmod(x, 2), divmod(x, one * 2)), (-x, -(x * one))]:
+        for i in [-1.5, 2, 4]:
+            assert r.evaluate(i) == r_expr.evaluate(i)
+
+    r = s.replace('a', 'b', 1)
+    r_expr = s.replace(s[0], 'b', 1)
+    assert r.evaluate('aab') == r_expr.evaluate('aab') == 'bab'
+    assert s.split(sep=',').evaluate('a,b') == s.split(sep=s[1]).evaluate('a,b') == ['a', 'b']
+
+
+def test_evaluator_call_arguments():
+    """ Object: Tests the evaluation of calls, for each kind of arguments plan """
+
+    x = InputVar('x', float)
+    s = InputVar('s', str)
+
+    # only the first argument is an expression
+    assert s.startswith('a').evaluate('ab') is True
+    assert s.strip().evaluate(' a ') == 'a'
+    assert s.split(sep=',', maxsplit=1).evaluate('a,b,c') == ['a', 'b,c']
+    assert round(x, 2).evaluate(1.2345) == 1.23
+    assert C(max)(x, 2, key=abs).evaluate(-3) == -3
+    assert C(abs)(x).evaluate(-3) == 3
+
+    # a method called with one expression argument
+    assert s.count(s[0]).evaluate('aab') == 2
+
+    # general case
+    assert s.replace(s[0], s[-1], 1).evaluate('abc') == 'cbc'
+    assert s.split(sep=s[1]).evaluate('a,b') == ['a', 'b']
+    assert C(max)(x, -x, key=abs).evaluate(-3) == -3
+    assert C(min)(2, x).evaluate(3) == 2
+    assert C(str.upper)(s).evaluate('a') == 'A'
+
+    # bound methods added explicitly, with expression arguments
+    assert s.add_bound_method_to_stack('replace', s[0], 'b').evaluate('aab') == 'bbb'
+    with pytest.raises(FunctionDefinitionError):
+        s.add_bound_method_to_stack('replace', x, 'b')
@@ -0,0 +1,279 @@
+from decimal import Decimal
+from functools import reduce
+from operator import add
+
+import gc
+import math
+import random
+
+import pytest
+
+from mini_lambda import x, s, C, ExpressionNode, get_node, walk, NodeVisitor, NodeTransformer, fold_constants, \
+    set_constant_folding, compile_expression, InputVar, StructuralKey, structurally_equal, set_interning, Len, \
+    fuse_comparisons, All_, AllOf, mark_impure, _, Not
+from mini_lambda.symbols.builtins import List
+from mini_lambda.base import NODE_VAR, NODE_CONSTANT, NODE_BINARY_OP, NODE_CALL, NODE_METHOD_CALL, \
+    NODE_GETATTR
+from mini_lambda.base import _INTERNED
+from mini_lambda.nodes import rebuild
+
+
+def test_node_record():
+    """ Tests that expressions hold an immutable node describing their operation """
+
+    expr = x ** 2 + 3
+    node = get_node(expr)
+    assert isinstance(node, ExpressionNode)
+    assert node.kind == NODE_BINARY_OP
+    assert node.symbol == '+'
+    assert node.constants == (3,)
+    assert len(node.children) == 1 and get_node(node.children[0]).symbol == '**'
+    assert node.apply((5, 3), ()) == 8
+
+    with pytest.raises(AttributeError):
+        node.kind = NODE_CALL
+    with pytest.raises(TypeError):
+        node[0] = NODE_CALL
+
+    assert get_node(x).kind == NODE_VAR
+    assert get_node(C(12)).kind == NODE_CONSTANT
+    assert get_node(C(12)).constants == (12,)
+
+    call_node = get_node(s.split(sep=','))
+    assert call_node.kind == NODE_METHOD_CALL
+    assert call_node.symbol == '__call__'
+    assert call_node.kwargs == (('sep', ','),)
+    assert get_node(call_node.args[0]).kind == NODE_GETATTR
+    assert get_node(call_node.args[0]).symbol == 'split'
+    assert call_node.apply(('a,b'.split,), call_node.kwargs) == ['a', 'b']
+
+
+def test_visitor():
+    """ Tests that the visitor dispatches on node kinds, children first and once per sub-expression """
+
+    class SymbolCollector(NodeVisitor):
+        def __init__(self):
+            self.symbols = []
+
+        def visit_binary_op(self, expr, node):
+            self.symbols.append(node.symbol)
+
+        def generic_visit(self, expr, node):
+            self.symbols.append(node.kind)
+
+    shared = x + 1
+    expr = shared * shared - abs(x)
+    assert SymbolCollector().visit(expr).symbols == ['var', '+', '*', 'call', '-']
+
+    # walk is iterative and supports very deep expressions
+    deep_sum = reduce(add, [x] * 3000)
+    assert len(list(walk(deep_sum))) == 3000
+
+
+def test_transformer():
+    """ Tests that the transformer rebuilds the expression bottom-up with the results of the visit methods """
+
+    class SwapOperands(NodeTransformer):
+        def visit_binary_op(self, expr, node):
+            if node.symbol == '-':
+                return rebuild(expr, node.args[::-1])
+            return expr
+
+    new_expr = SwapOperands().transform((x - 1) * 2 + abs(x - 3))
+    assert new_expr.to_string() == '(1 - x) * 2 + abs(3 - x)'
+    assert new_expr.evaluate(5) == -6
+
+    # an unchanged expression is returned as is
+    unchanged = x * 2
+    assert NodeTransformer().transform(unchanged) is unchanged
+
+    # plain values returned by the visit methods are used as constants
+    class ReplaceVar(NodeTransformer):
+        def visit_var(self, expr, node):
+            return 10
+
+    folded = ReplaceVar().transform(x * 2 + 1)
+    assert get_node(folded).kind == NODE_CONSTANT
+    assert folded.evaluate(None) == 21
+
+
+def test_constant_folding():
+    """ Tests that sub-expressions only depending on constants are precomputed, and still displayed as written """
+
+    calls = []
+
+    def two():
+        calls.append(1)
+        return 2
+
+    expr = (C(math.sqrt)(4) * C(3) + 1) * x
+    assert expr.to_string() == '(sqrt(4) * 3 + 1) * x'
+    folded = get_node(expr).args[0]
+    assert get_node(folded).kind == NODE_CONSTANT
+    assert get_node(folded).constants == (7.,)
+    assert get_node(folded).origin.symbol == '+'
+    assert expr.evaluate(2) == 14
+    assert compile_expression(expr)(2) == 14
+
+    # other callables may return a different value at each call: they are not folded
+    expr = (C(two)() * C(3) + 1) * x
+    assert len(calls) == 0
+    assert get_node(get_node(expr).args[0]).kind == NODE_BINARY_OP
+    assert expr.evaluate(2) == 14
+    assert len(calls) == 1
+    randoms = _(C(random.random)() + x)
+    assert randoms(0) != randoms(0)
+
+    # errors are raised at evaluation time, as usual
+    div = C(1) / C(0)
+    assert get_node(div).kind == NODE_BINARY_OP
+    with pytest.raises(ZeroDivisionError):
+        div.evaluate(None)
+
+    # folding can be disabled, and then performed explicitly, including for other callables
+    previous = set_constant_folding(False)
+    try:
+        assert get_node(get_node(C(2) * C(3) * x).args[0]).kind == NODE_BINARY_OP
+    finally:
+        set_constant_folding(previous)
+
+    folded = fold_constants(expr)
+    assert len(calls) == 2
+    assert folded.to_string() == '(two() * 3 + 1) * x'
+    assert get_node(get_node(folded).args[0]).constants == (7,)
+    assert folded.evaluate(2) == 14
+
+
+def test_constant_folding_mutable():
+    """ Tests that the operations returning mutable objects are not folded: each evaluation creates a new one """
+
+    lst, d = [1, 2, 3], {'a': 1}
+    for expr in (C([1]) + C([2]), List(C((1, 2))), C(lst)[0:2], C(d).copy()):
+        assert get_node(expr).kind != NODE_CONSTANT
+        f = _(expr)
+        first = f(0)
+        assert f(0) is not first
+        if isinstance(first, list):
+            first.append(99)
+        else:
+            first['b'] = 2
+        assert f(0) != first
+
+    # immutable results are still folded
+    assert get_node(C((1, )) + C((2, ))).kind == NODE_CONSTANT
+
+
+def test_structural_equality():
+    """ Tests that distinct expressions performing the same operations are structurally equal and hashed equally """
+
+    a = x ** 2 + C(3) * abs(x)
+    b = x ** 2 + C(3) * abs(x)
+    assert a is not b
+    assert a.fingerprint() == b.fingerprint()
+    assert a.structurally_equal(b)
+
+    # the fingerprint is cached
+    assert a._fingerprint is not None and get_node(a).args[0]._fingerprint is not None
+
+    # operands, constants types, symbols and methods are all compared
+    assert not a.structurally_equal(x ** 2 + C(3.0) * abs(x))
+    assert not a.structurally_equal(C(3) * abs(x) + x ** 2)
+    assert not a.structurally_equal(x ** 2 + C(3) * round(x))
+    assert not (x + 1).structurally_equal(InputVar('y') + 1)
+    assert not (x + 1).structurally_equal(x + True)
+    assert not (x + 0.0).structurally_equal(x + -0.0)
+    assert not (x + 1).structurally_equal(1)
+
+    # including the builtin helpers
+    assert Not(x > 1).structurally_equal(Not(x > 1))
+    assert s.contains('a').structurally_equal(s.contains('a'))
+    assert not s.contains('a').structurally_equal(s.contains('b'))
+
+    # unhashable constants are compared by identity
+    lst = [1]
+    assert (x + lst).structurally_equal(x + lst)
+    assert not (x + [1]).structurally_equal(x + [1])
+
+    # as well as the constants that are equal but do not behave the same
+    one = Decimal('1.0')
+    assert (x + one).structurally_equal(x + one)
+    assert not (x + Decimal('1.0')).structurally_equal(x + Decimal('1.00'))
+
+    # tuples and frozensets are compared item by item
+    assert (x + (1, 'a')).structurally_equal(x + (1, 'a'))
+    assert not (x + (1, )).structurally_equal(x + (1.0, ))
+    assert not (x + (0.0, )).structurally_equal(x + (-0.0, ))
+    assert (x - frozenset([1, 2])).structurally_equal(x - frozenset([2, 1]))
+    assert not (x - frozenset([1])).structurally_equal(x - frozenset([True]))
+
+    # usable as dictionary keys and set members, even for deep expressions
+    deep_1, deep_2 = reduce(add, [x] * 3000), reduce(add, [x] * 3000)
+    assert structurally_equal(deep_1, deep_2)
+    assert not structurally_equal(deep_1, deep_2 + 1)
+    rules = {StructuralKey(a): 'a', StructuralKey(deep_1): 'deep'}
+    assert rules[StructuralKey(b)] == 'a'
+    assert rules[StructuralKey(deep_2)] == 'deep'
+    assert len({StructuralKey(e) for e in (a, b, deep_1, deep_2, x + 1)}) == 3
+
+
+def test_interning():
+    """ Tests that when interning is enabled, structurally identical expressions are the same objects """
+
+    assert (x + 1) is not (x + 1)
+
+    previous = set_interning(True)
+    try:
+        a = (Len(s.strip()) > 3) & s.startswith('a')
+        b = (Len(s.strip()) > 3) & s.startswith('a')
+        assert a is b
+        assert a.evaluate('abcd') is True
+        assert a.to_string() == "(len(s.strip()) > 3) & s.startswith('a')"
+
+        assert (x + 1) is (x + 1)
+        assert C(2) is C(2)
+        assert (x + 1) is not (x + True)
+        assert (x + 1) is not (InputVar('x') + 1)
+        assert (x + [1]) is not (x + [1])
+
+        # equal constants that do not behave the same are not merged
+        assert (x * Decimal('1.0')) is not (x * Decimal('1.00'))
+        assert (x * Decimal('1.00')).to_string() == "x * Decimal('1.00')"
+        assert str((x * Decimal('1.00')).evaluate(Decimal(1))) == '1.00'
+        assert (x + (1.0, )) is not (x + (1, ))
+
+        # unused expressions can still be garbage collected
+        nb_interned = len(_INTERNED)
+        deep_sum = reduce(add, [x] * 1000)
+        assert len(_INTERNED) == nb_interned + 999
+        del deep_sum
+        gc.collect()
+        assert len(_INTERNED) <= nb_interned
+    finally:
+        set_interning(previous)
+
+    assert (x + 1) is not (x + 1)
+
+
+def test_fuse_comparisons():
+    """ Tests that conjunctions of comparisons sharing an operand are rewritten into chained comparisons """
+
+    for expr, expected in [((x > 0) & (x < 1), '0 < x < 1'),
+                           ((0 <= x) & (x < 1) & (x != 0.5), '(0 <= x < 1) & (x != 0.5)'),
+                           (All_(Len(s) > 1, Len(s) <= 3, s != 'ab'), "1 < len(s) <= 3 and s != 'ab'"),
+                           (AllOf(x ** 2 >= 1, x ** 2 < 4), '1 <= x ** 2 < 4'),
+                           ((x > 0) | (x < 1), '(x > 0) | (x < 1)'),
+                           ((x > 0) & (x + 1 < 3), '(x > 0) & (x + 1 < 3)')]:
+        fused = fuse_comparisons(expr)
+        assert fused.to_string() == expected
+        for i in [-2, 0, 0.5, 0.7, 1, 1.5, 2]:
+            arg = 'abcd'[:int(i * 2) if i > 0 else 0] if 's' in expected else i
+            assert fused.evaluate(arg) == expr.evaluate(arg)
+            assert compile_expression(fused)(arg) == expr.evaluate(arg)
+
+    # impure shared operands are not fused, since they would be evaluated once instead of twice
+    def rand(v):
+        return v
+
+    mark_impure(rand)
+    Rand = C(rand)
+    assert fuse_comparisons((Rand(x) > 0) & (Rand(x) < 1)).to_string() == '(rand(x) > 0) & (rand(x) < 1)'
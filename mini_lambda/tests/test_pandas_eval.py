@@ -0,0 +1,88 @@
+import pandas as pd
+import pytest
+
+from mini_lambda import In, Not, And, Between, AllOf
+from mini_lambda.vars.pandas_ import df
+from mini_lambda.symbols.math_ import Log, Sqrt
+from mini_lambda.batch import elementwise
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({'a': [1., 2., 3.], 'b': [4, 5, 6], 'my col': [1, 2, 3]})
+
+
+@pytest.mark.parametrize('expr, query, expected', [
+    (df['a'] * 2 + df['b'] > 10, '((a * 2) + b) > 10', [False, False, True]),
+    (-df['a'] ** 2, '-(a ** 2)', [-1., -4., -9.]),
+    ((-df['b']) ** 3 - (-1), '((-b) ** 3) - (-1)', [-63, -124, -215]),
+    (Log(df['a']) + Sqrt(df['b']) > 2.5, '(log(a) + sqrt(b)) > 2.5', [False, True, True]),
+    (Between(df['a'], 1, 2, inclusive='left'), '1 <= a < 2', [True, False, False]),
+    ((df['a'] > 1) & Not(df['my col'] == 3), '(a > 1) & (~(`my col` == 3))', [False, True, False]),
+    (And(df['a'] > 1, df['b'] < 6), '(a > 1) & (b < 6)', [False, True, False]),
+    (AllOf(df['a'] > 0, df['b'] > 4, df['a'] < 3), '(a > 0) & (b > 4) & (a < 3)', [False, True, False]),
+    (In(df['b'], [4, 6]), 'b in [4, 6]', [True, False, True]),
+    (df['b'].is_in((4, 6)), 'b in [4, 6]', [True, False, True]),
+    # the logical operators are bitwise on integers in pandas
+    (Not(df['b'] - 5), '~((b - 5) != 0)', [False, True, False]),
+    (elementwise(Not(df['b'] - 5)), '~((b - 5) != 0)', [False, True, False]),
+    ((df['b'] - 5) | (df['a'] > 2), '((b - 5) != 0) | (a > 2)', [True, False, True]),
+])
+def test_to_pandas_query(frame, expr, query, expected):
+    """ Tests that expressions on data frames are translated to DataFrame.eval strings """
+
+    assert expr.to_pandas_query() == query
+    assert frame.eval(query).tolist() == expected
+    assert expr.as_function(pandas_eval=True)(frame).tolist() == expected
+
+
+def test_to_pandas_query_unsupported(frame):
+    """ Tests that expressions that can not be translated raise a ValueError, and are evaluated without pandas """
+
+    for expr in (df.a + 1, df['a'] + df, (df['a'] > 1) ^ (df['b'] > 1), df['a'] + [1, 2, 3]):
+        with pytest.raises(ValueError):
+            expr.to_pandas_query()
+
+    # pandas returns 0 for the negative powers of integer columns, instead of raising an error
+    for expr in (2 ** -df['b'], df['a'] ** df['b'], df['b'] ** -1):
+        with pytest.raises(ValueError):
+            expr.to_pandas_query()
+    with pytest.raises(ValueError):
+        (2 ** -df['b']).as_function(pandas_eval=True)(frame)
+    assert (2 ** -df['a']).as_function(pandas_eval=True)(frame).tolist() == [0.5, 0.25, 0.125]
+
+    # as_function(pandas_eval=True) falls back to the usual evaluation
+    expr = df.a + 1
+    assert expr.as_function(pandas_eval=True)(frame).tolist() == [2., 3., 4.]
+
+    # DataFrame.eval returns floats for the absolute values of integers
+    expr = abs(df['b'] - 5)
+    with pytest.raises(ValueError):
+        expr.to_pandas_query()
+    result = expr.as_function(pandas_eval=True)(frame)
+    assert result.dtype == 'int64' and result.tolist() == [1, 0, 1]
+    assert abs(df['b'] / 2 - 2.5).to_pandas_query() == 'abs((b / 2) - 2.5)'
+    assert abs(Sqrt(df['b']) - 2).to_pandas_query() == 'abs(sqrt(b) - 2)'
+
+    # DataFrame.eval does not support the unary operators on booleans
+    for expr in (-(df['a'] > 1), +(df['a'] > 1)):
+        with pytest.raises(ValueError):
+            expr.to_pandas_query()
+        assert expr.as_function(pandas_eval=True)(frame).tolist() == expr.as_function()(frame).tolist()
+
+    # including for expressions lowered to operator.attrgetter
+    f = df.shape.as_function(pandas_eval=True, native=True)
+    assert f(frame) == (3, 3)
+    assert f.__name__ == 'df.shape'
+    assert df.shape.as_function(native=True)(frame) == (3, 3)
+
+
+@pytest.mark.parametrize('name', ['inf', 'abs'])
+def test_to_pandas_query_reserved_names(name):
+    """ Tests that the columns named as a constant or a function of DataFrame.eval are not used in queries """
+
+    frame = pd.DataFrame({name: [1., 2., 3.]})
+    expr = df[name] + 1
+    with pytest.raises(ValueError):
+        expr.to_pandas_query()
+    assert expr.as_function(pandas_eval=True)(frame).tolist() == [2., 3., 4.]
@@ -0,0 +1,76 @@
+import pytest
+
+from mini_lambda import x, s, l, Not, simplify
+
+
+@pytest.mark.parametrize('expr, types, expected', [
+    (x + 0, int, 'x'),
+    (0 + x * 1 - 0, int, 'x'),
+    (0 + x * 1 - 0, (int, float), '0 + x'),
+    (x - 0.0 + -0.0, float, 'x'),
+    (x / 1, float, 'x'),
+    (x ** 1, int, 'x'),
+    (-(-x), float, 'x'),
+    (x ** 2, int, 'x * x'),
+    ((x ** 5) % 7, int, 'pow(x, 5, 7)'),
+    (3 * x ** 2 + 2 * x + 1, int, '(3 * x + 2) * x + 1'),
+    (x ** 3 - 2 * x + x * x + 5, int, '((x + 1) * x - 2) * x + 5'),
+    (Not(Not(x > 1)), int, 'x > 1'),
+    (Not(Not(x)), None, 'bool(x)'),
+])
+def test_simplify(expr, types, expected):
+    """ Tests that the rewrites are applied and that they do not change the results """
+
+    simplified = simplify(expr, types=types)
+    assert simplified.to_string() == expected
+    for value in (-3, 0, 1, 2, 7) + ((-0.0, ) if types is float else ()):
+        if types is float:
+            value = float(value)
+        assert simplified.evaluate(value) == expr.evaluate(value)
+        assert repr(simplified.evaluate(value)) == repr(expr.evaluate(value))
+        assert type(simplified.evaluate(value)) is type(expr.evaluate(value))
+        assert simplified.as_function(compile=True)(value) == expr.evaluate(value)
+
+
+@pytest.mark.parametrize('expr, types', [
+    # the result would be an int instead of a float
+    (x + 0.0, int),
+    (x / 1, int),
+    # the types of the variable are unknown or not numbers
+    (x + 0, None),
+    (s + 0, str),
+    (l * 1, list),
+    (-(-x), None),
+    # -0.0 + 0 is 0.0
+    (x + 0, float),
+    (0.0 + x, float),
+    (x - -0.0, float),
+    # the rounding would change for floats
+    (x ** 2, float),
+    (3 * x ** 2 + 2 * x + 1, float),
+    # the modular power is only valid for ints
+    ((x ** 5) % 7, float),
+    # p ** 0 is a float if p is a float
+    ((x + 2.0) ** 0 + x * x, int),
+])
+def test_simplify_guarded(expr, types):
+    """ Tests that the rewrites are not applied when they could change the results """
+
+    assert simplify(expr, types=types).to_string() == expr.to_string()
+
+
+def test_simplify_fast_math():
+    """ Tests that fast_math enables the rewrites for floats """
+
+    expr = 0.5 * x ** 2 - x + 1.5
+    simplified = simplify(expr, types=float, fast_math=True)
+    assert simplified.to_string() == '(0.5 * x - 1) * x + 1.5'
+    assert simplified.evaluate(3.0) == pytest.approx(expr.evaluate(3.0))
+    assert simplify(x ** 2, types=float, fast_math=True).to_string() == 'x * x'
+    assert simplify(x + 0, types=float, fast_math=True).to_string() == 'x'
+
+    # the float zero terms and coefficients are kept, so that the result is still a float
+    for expr in (x * 0.0 + x * x, 1.0 * x * x + 3 + x):
+        simplified = simplify(expr, types=int, fast_math=True)
+        assert type(simplified.evaluate(10 ** 20)) is float
+        assert type(simplified.evaluate(7)) is float